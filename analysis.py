@@ -0,0 +1,174 @@
+import warnings
+
+from nodes import *
+
+# dataflow analysis of a program before it runs. for every command it computes the variables
+# the command may read, those it may write and those it assigns on every path through it
+# (definitely). a read is proven defined when its variable is definitely assigned before it
+# on every path from the start of the program; any other read may find its variable unset,
+# unless the memory given to the run provides it. the variables of those reads are the inputs
+# of the program, so a run whose memory defines all of them needs no check at all.
+# a variable is never unset once set, so along a path the definitely assigned variables only
+# grow, and loops need no fixpoint: at the head of a loop they are the ones on entry.
+
+class CommandSets:
+    __slots__ = ('reads', 'writes', 'defines')
+
+    def __init__(self, reads: frozenset, writes: frozenset, defines: frozenset):
+        self.reads = reads     # variables the command may read
+        self.writes = writes   # variables the command may assign
+        self.defines = defines # variables the command assigns on every path
+
+    def __repr__(self):
+        return f"CommandSets(reads={sorted(self.reads)}, writes={sorted(self.writes)}, defines={sorted(self.defines)})"
+
+
+class UndefinedRead:
+    '''
+    A read that may find its variable unset.
+    '''
+    __slots__ = ('name', 'node')
+
+    def __init__(self, name: str, node: NodeIdentifier):
+        self.name = name
+        self.node = node
+
+    @property
+    def pos(self) -> int:
+        return getattr(self.node, 'pos', -1)
+
+    def __repr__(self):
+        return f"UndefinedRead({self.name!r}, pos={self.pos})"
+
+
+class UndefinedVariableWarning(UserWarning):
+    '''
+    Issued by Dataflow.check for reads that may find their variable unset.
+    '''
+
+
+EMPTY = frozenset()
+
+class Dataflow:
+    '''
+    Read/write sets and definite assignment of a program.
+    sets maps every command node to its CommandSets, sets[ast] being those of the program.
+    undefined_reads lists, in program order, the reads that may find their variable unset
+    when the memory is empty, and inputs holds their variable names.
+    '''
+    def __init__(self, ast: Node):
+        self.ast = ast
+        self.sets = {}
+        self.undefined_reads = []
+        self._command(ast, EMPTY)
+        self.inputs = frozenset(read.name for read in self.undefined_reads)
+        self.unproven = {read.node for read in self.undefined_reads}
+
+    def proven(self, node: NodeIdentifier) -> bool:
+        '''
+        Whether the read is defined on every run, whatever the memory.
+        '''
+        return node not in self.unproven
+
+    def missing_inputs(self, memory) -> set:
+        '''
+        The inputs the memory (a dict or a collection of names) does not define.
+        A run needs no check on any read when this is empty.
+        '''
+        return self.inputs.difference(memory)
+
+    def check(self, memory=(), lines=None, mode: str = 'warn') -> list:
+        '''
+        Return the reads that may find their variable unset when running on memory
+        (a dict or a collection of names). With mode 'warn' they are reported with an
+        UndefinedVariableWarning, with 'error' the first one raises; 'ignore' only returns them.
+        lines is the LineTable used to locate the reads in the source.
+        '''
+        if mode not in ('ignore', 'warn', 'error'):
+            raise ValueError(f"Unknown mode '{mode}', expected 'ignore', 'warn' or 'error'")
+        missing = self.missing_inputs(memory)
+        if not missing:
+            return []
+        reads = [read for read in self.undefined_reads if read.name in missing]
+        if mode == 'error':
+            raise Exception(f"Analysis error: {self.describe(reads[0], lines)}")
+        if mode == 'warn':
+            for read in reads:
+                warnings.warn(self.describe(read, lines), UndefinedVariableWarning, stacklevel=2)
+        return reads
+
+    def describe(self, read: UndefinedRead, lines=None) -> str:
+        message = f"variable '{read.name}' may be read before it is assigned"
+        if read.pos < 0:
+            return message
+        if lines is None:
+            return f"{message} at position {read.pos}"
+        return f"{message} {lines.describe(read.pos)}"
+
+    # --- the pass ---
+
+    def _command(self, node: Node, defined) -> CommandSets:
+        # defined holds the variables definitely assigned when the command starts, it is not modified
+        if isinstance(node, SEQUENCE_NODES):
+            reads = set()
+            writes = set()
+            defines = set()
+            current = set(defined)
+            for command in sequence_commands(node):
+                sets = self._command(command, current)
+                reads |= sets.reads
+                writes |= sets.writes
+                defines |= sets.defines
+                current |= sets.defines
+            sets = CommandSets(frozenset(reads), frozenset(writes), frozenset(defines))
+        elif isinstance(node, NodeAssign):
+            target = frozenset((node.var_name,))
+            sets = CommandSets(self._expression(node.expr, defined), target, target)
+        elif isinstance(node, NodeIf):
+            condition = self._expression(node.condition, defined)
+            then_sets = self._command(node.then_branch, defined)
+            else_sets = self._command(node.else_branch, defined)
+            sets = CommandSets(
+                condition | then_sets.reads | else_sets.reads,
+                then_sets.writes | else_sets.writes,
+                then_sets.defines & else_sets.defines,
+            )
+        elif isinstance(node, NodeWhile):
+            condition = self._expression(node.condition, defined)
+            body_sets = self._command(node.body, defined)
+            # the body may not run at all
+            sets = CommandSets(condition | body_sets.reads, body_sets.writes, EMPTY)
+        elif isinstance(node, NodeSkip):
+            sets = CommandSets(EMPTY, EMPTY, EMPTY)
+        else:
+            raise Exception(f"Analysis error: unsupported node {type(node).__name__}")
+        self.sets[node] = sets
+        return sets
+
+    def _expression(self, node: Node, defined) -> frozenset:
+        # the variables read by the expression; the unproven reads are recorded left to right
+        reads = set()
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, NodeIdentifier):
+                reads.add(node.name)
+                if node.name not in defined:
+                    self.undefined_reads.append(UndefinedRead(node.name, node))
+            elif isinstance(node, NodeNot):
+                pending.append(node.factor)
+            elif isinstance(node, NodeInt64):
+                pending.append(node.expr)
+            elif isinstance(node, (NodePlus, NodeMinus, NodeMultiply, NodeLessEqual, NodeEqual, NodeAnd, NodeOr)):
+                pending.append(node.right)
+                pending.append(node.left)
+            elif not isinstance(node, (NodeInteger, NodeBoolean)):
+                raise Exception(f"Analysis error: unsupported node {type(node).__name__}")
+        return frozenset(reads) if reads else EMPTY
+
+
+def analyze(ast: Node) -> Dataflow:
+    '''
+    Run the dataflow analysis on an AST produced by Parser.parse.
+    '''
+    return Dataflow(ast)
@@ -0,0 +1,57 @@
+class BatchError(Exception):
+    '''
+    Raised by BatchResult.raise_errors when some inputs of a batch failed.
+    '''
+    def __init__(self, errors: dict):
+        self.errors = errors # input index -> exception
+        first = min(errors)
+        super().__init__(
+            f"{len(errors)} input(s) of the batch failed, first at index {first}: "
+            f"{type(errors[first]).__name__}: {errors[first]}"
+        )
+
+
+class BatchResult:
+    '''
+    Outcome of IMPInterpreter.run_batch. memories[i] is the final memory of input i,
+    or None if running it raised; the exception is then in errors[i].
+    '''
+    def __init__(self, memories: list, errors: dict):
+        self.memories = memories
+        self.errors = errors # input index -> exception
+
+    def __len__(self):
+        return len(self.memories)
+
+    def __getitem__(self, index: int):
+        return self.memories[index]
+
+    def __iter__(self):
+        return iter(self.memories)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def raise_errors(self):
+        '''
+        Raise a BatchError if any input failed.
+        '''
+        if self.errors:
+            raise BatchError(self.errors)
+
+    def columns(self, names: list = None) -> dict:
+        '''
+        Return the results column-wise: variable name -> list with one value per input.
+        Failed inputs and variables missing from a memory give None.
+        By default every variable that appears in some result is included.
+        '''
+        if names is None:
+            names = {} # used as an ordered set
+            for memory in self.memories:
+                if memory is not None:
+                    names.update(dict.fromkeys(memory))
+        return {
+            name: [None if memory is None else memory.get(name) for memory in self.memories]
+            for name in names
+        }
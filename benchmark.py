@@ -0,0 +1,369 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+
+from lexer import Lexer, FastLexer
+from parser import Parser
+from nodes import *
+import closure_compiler
+import flat_ast
+import profiler
+import vm
+
+# benchmarks for the IMP front end and the execution backends.
+# run with:
+#   python benchmark.py run [--output results.json] [--repeat 5] [--scale 1.0] [--only tight_loop ...]
+#   python benchmark.py compare baseline.json results.json [--threshold 0.1]
+#   python benchmark.py nested-boolean
+# every synthetic program is generated deterministically from its size, so two runs of the
+# same version measure the same work. rates are computed from the best of `repeat` timings.
+
+FORMAT_VERSION = 1
+
+# --- synthetic programs ---
+
+def long_sequence(n: int) -> str:
+    '''
+    n assignments in one sequence, cycling over 16 variables.
+    '''
+    lines = [f"x{i} := {i}" for i in range(16)]
+    for i in range(n):
+        lines.append(f"x{i % 16} := ((x{(i + 1) % 16} + {i % 97}) - x{(i + 5) % 16})")
+    return ";\n".join(lines)
+
+
+def deep_nesting(depth: int) -> str:
+    '''
+    A loop around ifs nested depth levels deep, each level also doing some work.
+    '''
+    body = "c := (c + 1)"
+    for level in reversed(range(depth)):
+        body = f"if (c <= (i + {level})) then c := (c + 1); {body} else c := (c - 1) end"
+        if level % 2:
+            body = f"{body}; c := (c - 1)"
+    return f"i := 0; c := 0; while (i <= 200) do {body}; i := (i + 1) end"
+
+
+def tight_loop(n: int) -> str:
+    '''
+    A single counting loop with a two-assignment body.
+    '''
+    return f"i := 0; s := 0; while (i <= {n}) do s := (s + i); i := (i + 1) end"
+
+
+def wide_boolean(width: int, iterations: int = 500) -> str:
+    '''
+    A loop whose condition is a chain of width comparisons joined by and/or.
+    Every comparison after the first is true, so the whole chain is evaluated on each test.
+    '''
+    condition = f"(i <= {iterations})"
+    for k in range(width):
+        term = f"(x <= {1000000 + k})"
+        if k % 2:
+            term = f"({term} or (x = {k}))"
+        condition = f"({condition} and {term})"
+    return f"i := 0; x := 1000000; while {condition} do i := (i + 1) end"
+
+
+def huge_integers(digits: int, iterations: int = 200) -> str:
+    '''
+    Multiplications and subtractions of integers digits long, with sizes kept constant.
+    '''
+    a = int(("1234567890" * (digits // 10 + 1))[:digits])
+    b = int(("9876543210" * (digits // 10 + 1))[:digits])
+    return (
+        f"a := {a}; b := {b}; i := 0; "
+        f"while (i <= {iterations}) do p := (a * b); q := (p - a); r := (q - (a * (b - 1))); i := (i + 1) end"
+    )
+
+
+def nested_boolean_condition(depth: int, shape: str = 'balanced') -> str:
+    '''
+    Build a boolean condition nested depth levels deep.
+    shape is 'left' ((... and b) or c), 'right' (a and (b or (...))) or 'balanced' (a full binary tree).
+    '''
+    def leaf(i):
+        return f"(x{i} <= {i})"
+
+    def build(level, counter):
+        if level == 0:
+            counter[0] += 1
+            return leaf(counter[0])
+        op = 'and' if level % 2 else 'or'
+        if shape == 'left':
+            return f"({build(level - 1, counter)} {op} {build(0, counter)})"
+        if shape == 'right':
+            return f"({build(0, counter)} {op} {build(level - 1, counter)})"
+        return f"({build(level - 1, counter)} {op} {build(level - 1, counter)})"
+
+    return build(depth, [0])
+
+
+def nested_boolean_program(depth: int, shape: str = 'balanced') -> str:
+    return f"if {nested_boolean_condition(depth, shape)} then skip else skip end"
+
+
+# name -> (generator, size at scale 1)
+PROGRAMS = {
+    'long_sequence': (long_sequence, 20000),
+    'deep_nesting':  (deep_nesting, 40),
+    'tight_loop':    (tight_loop, 20000),
+    'wide_boolean':  (wide_boolean, 200),
+    'huge_integers': (huge_integers, 2000),
+}
+
+BACKENDS = ('tree', 'closure', 'vm', 'flat')
+
+# --- measuring ---
+
+# a timing calls the function enough times to last at least this long, so that short
+# measurements are not dominated by timer resolution and noise
+MIN_TIME = 0.05
+
+def _time_calls(function, number: int) -> float:
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def best_time(function, repeat: int, min_time: float = MIN_TIME) -> float:
+    '''
+    Best wall time of one call of function, in seconds. The garbage collector is off while timing.
+    '''
+    number = 1
+    elapsed = _time_calls(function, number)
+    while elapsed < min_time:
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+        elapsed = _time_calls(function, number)
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        best = min(best, _time_calls(function, number) / number)
+    return best
+
+
+def time_parse(tokens: list, repeat: int = 3) -> float:
+    '''
+    Best wall time of parsing the token list, in seconds.
+    '''
+    return best_time(lambda: Parser(tokens).parse(), repeat)
+
+
+def count_nodes(ast: Node) -> int:
+    count = 0
+    pending = [ast]
+    while pending:
+        node = pending.pop()
+        count += 1
+        if isinstance(node, NodeBlock):
+            pending.extend(node.commands)
+            continue
+        for name in ('first', 'second', 'left', 'right', 'factor', 'expr', 'condition', 'then_branch',
+                     'else_branch', 'body'):
+            child = getattr(node, name, None)
+            if isinstance(child, Node):
+                pending.append(child)
+    return count
+
+
+def count_steps(ast: Node) -> int:
+    '''
+    Number of node evaluations (sequences excluded) of one run, counted with the profiler.
+    '''
+    program_profiler = profiler.Profiler(ast)
+    program_profiler.run({})
+    return sum(entry.count for entry in program_profiler.entries)
+
+
+def compile_backend(ast: Node, backend: str):
+    if backend == 'tree':
+        return ast.eval
+    if backend == 'closure':
+        return closure_compiler.compile_ast(ast)
+    if backend == 'vm':
+        return vm.compile_ast(ast)
+    return flat_ast.from_ast(ast)
+
+
+def measurement(seconds: float, units: int, unit: str) -> dict:
+    return {'seconds': seconds, 'units': units, 'rate': units / seconds if seconds else None, 'unit': unit}
+
+
+def bench_program(name: str, size: int, repeat: int) -> dict:
+    '''
+    Measure lexing (tokens/s), parsing (nodes/s) and execution on every backend (steps/s) of one program.
+    A measurement that raises is recorded as {'error': ...}.
+    '''
+    generator, _ = PROGRAMS[name]
+    source = generator(size)
+    results = {'size': size, 'chars': len(source)}
+
+    tokens = FastLexer(source).lex()
+    results['lex'] = measurement(best_time(lambda: Lexer(source).lex(), repeat), len(tokens), 'tokens/s')
+    results['lex_fast'] = measurement(best_time(lambda: FastLexer(source).lex(), repeat), len(tokens), 'tokens/s')
+
+    ast = Parser(tokens).parse()
+    results['parse'] = measurement(time_parse(tokens, repeat), count_nodes(ast), 'nodes/s')
+
+    try:
+        steps = count_steps(ast)
+    except Exception as e:
+        steps = None
+        step_error = f"{type(e).__name__}: {e}"
+    for backend in BACKENDS:
+        key = f"eval_{backend}"
+        if steps is None:
+            results[key] = {'error': f"steps not counted, {step_error}"}
+            continue
+        try:
+            program = compile_backend(ast, backend)
+            results[key] = measurement(best_time(lambda: program({}), repeat), steps, 'steps/s')
+        except Exception as e:
+            results[key] = {'error': f"{type(e).__name__}: {e}"}
+    return results
+
+
+def run_suite(repeat: int = 5, scale: float = 1.0, only: list = None) -> dict:
+    benchmarks = {}
+    for name, (_, size) in PROGRAMS.items():
+        if only and name not in only:
+            continue
+        benchmarks[name] = bench_program(name, max(1, int(size * scale)), repeat)
+    return {
+        'format': FORMAT_VERSION,
+        'meta': {
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+            'scale': scale,
+        },
+        'benchmarks': benchmarks,
+    }
+
+
+def print_results(results: dict):
+    print(f"{'benchmark':<16}{'metric':<14}{'seconds':>10}{'rate':>16}  unit")
+    for name, metrics in results['benchmarks'].items():
+        for metric, value in metrics.items():
+            if not isinstance(value, dict):
+                continue
+            if 'error' in value:
+                print(f"{name:<16}{metric:<14}{'':>10}{'':>16}  error: {value['error']}")
+            else:
+                print(f"{name:<16}{metric:<14}{value['seconds']:>10.4f}{value['rate']:>16,.0f}  {value['unit']}")
+
+
+# --- comparing ---
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    '''
+    Compare the rates of two result files. Returns the rows of the comparison as
+    (benchmark, metric, baseline rate, current rate, ratio, status), status being
+    'regression' when the rate dropped by more than threshold, 'improvement' when it rose
+    by more than threshold, 'ok' otherwise, 'missing' when a side has no rate, or
+    'size differs' when the program was generated with another size.
+    '''
+    rows = []
+    for name, metrics in baseline['benchmarks'].items():
+        same_size = current['benchmarks'].get(name, {}).get('size') == metrics.get('size')
+        for metric, old in metrics.items():
+            if not isinstance(old, dict):
+                continue
+            new = current['benchmarks'].get(name, {}).get(metric)
+            old_rate = old.get('rate')
+            new_rate = new.get('rate') if isinstance(new, dict) else None
+            if not old_rate or not new_rate:
+                rows.append((name, metric, old_rate, new_rate, None, 'missing'))
+                continue
+            if not same_size:
+                rows.append((name, metric, old_rate, new_rate, None, 'size differs'))
+                continue
+            ratio = new_rate / old_rate
+            if ratio < 1 - threshold:
+                status = 'regression'
+            elif ratio > 1 + threshold:
+                status = 'improvement'
+            else:
+                status = 'ok'
+            rows.append((name, metric, old_rate, new_rate, ratio, status))
+    return rows
+
+
+def print_comparison(rows: list):
+    print(f"{'benchmark':<16}{'metric':<14}{'baseline':>16}{'current':>16}{'ratio':>8}  status")
+    for name, metric, old_rate, new_rate, ratio, status in rows:
+        old_text = f"{old_rate:,.0f}" if old_rate else '-'
+        new_text = f"{new_rate:,.0f}" if new_rate else '-'
+        ratio_text = f"{ratio:.2f}" if ratio is not None else '-'
+        print(f"{name:<16}{metric:<14}{old_text:>16}{new_text:>16}{ratio_text:>8}  {status}")
+
+
+# --- nested boolean parsing ---
+
+def bench_nested_boolean():
+    '''
+    Parse time of deeply nested boolean conditions. The parser reads every token once,
+    so the time per token should stay flat as the nesting grows.
+    '''
+    print(f"{'shape':<10}{'depth':>6}{'tokens':>9}{'seconds':>10}{'us/token':>10}")
+    for shape, depths in (('left', (25, 50, 100, 200)), ('right', (25, 50, 100, 200)), ('balanced', (6, 8, 10, 12))):
+        for depth in depths:
+            tokens = FastLexer(nested_boolean_program(depth, shape)).lex()
+            seconds = time_parse(tokens)
+            print(f"{shape:<10}{depth:>6}{len(tokens):>9}{seconds:>10.4f}{seconds / len(tokens) * 1e6:>10.2f}")
+
+
+def main(argv: list = None) -> int:
+    arguments = argparse.ArgumentParser(description="IMP interpreter benchmarks")
+    commands = arguments.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="run the benchmark suite")
+    run.add_argument('--output', help="write the results to this JSON file")
+    run.add_argument('--repeat', type=int, default=5, help="timings per measurement, the best is kept")
+    run.add_argument('--scale', type=float, default=1.0, help="multiply the program sizes")
+    run.add_argument('--only', nargs='*', choices=list(PROGRAMS), help="only run these programs")
+
+    compare_command = commands.add_parser('compare', help="compare two result files")
+    compare_command.add_argument('baseline')
+    compare_command.add_argument('current')
+    compare_command.add_argument('--threshold', type=float, default=0.1,
+                                 help="relative rate drop reported as a regression")
+
+    commands.add_parser('nested-boolean', help="parse time of nested boolean conditions")
+
+    args = arguments.parse_args(argv)
+    if args.command == 'run':
+        results = run_suite(args.repeat, args.scale, args.only)
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        rows = compare(baseline, current, args.threshold)
+        print_comparison(rows)
+        regressions = [row for row in rows if row[-1] == 'regression']
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            return 1
+        return 0
+    bench_nested_boolean()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+from nodes import *
+from resolver import UNSET, SlotTable
+
+# closed-form execution of affine counting loops. a loop like
+#     while (i <= n) do s := (s + (2 * i)); i := (i + 1) end
+# runs a number of iterations known when it starts, and every variable it assigns ends with
+# a value given by a formula over the values on entry: the induction variable i moves by a
+# constant step, the bound n is not assigned in the loop, and the other variables are either
+# accumulated (s := (s + e)) or overwritten (t := e) with an e affine in i. such a loop is
+# replaced by an AffineLoop, which computes the final values in constant time when the loop
+# starts. when the values do not allow it (a variable unset or not an int, a budget with too
+# few steps left) it falls back to running the iterations, so the result is always the same.
+
+class Update:
+    '''
+    The effect of an assignment name := ... of the body over the iterations of the loop.
+    The value assigned at an iteration is coefficient * i + constant, i being the value of
+    the induction variable when the iteration starts plus offset. With accumulate, that value
+    is added to (sign 1) or subtracted from (sign -1) the variable instead of replacing it.
+    '''
+    __slots__ = ('name', 'coefficient', 'constant', 'offset', 'accumulate', 'sign')
+
+    def __init__(self, name: str, coefficient: Node, constant: Node, offset: int, accumulate: bool, sign: int = 1):
+        self.name = name
+        self.coefficient = coefficient # expression over invariant variables, None for 0
+        self.constant = constant       # expression over invariant variables, None for 0
+        self.offset = offset
+        self.accumulate = accumulate
+        self.sign = sign
+
+
+class AffineLoop(NodeWhile):
+    '''
+    A while loop recognized as an affine counting loop (see recognize). It runs like the
+    NodeWhile it stands for, so passes and backends that do not know it iterate it; eval,
+    run and frame_runner compute its result in closed form when possible.
+    The loop runs while the induction variable is at most limit (step > 0) or at least
+    limit (step < 0), limit being bound, or bound - 1 / bound + 1 when exclusive.
+    With wrap, the arithmetic of the loop wraps around to 64 bits: the final values are
+    computed exactly and wrapped, which gives the same result as long as the induction
+    variable does not wrap, and the loop is iterated otherwise.
+    '''
+    __slots__ = ('induction', 'step', 'bound', 'exclusive', 'updates', 'wrap', 'bound_names', 'names')
+
+    def __init__(self, loop: NodeWhile, induction: str, step: int, bound: Node, exclusive: bool, updates: list,
+                 wrap: bool = False):
+        super().__init__(loop.condition, loop.body)
+        if hasattr(loop, 'pos'):
+            self.pos = loop.pos
+        self.induction = induction
+        self.step = step
+        self.bound = bound
+        self.exclusive = exclusive
+        self.updates = updates
+        self.wrap = wrap
+        # the variables read to decide whether the loop runs, and all the variables it reads
+        self.bound_names = [induction] + sorted(_variables(bound))
+        names = set(self.bound_names)
+        for update in updates:
+            for expression in (update.coefficient, update.constant):
+                if expression is not None:
+                    names |= _variables(expression)
+            if update.accumulate:
+                names.add(update.name)
+        self.names = sorted(names)
+
+    def eval(self, memory: dict):
+        if not self.run(memory):
+            NodeWhile.eval(self, memory)
+
+    def iterations(self, values: dict) -> int:
+        '''
+        The number of iterations the loop runs, or None if the values it needs are not ints.
+        '''
+        for name in self.bound_names:
+            if type(values.get(name)) is not int:
+                return None
+        start = values[self.induction]
+        limit = self.bound.eval(values)
+        if self.wrap:
+            limit = wrap_int64(limit)
+        step = self.step
+        if step > 0:
+            if self.exclusive:
+                limit -= 1
+            if start > limit:
+                return 0
+        else:
+            if self.exclusive:
+                limit += 1
+            if start < limit:
+                return 0
+        return (limit - start) // step + 1
+
+    def solve(self, values: dict, budget=None) -> dict:
+        '''
+        Return the values of the variables the loop assigns, after running it from values
+        (a dict holding the variables that are set), or None if it has to be iterated.
+        With a budget, the iterations are charged to it; if it does not have them all left,
+        None is returned so the iterations run, and the budget stops them at the right step.
+        '''
+        count = self.iterations(values)
+        if count is None:
+            return None
+        if count == 0:
+            return {}
+        for name in self.names:
+            if type(values.get(name)) is not int:
+                return None
+        start = values[self.induction]
+        step = self.step
+        if self.wrap and not INT64_MIN <= start + count * step <= INT64_MAX:
+            return None
+        if budget is not None and not budget.charge(count):
+            return None
+
+        triangle = count * (count - 1) // 2 # sum of the iteration numbers 0 .. count - 1
+        results = {}
+        for update in self.updates:
+            coefficient = 0 if update.coefficient is None else update.coefficient.eval(values)
+            constant = 0 if update.constant is None else update.constant.eval(values)
+            first = start + update.offset
+            if update.accumulate:
+                total = count * (coefficient * first + constant) + coefficient * step * triangle
+                results[update.name] = values[update.name] + update.sign * total
+            else:
+                results[update.name] = coefficient * (first + (count - 1) * step) + constant
+        results[self.induction] = start + count * step
+        if self.wrap:
+            for name, value in results.items():
+                results[name] = wrap_int64(value)
+        return results
+
+    def run(self, memory: dict, budget=None) -> bool:
+        '''
+        Run the loop in closed form on the memory dict. Returns False, leaving the memory
+        untouched, if it has to be iterated instead.
+        '''
+        results = self.solve(memory, budget)
+        if results is None:
+            return False
+        memory.update(results)
+        return True
+
+    def frame_runner(self, slot_table: SlotTable):
+        '''
+        Return run(frame, budget=None) -> bool, which is run for a frame of slot_table.
+        '''
+        slots = [(name, slot_table.slot(name)) for name in self.names]
+        slot = slot_table.slot
+        solve = self.solve
+
+        def run(frame: list, budget=None) -> bool:
+            values = {}
+            for name, index in slots:
+                value = frame[index]
+                if value is not UNSET:
+                    values[name] = value
+            results = solve(values, budget)
+            if results is None:
+                return False
+            for name, value in results.items():
+                frame[slot(name)] = value
+            return True
+        return run
+
+
+def recognize(loop: NodeWhile) -> AffineLoop:
+    '''
+    Return the AffineLoop computing the loop in closed form, or None if it is not an affine
+    counting loop: its body must only assign variables, each once, the condition must compare
+    the induction variable i (assigned by i := (i + d) or (i - d)) to an expression bound
+    whose variables the loop does not assign, and every other assignment must be t := e or
+    an accumulation t := (t + e), (e + t), (t - e), with e affine in i over unassigned variables.
+    '''
+    body = sequence_commands(loop.body) if isinstance(loop.body, SEQUENCE_NODES) else [loop.body]
+    commands = [command for command in body if not isinstance(command, NodeSkip)]
+    if not all(isinstance(command, NodeAssign) for command in commands):
+        return None
+    written = [command.var_name for command in commands]
+    if len(set(written)) != len(written):
+        return None
+    written = set(written)
+
+    compared = _comparison(loop.condition, written)
+    if compared is None:
+        return None
+    induction, bound, increasing, exclusive = compared
+
+    step = None
+    offset = 0 # the induction variable has moved by offset at the current command
+    updates = []
+    for command in commands:
+        name = command.var_name
+        if name == induction:
+            form = _linear(command.expr, induction, written - {induction})
+            if form is None or not _is_integer(form[0], 1) or not isinstance(form[1], NodeInteger):
+                return None
+            step = form[1].value
+            offset = step
+            continue
+        update = _update(command, induction, written, offset)
+        if update is None:
+            return None
+        updates.append(update)
+    if step is None or step == 0 or (step > 0) != increasing:
+        return None # no induction variable, or one moving away from the bound
+    # the updates before the induction assignment see it unmoved
+    return AffineLoop(loop, induction, step, bound, exclusive, updates)
+
+
+def _comparison(condition: Node, written: set) -> tuple:
+    # (induction name, bound, increasing, exclusive) for i <= b, b <= i, not (b <= i), not (i <= b)
+    negated = isinstance(condition, NodeNot)
+    if negated:
+        condition = condition.factor
+    if not isinstance(condition, NodeLessEqual):
+        return None
+    left, right = condition.left, condition.right
+    if isinstance(left, NodeIdentifier) and left.name in written and not _variables(right) & written:
+        # i <= b runs upwards, not (i <= b), i.e. i > b, downwards
+        return (left.name, right, not negated, negated)
+    if isinstance(right, NodeIdentifier) and right.name in written and not _variables(left) & written:
+        # b <= i runs downwards, not (b <= i), i.e. i < b, upwards
+        return (right.name, left, negated, negated)
+    return None
+
+def _update(command: NodeAssign, induction: str, written: set, offset: int) -> Update:
+    name = command.var_name
+    expr = command.expr
+    others = written - {induction, name}
+    sign = 0
+    if isinstance(expr, NodePlus):
+        if isinstance(expr.left, NodeIdentifier) and expr.left.name == name:
+            sign, term = 1, expr.right
+        elif isinstance(expr.right, NodeIdentifier) and expr.right.name == name:
+            sign, term = 1, expr.left
+    elif isinstance(expr, NodeMinus):
+        if isinstance(expr.left, NodeIdentifier) and expr.left.name == name:
+            sign, term = -1, expr.right
+    if sign:
+        form = _linear(term, induction, others | {name})
+        if form is None:
+            return None
+        return Update(name, form[0], form[1], offset, True, sign)
+    form = _linear(expr, induction, others | {name})
+    if form is None:
+        return None
+    return Update(name, form[0], form[1], offset, False)
+
+def _linear(node: Node, induction: str, assigned: set) -> tuple:
+    # (coefficient, constant) such that node == coefficient * induction + constant, both
+    # expressions over variables not assigned in the loop (None standing for 0); None if
+    # node reads a variable of assigned or is not affine in the induction variable
+    if isinstance(node, NodeIdentifier):
+        if node.name == induction:
+            return (NodeInteger(1), None)
+        if node.name in assigned:
+            return None
+        return (None, node)
+    if isinstance(node, NodeInteger):
+        return (None, node)
+    if isinstance(node, (NodePlus, NodeMinus, NodeMultiply)):
+        left = _linear(node.left, induction, assigned)
+        right = _linear(node.right, induction, assigned)
+        if left is None or right is None:
+            return None
+        if isinstance(node, NodePlus):
+            return (_combine(NodePlus, left[0], right[0]), _combine(NodePlus, left[1], right[1]))
+        if isinstance(node, NodeMinus):
+            return (_combine(NodeMinus, left[0], right[0]), _combine(NodeMinus, left[1], right[1]))
+        # a product stays affine when one side does not depend on the induction variable
+        if left[0] is not None and right[0] is not None:
+            return None
+        factor, other = (right[1], left) if right[0] is None else (left[1], right)
+        if factor is None:
+            return (None, None)
+        return (_combine(NodeMultiply, other[0], factor), _combine(NodeMultiply, other[1], factor))
+    return None
+
+def _combine(kind, left: Node, right: Node) -> Node:
+    # kind(left, right) with None standing for 0, integer constants folded
+    if kind is NodeMultiply:
+        if left is None or right is None:
+            return None
+    elif right is None:
+        return left
+    elif left is None:
+        return right if kind is NodePlus else _combine(NodeMultiply, right, NodeInteger(-1))
+    if isinstance(left, NodeInteger) and isinstance(right, NodeInteger):
+        if kind is NodePlus:
+            return NodeInteger(left.value + right.value)
+        if kind is NodeMinus:
+            return NodeInteger(left.value - right.value)
+        return NodeInteger(left.value * right.value)
+    return kind(left, right)
+
+def _is_integer(node: Node, value: int) -> bool:
+    return isinstance(node, NodeInteger) and node.value == value
+
+def _variables(node: Node) -> set:
+    names = set()
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, NodeIdentifier):
+            names.add(node.name)
+        elif isinstance(node, NodeNot):
+            pending.append(node.factor)
+        elif isinstance(node, (NodePlus, NodeMinus, NodeMultiply, NodeLessEqual, NodeEqual, NodeAnd, NodeOr)):
+            pending.append(node.right)
+            pending.append(node.left)
+    return names
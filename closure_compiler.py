@@ -0,0 +1,353 @@
+from nodes import *
+from resolver import UNSET, SlotTable, resolve_slots
+from analysis import analyze
+from closed_form import AffineLoop
+from limits import Budget, ExecutionLimitExceeded
+
+# the closure compiler turns the AST into pre-bound python closures built from generated code.
+# expressions are inlined into python expressions and commands into python statements, so
+# running the program does no attribute reads or method dispatch on the nodes. only command
+# bodies nested deeper than MAX_INLINE_DEPTH become separate closures called from their parent.
+# the closures take a frame list indexed by the slots of a SlotTable; each one loads the
+# variables it uses into python locals, and stores those it assigns back when it returns
+# or raises, and around calls to other closures.
+# with a budget slot, the frame also holds the run's Budget and every loop iteration is charged to it.
+# the reads given as checked raise if their variable is unset, the others read the local directly.
+# compile_ast only compiles the top-level commands containing loops: straight-line code runs
+# once per run, which costs less on the tree walker than generating and compiling its python
+# source, until it has run COMPILE_AFTER times.
+
+def raise_undefined(name: str):
+    raise undefined_variable(name)
+
+def raise_overflow(value: int):
+    raise int64_overflow(value)
+
+class ClosureCompiler:
+    def __init__(self, slot_table: SlotTable, budget_slot: int = None, checked: set = None):
+        self.slot_table = slot_table
+        self.budget_slot = budget_slot
+        self.checked = checked or set() # identifier nodes whose read is checked
+        self.expression_depth = 0
+        self.used = set()    # slots read or assigned by the function being generated
+        self.written = set() # slots assigned by it
+        self.commands = (NodeSequence, NodeBlock, NodeSkip, NodeAssign, NodeIf, NodeWhile)
+        self.expressions = {
+            NodeIdentifier: self._identifier_source,
+            NodeInteger:    self._constant_source,
+            NodeBoolean:    self._constant_source,
+            NodePlus:       lambda node, env: self._binary_source(node, '+', env),
+            NodeMinus:      lambda node, env: self._binary_source(node, '-', env),
+            NodeMultiply:   lambda node, env: self._binary_source(node, '*', env),
+            NodeLessEqual:  lambda node, env: self._binary_source(node, '<=', env),
+            NodeEqual:      lambda node, env: self._binary_source(node, '==', env),
+            NodeAnd:        lambda node, env: self._binary_source(node, 'and', env),
+            NodeOr:         lambda node, env: self._binary_source(node, 'or', env),
+            NodeNot:        self._not_source,
+            NodeInt64:      self._int64_source,
+        }
+
+    def compile(self, node: Node):
+        '''
+        Compile the AST rooted at node into a closure taking the frame.
+        Commands return None, expressions return their value.
+        '''
+        if isinstance(node, self.commands):
+            return self._compile_command(node)
+        env = {}
+        saved = self.used, self.written
+        self.used, self.written = set(), set()
+        source = self._expression_source(node, env)
+        lines = [f"    v{slot} = frame[{slot}]" for slot in sorted(self.used)]
+        self.used, self.written = saved
+        exec("def run_expression(frame):\n" + "\n".join(lines + [f"    return {source}"]), env)
+        return env['run_expression']
+
+    # --- expressions: generated python source, objects that have no literal bound in env ---
+
+    # python limits nested parentheses, so deeper sub-expressions become separate closures
+    MAX_EXPRESSION_DEPTH = 50
+
+    def _expression_source(self, node: Node, env: dict) -> str:
+        handler = self.expressions.get(type(node))
+        if handler is None:
+            raise Exception(f"Closure compiler error: unsupported node {type(node).__name__}")
+        if self.expression_depth >= self.MAX_EXPRESSION_DEPTH:
+            # a function of the variables the sub-expression reads
+            depth, used = self.expression_depth, self.used
+            self.expression_depth, self.used = 0, set()
+            nested_env = {}
+            source = self._expression_source(node, nested_env)
+            parameters = ", ".join(f"v{slot}" for slot in sorted(self.used))
+            exec(f"def run_expression({parameters}):\n    return {source}", nested_env)
+            used |= self.used
+            self.expression_depth, self.used = depth, used
+            return f"{self._bind(nested_env['run_expression'], env)}({parameters})"
+        self.expression_depth += 1
+        try:
+            return handler(node, env)
+        finally:
+            self.expression_depth -= 1
+
+    def _bind(self, value, env: dict) -> str:
+        name = f"_c{len(env)}"
+        env[name] = value
+        return name
+
+    def _identifier_source(self, node: NodeIdentifier, env: dict) -> str:
+        # a variable missing from memory holds UNSET in the frame
+        slot = self.slot_table.slot(node.name)
+        self.used.add(slot)
+        if node not in self.checked:
+            return f"v{slot}"
+        env['_unset'] = UNSET
+        env['_undefined'] = raise_undefined
+        return f"(v{slot} if v{slot} is not _unset else _undefined({node.name!r}))"
+
+    def _constant_source(self, node: Node, env: dict) -> str:
+        # ints and bools are emitted as literals
+        return repr(node.value)
+
+    def _binary_source(self, node: Node, op: str, env: dict) -> str:
+        left = self._expression_source(node.left, env)
+        right = self._expression_source(node.right, env)
+        return f"({left} {op} {right})"
+
+    def _not_source(self, node: NodeNot, env: dict) -> str:
+        return f"(not {self._expression_source(node.factor, env)})"
+
+    def _int64_source(self, node: NodeInt64, env: dict) -> str:
+        expr = self._expression_source(node.expr, env)
+        if not node.trap:
+            return f"((({expr} + {-INT64_MIN}) & {2 ** 64 - 1}) - {-INT64_MIN})"
+        # the value is kept in a local, assigned after the nested ones are read
+        env['_overflow'] = raise_overflow
+        return f"(_v if {INT64_MIN} <= (_v := {expr}) <= {INT64_MAX} else _overflow(_v))"
+
+    # --- commands: generated python statements, nested bodies inlined up to a depth ---
+
+    # python limits statically nested blocks, so deeper bodies become separate closures
+    MAX_INLINE_DEPTH = 10
+
+    # placeholders in the generated lines, replaced once the function's locals are known:
+    # the assigned locals are stored to the frame before a call, and all are loaded after it
+    STORE = 'store'
+    LOAD = 'load'
+
+    def _compile_command(self, node: Node):
+        env = {}
+        saved = self.used, self.written
+        self.used, self.written = set(), set()
+        body = self._command_source(node, env, 2)
+        used, written = sorted(self.used), sorted(self.written)
+        self.used, self.written = saved
+
+        def expand(lines: list) -> list:
+            expanded = []
+            for line in lines:
+                if isinstance(line, tuple):
+                    indent, sync = line
+                    if sync == self.STORE:
+                        expanded.extend(f"{indent}frame[{slot}] = v{slot}" for slot in written)
+                    else:
+                        expanded.extend(f"{indent}v{slot} = frame[{slot}]" for slot in used)
+                else:
+                    expanded.append(line)
+            return expanded
+
+        lines = [f"    v{slot} = frame[{slot}]" for slot in used]
+        if self.budget_slot is not None:
+            # the countdown is a local of each function, synced with the budget around calls
+            lines += [f"    budget = frame[{self.budget_slot}]", "    remaining = budget.remaining"]
+        lines += ["    try:"] + expand(body) + ["    finally:"]
+        lines += [f"        frame[{slot}] = v{slot}" for slot in written]
+        if self.budget_slot is not None:
+            lines.append("        budget.remaining = remaining")
+        else:
+            lines.append("        pass")
+        exec("def run_command(frame):\n" + "\n".join(lines), env)
+        return env['run_command']
+
+    def _call_source(self, call: str, indent: str) -> list:
+        # a call to a closure running on the frame; the locals are loaded again even if
+        # it raises, so that they are not stored over what it assigned
+        lines = [(indent, self.STORE)]
+        if self.budget_slot is not None:
+            lines.append(f"{indent}budget.remaining = remaining")
+        lines += [f"{indent}try:", f"{indent}    {call}", f"{indent}finally:", (indent + "    ", self.LOAD)]
+        if self.budget_slot is not None:
+            lines.append(f"{indent}    remaining = budget.remaining")
+        else:
+            lines.append(f"{indent}    pass")
+        return lines
+
+    def _command_source(self, node: Node, env: dict, depth: int) -> list:
+        indent = "    " * depth
+        if depth > self.MAX_INLINE_DEPTH + 1: # the body of a function sits in a try block
+            command = self._bind(self._compile_command(node), env)
+            # the called function may read and assign any variable
+            self.used.update(range(len(self.slot_table)))
+            self.written.update(range(len(self.slot_table)))
+            return self._call_source(f"{command}(frame)", indent)
+
+        if isinstance(node, SEQUENCE_NODES):
+            # the commands of the sequence become consecutive statements
+            lines = []
+            for command in sequence_commands(node):
+                lines.extend(self._command_source(command, env, depth))
+            return lines
+
+        if isinstance(node, NodeSkip):
+            return [f"{indent}pass"]
+
+        if isinstance(node, NodeAssign):
+            expr = self._expression_source(node.expr, env)
+            slot = self.slot_table.slot(node.var_name)
+            self.used.add(slot)
+            self.written.add(slot)
+            return [f"{indent}v{slot} = {expr}"]
+
+        if isinstance(node, NodeIf):
+            condition = self._expression_source(node.condition, env)
+            return (
+                [f"{indent}if {condition}:"]
+                + self._command_source(node.then_branch, env, depth + 1)
+                + [f"{indent}else:"]
+                + self._command_source(node.else_branch, env, depth + 1)
+            )
+
+        if isinstance(node, AffineLoop):
+            # the loop runs in closed form when it can, and is iterated otherwise
+            run = self._bind(node.frame_runner(self.slot_table), env)
+            loop = self._command_source(NodeWhile(node.condition, node.body), env, depth + 1)
+            slots = self.slot_table.slots
+            self.used.update(slots[name] for name in node.names)
+            self.written.update(slots[name] for name in node.names)
+            if self.budget_slot is None:
+                call = self._call_source(f"accelerated = {run}(frame)", indent)
+            else:
+                call = self._call_source(f"accelerated = {run}(frame, budget)", indent)
+            return call + [f"{indent}if not accelerated:"] + loop
+
+        if isinstance(node, NodeWhile):
+            condition = self._expression_source(node.condition, env)
+            lines = [f"{indent}while {condition}:"]
+            if self.budget_slot is not None:
+                # inlined Budget.tick
+                lines += [
+                    f"{indent}    remaining -= 1",
+                    f"{indent}    if remaining < 0:",
+                    f"{indent}        budget.remaining = remaining",
+                    f"{indent}        budget.check()",
+                    f"{indent}        remaining = budget.remaining",
+                ]
+            return lines + self._command_source(node.body, env, depth + 1)
+
+        raise Exception(f"Closure compiler error: unsupported node {type(node).__name__}")
+
+
+# the number of runs of a straight-line part of the program on the tree walker before it is compiled
+COMPILE_AFTER = 2
+
+class Segment:
+    '''
+    Consecutive top-level commands of a program, run on a memory dict. The commands are
+    compiled on a frame of their own variables, at once if they contain a loop, otherwise
+    after running COMPILE_AFTER times on the tree walker.
+    '''
+    def __init__(self, commands: list, budgeted: bool):
+        self.ast = commands[0] if len(commands) == 1 else NodeBlock(commands)
+        self.budgeted = budgeted
+        self.runs = 0
+        self.program = None
+        if any(_has_loop(command) for command in commands):
+            self.program = self._compile()
+
+    def _compile(self):
+        ast = self.ast
+        slot_table = resolve_slots(ast)
+        dataflow = analyze(ast)
+        input_slots = [slot_table.slot(name) for name in sorted(dataflow.inputs)]
+        # the budget sits in the frame right after the variables
+        budget_slot = len(slot_table) if self.budgeted else None
+        program = ClosureCompiler(slot_table, budget_slot).compile(ast)
+        checked_program = [] # compiled on first use
+
+        def run(memory: dict, budget: Budget = None):
+            frame = slot_table.load(memory)
+            if budget_slot is not None:
+                frame.append(budget)
+            # with every input set, no read can find its variable unset; otherwise run the
+            # version of the program that checks the reads the analysis could not prove
+            selected = program
+            for slot in input_slots:
+                if frame[slot] is UNSET:
+                    if not checked_program:
+                        checked_program.append(ClosureCompiler(slot_table, budget_slot, dataflow.unproven).compile(ast))
+                    selected = checked_program[0]
+                    break
+            try:
+                selected(frame)
+            finally:
+                slot_table.store(frame, memory)
+        return run
+
+    def run(self, memory: dict, budget: Budget = None):
+        if self.program is None:
+            self.runs += 1
+            if self.runs < COMPILE_AFTER:
+                self.ast.eval(memory) # no loop, so no steps to charge
+                return
+            self.program = self._compile()
+        self.program(memory, budget)
+
+
+def compile_ast(ast: Node, budgeted: bool = False):
+    '''
+    Compile an AST produced by Parser.parse into a closure taking the memory dict.
+    The top-level commands are split in segments (see Segment), which run in order.
+    With budgeted, the closure takes the memory dict and a limits.Budget.
+    '''
+    commands = sequence_commands(ast) if isinstance(ast, SEQUENCE_NODES) else [ast]
+    segments = []
+    straight = [] # the commands since the last loop
+    for command in commands:
+        if _has_loop(command):
+            if straight:
+                segments.append(Segment(straight, budgeted))
+                straight = []
+            segments.append(Segment([command], budgeted))
+        else:
+            straight.append(command)
+    if straight:
+        segments.append(Segment(straight, budgeted))
+    runs = [segment.run for segment in segments]
+
+    if not budgeted:
+        def run_program(memory: dict):
+            for run in runs:
+                run(memory)
+        return run_program
+
+    def run_budgeted_program(memory: dict, budget: Budget):
+        try:
+            for run in runs:
+                run(memory, budget)
+        except ExecutionLimitExceeded as e:
+            e.memory = memory
+            raise
+    return run_budgeted_program
+
+
+def _has_loop(node: Node) -> bool:
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, NodeWhile):
+            return True
+        if isinstance(node, SEQUENCE_NODES):
+            pending.extend(sequence_commands(node))
+        elif isinstance(node, NodeIf):
+            pending.append(node.then_branch)
+            pending.append(node.else_branch)
+    return False
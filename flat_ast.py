@@ -0,0 +1,243 @@
+from array import array
+
+from nodes import *
+from resolver import UNSET, SlotTable, resolve_slots
+from analysis import analyze
+from closed_form import AffineLoop
+from limits import Budget, ExecutionLimitExceeded
+
+# struct-of-arrays form of the AST: node i is described by kinds[i] and the operands
+# first[i], second[i], third[i] stored in parallel arrays, instead of by a python object.
+# operands are node indices, variable slots or constant indices depending on the kind.
+# a chain of sequences is stored as one BLOCK whose commands are listed in `children`.
+
+# node kinds
+SKIP       = 0   #
+BLOCK      = 1   # children[first : first + second]
+ASSIGN     = 2   # slot first := expression second
+IF         = 3   # if condition first then second else third
+WHILE      = 4   # while condition first do second
+VAR        = 5   # variable in slot first
+CONST      = 6   # constants[first]
+PLUS       = 7   # first + second
+MINUS      = 8   # first - second
+MULTIPLY   = 9   # first * second
+LESS_EQUAL = 10  # first <= second
+EQUAL      = 11  # first == second
+AND        = 12  # first and second
+OR         = 13  # first or second
+NOT        = 14  # not first
+CHECKED_VAR = 15 # variable in slot first, raising if it is unset (only in checked kinds)
+AFFINE_WHILE = 16 # while condition first do second, unless loops[third] runs it in closed form
+WRAP       = 17  # first wrapped around to 64 bits
+TRAP       = 18  # first, raising if it does not fit in 64 bits
+
+BINARY_KINDS = {
+    NodePlus: PLUS, NodeMinus: MINUS, NodeMultiply: MULTIPLY,
+    NodeLessEqual: LESS_EQUAL, NodeEqual: EQUAL, NodeAnd: AND, NodeOr: OR,
+}
+
+
+class FlatAST:
+    def __init__(self, slot_table: SlotTable):
+        self.slot_table = slot_table
+        self.kinds = array('B')
+        self.first = array('i')
+        self.second = array('i')
+        self.third = array('i')
+        self.children = array('i') # commands of the blocks
+        self.constants = []
+        self.loops = [] # runners of the closed-form loops (see closed_form)
+        self.root = -1
+        # VAR nodes whose read may find the variable unset; they become CHECKED_VAR in the
+        # kinds used when the memory does not set every input slot
+        self.unproven = array('i')
+        self.input_slots = []
+        self.checked_kinds = None # built on first use
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __call__(self, memory: dict):
+        self.execute(memory)
+
+    def nbytes(self) -> int:
+        '''
+        Size of the node arrays in bytes (constants and variable names not included).
+        '''
+        return sum(a.itemsize * len(a) for a in (self.kinds, self.first, self.second, self.third, self.children))
+
+    def add(self, kind: int, first: int = 0, second: int = 0, third: int = 0) -> int:
+        self.kinds.append(kind)
+        self.first.append(first)
+        self.second.append(second)
+        self.third.append(third)
+        return len(self.kinds) - 1
+
+    def execute(self, memory: dict, budget: Budget = None):
+        '''
+        Run the program on the memory dict, which is updated in place.
+        With a budget, every loop iteration is charged to it.
+        '''
+        frame = self.slot_table.load(memory)
+        kinds = self.kinds
+        for slot in self.input_slots:
+            if frame[slot] is UNSET:
+                kinds = self._checked_kinds()
+                break
+        try:
+            self._evaluator(frame, budget, kinds)(self.root)
+        except ExecutionLimitExceeded as e:
+            self.slot_table.store(frame, memory)
+            e.memory = memory
+            raise
+        self.slot_table.store(frame, memory)
+
+    def _checked_kinds(self) -> array:
+        if self.checked_kinds is None:
+            kinds = array('B', self.kinds)
+            for i in self.unproven:
+                kinds[i] = CHECKED_VAR
+            self.checked_kinds = kinds
+        return self.checked_kinds
+
+    def _evaluator(self, frame: list, budget: Budget = None, kinds: array = None):
+        # the arrays are walked directly; they are bound to locals of the closures for speed
+        kinds = self.kinds if kinds is None else kinds
+        first, second, third = self.first, self.second, self.third
+        children, constants = self.children, self.constants
+        names = self.slot_table.names
+        loops = self.loops
+
+        def expression(i):
+            kind = kinds[i]
+            if kind == VAR:
+                return frame[first[i]]
+            if kind == CONST:
+                return constants[first[i]]
+            if kind == PLUS:
+                return expression(first[i]) + expression(second[i])
+            if kind == MINUS:
+                return expression(first[i]) - expression(second[i])
+            if kind == MULTIPLY:
+                return expression(first[i]) * expression(second[i])
+            if kind == LESS_EQUAL:
+                return expression(first[i]) <= expression(second[i])
+            if kind == EQUAL:
+                return expression(first[i]) == expression(second[i])
+            if kind == AND:
+                return expression(first[i]) and expression(second[i])
+            if kind == OR:
+                return expression(first[i]) or expression(second[i])
+            if kind == NOT:
+                return not expression(first[i])
+            if kind == WRAP:
+                value = expression(first[i])
+                return value if INT64_MIN <= value <= INT64_MAX else wrap_int64(value)
+            if kind == TRAP:
+                value = expression(first[i])
+                if not INT64_MIN <= value <= INT64_MAX:
+                    raise int64_overflow(value)
+                return value
+            if kind == CHECKED_VAR:
+                value = frame[first[i]]
+                if value is UNSET:
+                    raise undefined_variable(names[first[i]])
+                return value
+            raise Exception(f"Flat AST error: node {i} of kind {kind} is not an expression")
+
+        def loop(condition, body):
+            if budget is None:
+                while expression(condition):
+                    command(body)
+            else:
+                while expression(condition):
+                    budget.remaining -= 1
+                    if budget.remaining < 0:
+                        budget.check()
+                    command(body)
+
+        def command(i):
+            kind = kinds[i]
+            if kind == ASSIGN:
+                frame[first[i]] = expression(second[i])
+            elif kind == BLOCK:
+                start = first[i]
+                for j in range(start, start + second[i]):
+                    command(children[j])
+            elif kind == WHILE:
+                loop(first[i], second[i])
+            elif kind == IF:
+                if expression(first[i]):
+                    command(second[i])
+                else:
+                    command(third[i])
+            elif kind == AFFINE_WHILE:
+                if not loops[third[i]](frame, budget):
+                    loop(first[i], second[i])
+            elif kind != SKIP:
+                raise Exception(f"Flat AST error: node {i} of kind {kind} is not a command")
+
+        return command
+
+
+class FlatASTBuilder:
+    def __init__(self, slot_table: SlotTable, unproven: set = None):
+        self.flat = FlatAST(slot_table)
+        self.constant_indices = {}
+        self.unproven = unproven or set() # identifier nodes whose read may find the variable unset
+
+    def build(self, ast: Node) -> FlatAST:
+        self.flat.root = self._node(ast)
+        return self.flat
+
+    def _constant(self, value) -> int:
+        key = (type(value), value) # keep True and 1 apart
+        if key not in self.constant_indices:
+            self.constant_indices[key] = len(self.flat.constants)
+            self.flat.constants.append(value)
+        return self.constant_indices[key]
+
+    def _node(self, node: Node) -> int:
+        flat = self.flat
+        kind = BINARY_KINDS.get(type(node))
+        if kind is not None:
+            return flat.add(kind, self._node(node.left), self._node(node.right))
+        if isinstance(node, NodeIdentifier):
+            index = flat.add(VAR, flat.slot_table.slot(node.name))
+            if node in self.unproven:
+                flat.unproven.append(index)
+            return index
+        if isinstance(node, (NodeInteger, NodeBoolean)):
+            return flat.add(CONST, self._constant(node.value))
+        if isinstance(node, NodeNot):
+            return flat.add(NOT, self._node(node.factor))
+        if isinstance(node, NodeInt64):
+            return flat.add(TRAP if node.trap else WRAP, self._node(node.expr))
+        if isinstance(node, NodeSkip):
+            return flat.add(SKIP)
+        if isinstance(node, NodeAssign):
+            return flat.add(ASSIGN, flat.slot_table.slot(node.var_name), self._node(node.expr))
+        if isinstance(node, NodeIf):
+            return flat.add(IF, self._node(node.condition), self._node(node.then_branch), self._node(node.else_branch))
+        if isinstance(node, AffineLoop):
+            flat.loops.append(node.frame_runner(flat.slot_table))
+            return flat.add(AFFINE_WHILE, self._node(node.condition), self._node(node.body), len(flat.loops) - 1)
+        if isinstance(node, NodeWhile):
+            return flat.add(WHILE, self._node(node.condition), self._node(node.body))
+        if isinstance(node, SEQUENCE_NODES):
+            commands = [self._node(command) for command in sequence_commands(node)]
+            start = len(flat.children)
+            flat.children.extend(commands)
+            return flat.add(BLOCK, start, len(commands))
+        raise Exception(f"Flat AST error: unsupported node {type(node).__name__}")
+
+
+def from_ast(ast: Node) -> FlatAST:
+    '''
+    Convert an AST produced by Parser.parse into its struct-of-arrays form.
+    '''
+    dataflow = analyze(ast)
+    flat = FlatASTBuilder(resolve_slots(ast), dataflow.unproven).build(ast)
+    flat.input_slots = [flat.slot_table.slot(name) for name in sorted(dataflow.inputs)]
+    return flat
@@ -1,19 +1,374 @@
 import lexer
 import parser
+import closure_compiler
+import vm
+import flat_ast
+import optimizer
+import vectorized
+import limits
+import profiler
+import tracing
+import incremental
+import analysis
+import memoize
+from nodes import INT64_MIN, INT64_MAX
+from parse_cache import ParseCache
+from batch import BatchResult
 
 class IMPInterpreter:
-    def __init__(self, input_text: str):
+    # available execution backends:
+    #   'tree'    - walk the AST with Node.eval
+    #   'closure' - run the AST compiled to python closures
+    #   'vm'      - run the AST compiled to bytecode on the register vm
+    #   'flat'    - walk the struct-of-arrays form of the AST
+    BACKENDS = ('tree', 'closure', 'vm', 'flat')
+
+    def __init__(self, input_text, backend: str = 'tree', fast_lexer: bool = True, cache: ParseCache = None,
+                 optimize: bool = False, trace=None, undefined: str = 'ignore', memo: memoize.RegionMemo = None,
+                 integers: str = 'unbounded'):
+        '''
+        input_text is the program source. Besides a str it can be a file object, a memory-mapped
+        file or an iterable of text chunks, which are lexed and parsed as a stream without
+        materializing the token list (self.tokens is None then).
+        With a ParseCache, a str source that was parsed before reuses the cached AST and
+        compiled programs instead of being lexed and parsed again.
+        With optimize, constants are folded, dead branches removed, affine counting loops
+        computed in closed form and loop invariants hoisted before execution (self.ast stays
+        the parsed tree, see optimizer and closed_form); the temporaries of the loop optimizer
+        are removed from the memory after a run.
+        self.lines maps the source offsets stored in tokens and nodes to lines and columns.
+        trace is a hook receiving the lexer, parser and evaluation events (see tracing); a run
+        with a hook walks the AST, whatever the backend.
+        undefined decides what happens, before running, to a memory that lacks variables the
+        program may read before assigning them (see dataflow): 'ignore' runs it anyway, and the
+        read raises a NameError if it happens, 'warn' issues an analysis.UndefinedVariableWarning
+        first, 'error' rejects the memory without running the program.
+        memo is a memoize.RegionMemo: the loops (and conditionals containing loops) of a run then
+        reuse the memory they left when they last started from the same values, in this run or
+        an earlier one, instead of running again. A run with a memo walks the AST, whatever the
+        backend; the memo may be shared by interpreters and its statistics cover all their runs.
+        integers chooses the integer arithmetic: 'unbounded' uses Python ints, 'wrap' and 'trap'
+        64-bit ints, which wrap around on overflow or raise an OverflowError, in every backend.
+        With those, the memory may only hold bools and 64-bit ints, anything else is rejected
+        before running. With optimize in 'trap' mode, counting loops iterate instead of being
+        computed in closed form, so that an overflow is raised at the iteration it happens in.
+        '''
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {self.BACKENDS}")
+        if undefined not in ('ignore', 'warn', 'error'):
+            raise ValueError(f"Unknown undefined mode '{undefined}', expected 'ignore', 'warn' or 'error'")
+        if integers not in ('unbounded', 'wrap', 'trap'):
+            raise ValueError(f"Unknown integers mode '{integers}', expected 'unbounded', 'wrap' or 'trap'")
+        self.backend = backend
+        self.undefined = undefined
+        self.integers = integers
+        self.optimize = optimize
+        self.optimized_ast = None
+        self.temporaries = [] # variables introduced by the loop optimizer
+        self.trace = trace
+        self.memo = memo
+        self.source = input_text if isinstance(input_text, str) else None # streamed sources are not kept
+        self.document = None # IncrementalDocument, created by the first edit
+        self.compiled = {} # (backend name, options) -> executable program
+
+        cacheable = cache is not None and isinstance(input_text, str)
+        if cacheable:
+            entry = cache.get(input_text)
+            if entry is not None:
+                self.lexer = self.tokens = self.parser = None
+                self.lines = lexer.LineTable(input_text)
+                self.ast = entry.ast
+                self.compiled = entry.compiled
+                return
+
         try:
-            self.lexer = lexer.Lexer(input_text)
-            self.tokens = self.lexer.lex()
-            self.parser = parser.Parser(self.tokens)
+            if isinstance(input_text, str):
+                # both lexers produce the same tokens, the state machine one is kept as reference
+                self.lines = lexer.LineTable(input_text)
+                self.lexer = lexer.FastLexer(input_text, trace) if fast_lexer else lexer.Lexer(input_text, trace)
+                self.tokens = self.lexer.lex()
+                self.parser = parser.Parser(self.tokens, self.lines, trace)
+            else:
+                self.lexer = lexer.StreamLexer(input_text, trace=trace)
+                self.lines = self.lexer.lines # filled as the source is read
+                self.tokens = None
+                self.parser = parser.Parser(iter(self.lexer), self.lines, trace)
             self.ast = self.parser.parse()
         except Exception as e:
             raise Exception(f"IMPInterpreter parsing error: {str(e)}")
 
-    def run(self, memory: dict):
+        if cacheable:
+            self.compiled = cache.put(input_text, self.ast).compiled
+
+    def edit(self, offset: int, deleted: int, inserted: str):
+        '''
+        Apply a text edit (replace deleted characters at offset with inserted) to the program.
+        Only the top-level commands touched by the edit are lexed and parsed again, the AST of
+        the others is reused; ast is rebuilt from them when it is next used. Raises a parsing error if the edited text does not parse; the
+        text is still edited, and the last valid AST stays in use until an edit fixes it.
+        '''
+        if self.source is None:
+            raise ValueError("Incremental editing needs the program source as a str")
+        if self.document is None:
+            self.document = incremental.IncrementalDocument(self.source)
+        parsed = self.document.edit(offset, deleted, inserted)
+        self.source = self.document.text
+        if not parsed:
+            if self._ast is None:
+                self._ast = self.document.last_ast
+            raise Exception(f"IMPInterpreter parsing error: {str(self.document.error)}")
+        self.lexer = self.tokens = self.parser = None
+        self.lines = self.document.lines
+        self.ast = None # taken from the document when next needed, see ast
+        self.optimized_ast = None
+        self.temporaries = []
+        self.compiled = {} # not cleared in place: it may be shared through the parse cache
+
+    @property
+    def ast(self):
+        '''
+        The parsed AST. After an edit it is built by the document on first use, so that a
+        series of edits does not rebuild it every time.
+        '''
+        if self._ast is None and self.document is not None:
+            self._ast = self.document.ast
+        return self._ast
+
+    @ast.setter
+    def ast(self, ast):
+        self._ast = ast
+
+    def compile(self, backend: str = None, budgeted: bool = False):
+        '''
+        Compile the AST for the given backend (the interpreter's backend by default).
+        Returns a callable that runs the program on a memory dict; the result is cached.
+        With budgeted, the callable takes the memory dict and a limits.Budget.
+        '''
+        backend = backend or self.backend
+        # the compiled programs may be shared with other interpreters through the parse cache,
+        # so they are keyed by every option that changes what gets compiled
+        key = (backend, self.optimize, self.integers, budgeted)
+        if key in self.compiled:
+            return self.compiled[key]
+
+        ast = self.program_ast()
+        if budgeted:
+            if backend == 'tree':
+                program = lambda memory, budget: limits.run_tree(ast, memory, budget)
+            elif backend == 'closure':
+                program = closure_compiler.compile_ast(ast, budgeted=True)
+            elif backend in ('vm', 'flat'):
+                program = self.compile(backend).execute # these check the budget only when given one
+            else:
+                raise ValueError(f"Unknown backend '{backend}', expected one of {self.BACKENDS}")
+        elif backend == 'tree':
+            program = ast.eval
+        elif backend == 'closure':
+            program = closure_compiler.compile_ast(ast)
+        elif backend == 'vm':
+            program = vm.compile_ast(ast) # a callable BytecodeProgram
+        elif backend == 'flat':
+            program = flat_ast.from_ast(ast) # a callable FlatAST
+        else:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {self.BACKENDS}")
+
+        self.compiled[key] = program
+        return program
+
+    def program_ast(self):
+        '''
+        The AST that is executed: the parsed one, or its optimized form with optimize, with
+        64-bit arithmetic unless integers is 'unbounded'.
+        '''
+        if not self.optimize and self.integers == 'unbounded':
+            return self.ast
+        if self.optimized_ast is None:
+            ast = self.ast
+            trap = self.integers == 'trap'
+            if self.optimize:
+                ast = optimizer.fold_constants(ast, int64=self.integers != 'unbounded', trap=trap)
+                if not trap:
+                    # counting loops are solved before the others are optimized, which leaves them alone
+                    ast = optimizer.accelerate_loops(ast)
+                loops = optimizer.LoopOptimizer(reduce=not trap)
+                ast = loops.optimize(ast)
+                self.temporaries = loops.temporaries
+            if self.integers != 'unbounded':
+                ast = optimizer.to_int64(ast, trap)
+            self.optimized_ast = ast
+        return self.optimized_ast
+
+    def check_integers(self, memory: dict):
+        '''
+        Reject a memory holding values the integers mode cannot represent: an int outside
+        64 bits raises an OverflowError, a value that is neither an int nor a bool a ValueError.
+        '''
+        if self.integers == 'unbounded':
+            return
+        for name, value in memory.items():
+            if type(value) is int:
+                if not INT64_MIN <= value <= INT64_MAX:
+                    raise OverflowError(f"Integer overflow: {name} = {value} does not fit in 64 bits")
+            elif type(value) is not bool:
+                raise ValueError(f"Unsupported value for {name}: {value!r}, expected a 64-bit int or a bool")
+
+    def _drop_temporaries(self, memory: dict):
+        if self.optimize:
+            self.program_ast() # the compiled programs may come from the parse cache
+            for name in self.temporaries:
+                memory.pop(name, None)
+
+    def dataflow(self) -> analysis.Dataflow:
+        '''
+        The read/write sets and definite assignment of the executed program (see analysis).
+        '''
+        key = ('dataflow', self.optimize, self.integers)
+        if key not in self.compiled:
+            self.compiled[key] = analysis.analyze(self.program_ast())
+        return self.compiled[key]
+
+    def regions(self) -> dict:
+        '''
+        The regions of the executed program that a memo stores (see memoize.find_regions).
+        '''
+        key = ('regions', self.optimize, self.integers)
+        if key not in self.compiled:
+            self.compiled[key] = memoize.find_regions(self.program_ast(), self.dataflow())
+        return self.compiled[key]
+
+    def check(self, memory=(), mode: str = 'warn') -> list:
+        '''
+        Return the reads that may find their variable unset when running on memory (a dict or
+        a collection of variable names), reported as in analysis.Dataflow.check.
+        '''
+        return self.dataflow().check(memory, self.lines, mode)
+
+    def run(self, memory: dict, backend: str = None, max_steps: int = None, timeout: float = None):
         '''
         Run the IMP program represented by the AST on the given memory.
+        The backend can be overridden per call, e.g. to cross-check results.
+        max_steps limits the number of loop iterations and timeout the wall-clock time in seconds;
+        going over either raises limits.ExecutionLimitExceeded, which reports the steps executed
+        and the memory at the point of interruption. Without limits the run is not instrumented.
         '''
-        self.ast.eval(memory)
-        return memory
\ No newline at end of file
+        self.check_integers(memory)
+        if self.undefined != 'ignore':
+            self.check(memory, self.undefined)
+        try:
+            if self.trace is not None:
+                budget = None if max_steps is None and timeout is None else limits.Budget(max_steps, timeout)
+                tracing.run_traced(self.program_ast(), memory, self.trace, budget)
+            elif self.memo is not None:
+                budget = None if max_steps is None and timeout is None else limits.Budget(max_steps, timeout)
+                memoize.run_memoized(self.program_ast(), memory, self.memo, self.regions(), budget)
+            elif max_steps is None and timeout is None:
+                program = self.compile(backend)
+                program(memory)
+            else:
+                program = self.compile(backend, budgeted=True)
+                program(memory, limits.Budget(max_steps, timeout))
+        finally:
+            self._drop_temporaries(memory)
+        return memory
+
+    def profile(self, memory: dict) -> profiler.Profiler:
+        '''
+        Run the program on the given memory with per-node counting and timing, and return
+        the Profiler holding the statistics (see Profiler.report, annotate, to_json and dump_stats).
+        The program runs on an instrumented copy of the AST, which run never uses.
+        '''
+        self.check_integers(memory)
+        if self.undefined != 'ignore':
+            self.check(memory, self.undefined)
+        program_profiler = profiler.Profiler(self.program_ast(), self.lines)
+        try:
+            program_profiler.run(memory)
+        finally:
+            self._drop_temporaries(memory)
+        return program_profiler
+
+
+    def run_batch(self, memories, backend: str = None, stop_on_error: bool = False,
+                  vectorize: bool = False, max_steps: int = None, timeout: float = None) -> BatchResult:
+        '''
+        Run the program on every memory of memories, compiling it only once.
+        Like run, each memory dict is updated in place. An input that raises does not stop the
+        batch: its result is None and the exception is recorded in BatchResult.errors under
+        the input's index. With stop_on_error the first exception propagates instead.
+        With vectorize, all inputs are first run together as numpy int64 vectors; if that is not
+        possible (int64 overflow, unset variables, non-int inputs, inputs rejected by the
+        undefined mode) the batch falls back to running them one by one on the backend.
+        max_steps and timeout apply to each input separately, as in run, and so does the
+        undefined mode: with 'error', a rejected input is recorded as failed without running.
+        With a trace hook, every input runs traced, as in run, and none is vectorized;
+        otherwise, with a memo, the inputs that are not vectorized run on it.
+        In the 64-bit integers modes, inputs holding other values are rejected like those of the
+        undefined mode; in 'wrap' mode the vectors wrap around instead of falling back on overflow.
+        '''
+        budgeted = max_steps is not None or timeout is not None
+        errors = {}
+        if self.undefined != 'ignore' or self.integers != 'unbounded':
+            memories = list(memories)
+            dataflow = self.dataflow()
+            for index, memory in enumerate(memories):
+                try:
+                    self.check_integers(memory)
+                    if self.undefined != 'ignore':
+                        dataflow.check(memory, self.lines, self.undefined)
+                except Exception as e:
+                    if stop_on_error:
+                        raise
+                    errors[index] = e
+        rejected = dict(errors)
+
+        if vectorize and not rejected and self.trace is None:
+            memories = list(memories)
+            key = ('vector', self.optimize, self.integers)
+            if key not in self.compiled:
+                self.compiled[key] = vectorized.VectorizedProgram(self.program_ast())
+            try:
+                budget = limits.Budget(max_steps, timeout) if budgeted else None
+                self.compiled[key].run_memories(memories, budget)
+                for memory in memories:
+                    self._drop_temporaries(memory)
+                return BatchResult(memories, {})
+            except vectorized.VectorFallback:
+                pass # the memories are untouched, run them on the scalar backend
+
+        if self.trace is not None:
+            ast, trace = self.program_ast(), self.trace
+            if budgeted:
+                program = lambda memory, budget: tracing.run_traced(ast, memory, trace, budget)
+            else:
+                program = lambda memory: tracing.run_traced(ast, memory, trace)
+        elif self.memo is not None:
+            ast, memo, regions = self.program_ast(), self.memo, self.regions()
+            if budgeted:
+                program = lambda memory, budget: memoize.run_memoized(ast, memory, memo, regions, budget)
+            else:
+                program = lambda memory: memoize.run_memoized(ast, memory, memo, regions)
+        else:
+            program = self.compile(backend, budgeted)
+        results = []
+        append = results.append
+        for index, memory in enumerate(memories):
+            if rejected and index in rejected:
+                append(None)
+                continue
+            try:
+                if budgeted:
+                    program(memory, limits.Budget(max_steps, timeout))
+                else:
+                    program(memory)
+            except Exception as e:
+                if stop_on_error:
+                    raise
+                errors[index] = e
+                append(None)
+            else:
+                append(memory)
+        if self.optimize:
+            for memory in results:
+                if memory is not None:
+                    self._drop_temporaries(memory)
+        return BatchResult(results, errors)
@@ -31,10 +31,18 @@ class TokenType:
     SEQ     = ';'
 
 class Token:
-    def __init__(self, type: TokenType, value=None):
+    __slots__ = ('type', 'value', 'pos')
+
+    def __init__(self, type: TokenType, value=None, pos: int = -1):
         self.type = type
         self.value = value
+        self.pos = pos # offset of the token's first character in the source, -1 if unknown
     
+    def __eq__(self, other):
+        if not isinstance(other, Token):
+            return NotImplemented
+        return self.type == other.type and self.value == other.value
+
     def __repr__(self):
         if self.value: return f"Token({self.type}, {repr(self.value)})"
         return f"Token({self.type})"
\ No newline at end of file
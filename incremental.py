@@ -0,0 +1,202 @@
+from bisect import bisect_left
+
+from lexer import LineTable, scan_tokens
+from parser import Parser
+from nodes import *
+
+# incremental re-parsing for editors. a document keeps its program as the list of its
+# top-level commands (the commands of the outermost sequence) and the offsets of the ';'
+# separating them. an edit only re-lexes and re-parses the top-level commands whose text it
+# touches; the other commands keep their AST. a ';' is always a token of its own, so lexing
+# never crosses a separator, and the predictive parser parses a command the same way
+# whatever follows it, so a re-parsed region that forms complete commands can be spliced in.
+# when it does not (e.g. an 'end' was deleted), the whole text is parsed again.
+# the lexing and parsing of an edit cost the size of the re-parsed region, and updating the
+# separators the distance from the previous edit: the separators after an edit are moved by
+# a pending shift, only applied to the entries an edit goes past. the text itself is still
+# a str spliced by every edit, and the LineTable a new one, which only scans the text when
+# a position is looked up; both are linear copies, far cheaper than lexing. the positions
+# of the commands after an edit and the AST are only updated when ast is read.
+
+class Segment:
+    __slots__ = ('node', 'start')
+
+    def __init__(self, node: Node, start: int):
+        self.node = node    # AST of the top-level command
+        self.start = start  # offset its positions are relative to: where its text started when parsed
+
+
+class IncrementalDocument:
+    '''
+    Program text kept parsed across edits. When the text does not parse, ast is None and
+    error holds the exception; the next edit then parses the whole text again.
+    '''
+    def __init__(self, text: str):
+        self.text = text
+        self.lines = LineTable(text)
+        self.segments = None   # Segment of every top-level command
+        self.separators = None # offsets of the top-level ';', one less than the segments
+        self.shifted = 0       # the separators from this index on are shift characters off
+        self.shift = 0
+        self.placed = 0        # number of leading segments whose positions are up to date
+        self._ast = None
+        self.last_ast = None   # AST of the last text that parsed, kept while the text does not
+        self.error = None
+        # counters, for monitoring
+        self.full_parses = 0
+        self.incremental_parses = 0
+        self.reparsed_chars = 0
+        self._parse_all()
+
+    def _parse_region(self, start: int, stop: int):
+        '''
+        Lex and parse text[start:stop], which must form complete top-level commands.
+        Returns their segments and separators.
+        '''
+        tokens, _ = scan_tokens(self.text[start:stop], offset=start)
+        commands, separators = Parser(tokens, self.lines).parse_commands()
+        starts = [start] + [separator + 1 for separator in separators]
+        self.reparsed_chars += stop - start
+        return [Segment(command, command_start) for command, command_start in zip(commands, starts)], separators
+
+    def _parse_all(self):
+        self.full_parses += 1
+        if self.segments is not None:
+            self.last_ast = self.ast # as costly as the full parse, and kept if it fails
+        self.placed = 0
+        self._ast = None
+        try:
+            self.segments, self.separators = self._parse_region(0, len(self.text))
+            self.shifted = len(self.separators)
+            self.shift = 0
+            self.error = None
+        except Exception as e:
+            self.segments = self.separators = None
+            self.error = e
+
+    def separator(self, index: int) -> int:
+        '''
+        The offset of the index-th top-level ';'.
+        '''
+        if index >= self.shifted:
+            return self.separators[index] + self.shift
+        return self.separators[index]
+
+    def _find_separator(self, offset: int) -> int:
+        # bisect_left on the separators, with the pending shift applied
+        separators, shifted = self.separators, self.shifted
+        index = bisect_left(separators, offset, 0, shifted)
+        if index < shifted:
+            return index
+        return bisect_left(separators, offset - self.shift, shifted)
+
+    def edit(self, offset: int, deleted: int, inserted: str) -> bool:
+        '''
+        Replace the deleted characters at offset with the inserted text and update the parsed
+        commands; ast is rebuilt when it is next read. Returns whether the text parses (see error).
+        '''
+        old_length = len(self.text)
+        if offset < 0 or deleted < 0 or offset + deleted > old_length:
+            raise ValueError(f"Edit of {deleted} characters at {offset} is outside the text ({old_length} characters)")
+        self.text = self.text[:offset] + inserted + self.text[offset + deleted:]
+        self.lines = LineTable(self.text)
+        if self.segments is None:
+            self._parse_all()
+            return self.error is None
+
+        # the top-level commands touched by the edit, including those it only borders,
+        # since the edit may extend their first or last token
+        delta = len(inserted) - deleted
+        separators = self.separators
+        first = self._find_separator(offset)
+        last = self._find_separator(offset + deleted)
+        start = self.separator(first - 1) + 1 if first else 0
+        stop = (self.separator(last) if last < len(separators) else old_length) + delta
+        try:
+            segments, region_separators = self._parse_region(start, stop)
+        except Exception:
+            # the edit changed the structure around the region, e.g. by removing an 'end'
+            self._parse_all()
+            return self.error is None
+
+        self.incremental_parses += 1
+        self.segments[first:last + 1] = segments
+        # the separators before the region get their pending shift, those after it are
+        # all left off by the pending shift, which then takes the length change of the edit
+        shift = self.shift
+        for index in range(self.shifted, first):
+            separators[index] += shift
+        for index in range(last, self.shifted):
+            separators[index] -= shift
+        separators[first:last] = region_separators
+        self.shifted = first + len(region_separators)
+        self.shift = shift + delta
+        self.placed = min(self.placed, first)
+        self._ast = None
+        return True
+
+    @property
+    def ast(self) -> Node:
+        '''
+        The AST of the whole program, as built by Parser.parse. The commands after the first
+        edited one are copied with their positions moved by the length change of the edits, when
+        it is read, so the ASTs read before the edits keep their nodes and positions.
+        '''
+        segments = self.segments
+        if segments is None:
+            return None
+        if self._ast is not None:
+            return self._ast
+        separator = self.separator
+        for k in range(self.placed, len(segments)):
+            segment = segments[k]
+            start = separator(k - 1) + 1 if k else 0
+            if segment.start != start:
+                segment.node = _shifted_copy(segment.node, start - segment.start)
+                segment.start = start
+        self.placed = len(segments)
+        if len(segments) == 1:
+            self._ast = segments[0].node
+        else:
+            self._ast = NodeBlock([segment.node for segment in segments])
+            self._ast.pos = segments[0].node.pos
+        return self._ast
+
+
+def _shifted_copy(node: Node, shift: int) -> Node:
+    # copy the subtree with its source offsets moved, without recursion: the nodes are
+    # created in a first pass, then their fields are filled with the copies of the children
+    copies = {} # id of a node -> its copy
+    order = []
+    pending = [node]
+    while pending:
+        original = pending.pop()
+        if id(original) in copies:
+            continue
+        copies[id(original)] = object.__new__(type(original))
+        order.append(original)
+        for value in _fields(original).values():
+            if isinstance(value, Node):
+                pending.append(value)
+            elif isinstance(value, (tuple, list)):
+                pending.extend(child for child in value if isinstance(child, Node))
+    for original in order:
+        copy = copies[id(original)]
+        for name, value in _fields(original).items():
+            if name == 'pos':
+                value += shift
+            elif isinstance(value, Node):
+                value = copies[id(value)]
+            elif isinstance(value, (tuple, list)):
+                value = type(value)(copies[id(child)] if isinstance(child, Node) else child for child in value)
+            setattr(copy, name, value)
+    return copies[id(node)]
+
+def _fields(node: Node) -> dict:
+    # the slots of the node that are set
+    return {
+        name: getattr(node, name)
+        for cls in type(node).__mro__
+        for name in getattr(cls, '__slots__', ())
+        if hasattr(node, name)
+    }
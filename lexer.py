@@ -1,24 +1,131 @@
-from token import Token, TokenType
+from array import array
+from bisect import bisect_right
+import codecs
+import re
+
+from imp_token import Token, TokenType
+
+# lookup tables shared by both lexers
+KEYWORDS = {
+    'true':  TokenType.TRUE,
+    'false': TokenType.FALSE,
+    'not':   TokenType.NOT,
+    'and':   TokenType.AND,
+    'or':    TokenType.OR,
+    'skip':  TokenType.SKIP,
+    'if':    TokenType.IF,
+    'then':  TokenType.THEN,
+    'else':  TokenType.ELSE,
+    'end':   TokenType.END,
+    'while': TokenType.WHILE,
+    'do':    TokenType.DO,
+}
+
+OPERATORS = {
+    '+':  TokenType.PLUS,
+    '-':  TokenType.MINUS,
+    '*':  TokenType.MUL,
+    ':=': TokenType.ASSIGN,
+    '<=': TokenType.LE,
+    '=':  TokenType.EQ,
+}
+
+PUNCTUATION = {
+    ';': TokenType.SEQ,
+    '(': TokenType.LPAREN,
+    ')': TokenType.RPAREN,
+}
+
+# integers and identifiers are ascii: str.isdigit and str.isalpha also accept characters
+# like '²' or 'ⅷ', which the regex classes of FastLexer do not match the same way
+DIGITS = frozenset('0123456789')
+LETTERS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+class LineTable:
+    '''
+    Maps source offsets, as stored in Token.pos and Node.pos, to 1-based (line, column) pairs.
+    The offsets of the line starts are only computed on the first lookup, or fed chunk by
+    chunk with extend when the source is streamed.
+    '''
+    def __init__(self, text: str = None):
+        self.text = text
+        self.starts = None # array of the offsets where lines start
+        self.length = 0    # characters seen so far when fed with extend
+
+    def _line_starts(self) -> array:
+        if self.starts is None:
+            self.starts = array('q', [0])
+            if self.text is not None:
+                self.extend(self.text)
+        return self.starts
+
+    def extend(self, chunk: str):
+        '''
+        Add the line starts of the next chunk of a streamed source.
+        '''
+        starts = self._line_starts()
+        newline = chunk.find('\n')
+        while newline != -1:
+            starts.append(self.length + newline + 1)
+            newline = chunk.find('\n', newline + 1)
+        self.length += len(chunk)
+
+    def position(self, offset: int) -> tuple:
+        '''
+        Return the (line, column) of a source offset, both counted from 1.
+        '''
+        starts = self._line_starts()
+        line = bisect_right(starts, offset)
+        return line, offset - starts[line - 1] + 1
+
+    def line_count(self) -> int:
+        return len(self._line_starts())
+
+    def describe(self, offset: int) -> str:
+        if offset is None or offset < 0:
+            return "at unknown position"
+        line, column = self.position(offset)
+        return f"at line {line}, column {column}"
+
+    def source_line(self, line: int) -> str:
+        '''
+        Return the text of a line (counted from 1), only available when the table holds the text.
+        '''
+        if self.text is None:
+            return None
+        starts = self._line_starts()
+        start = starts[line - 1]
+        end = starts[line] - 1 if line < len(starts) else len(self.text)
+        return self.text[start:end]
+
 
 # we implmenet the lexer as a state machine
-# a more advanced implementation could use regexes or similar techniques
+# FastLexer below is the regex based implementation, this one is kept as its reference
 class Lexer:
-    def __init__(self, input_text):
+    def __init__(self, input_text, trace=None):
         self.text = input_text
+        self.trace = trace # hook called with every token, see tracing
         self.length = len(input_text)
         self.pos = -1 # "reading head" position in input text
         self.state = 'NEXT'
         self.buffer = ''
+        self.start = 0 # position of the first character of the buffer
         self.lexeme = []
 
     def get_lexeme(self):
         return self.lexeme
 
     def lex(self):
-        while True:
-            self._step()
-            if self.state == 'EOF':
-                break   
+        try:
+            while True:
+                self._step()
+                if self.state == 'EOF':
+                    break
+        finally:
+            # reported once lexing stops, also when it fails, so the hook is not checked per character
+            if self.trace is not None:
+                for token in self.lexeme:
+                    self.trace('lex.token', token.pos, token)
         return self.lexeme
     
     def _step(self):
@@ -47,19 +154,22 @@ class Lexer:
             # punctuation, create token
             self._create_punctuation_token(c)
             self.pos += 1
-        elif c.isdigit():
+        elif c in DIGITS:
             # start reading integer literal
             self._set_state('READING_INT')
+            self.start = self.pos + 1
             self.buffer = c # add first char to buffer
             self.pos += 1 # move head
-        elif c.isalpha():
+        elif c in LETTERS:
             # start reading variable/identifier or keyword (must start with letter)
             self._set_state('READING_LETTER')
+            self.start = self.pos + 1
             self.buffer = c # add first char to buffer
             self.pos += 1   # move head
         elif self._is_operator_char(c):
             # start reading operator (since there could be multi-char operators)
             self._set_state('READING_OPERATOR')
+            self.start = self.pos + 1
             self.buffer = c # add first char to buffer
             self.pos += 1   # move head
         else:
@@ -72,7 +182,7 @@ class Lexer:
 
         if c is not None:
             # has next
-            if c.isdigit():
+            if c in DIGITS:
                 # next is still digit, keep reading
                 self.buffer += c
                 self.pos += 1
@@ -93,7 +203,7 @@ class Lexer:
 
         if c is not None:
             # has next
-            if c.isalnum() or c == '_':
+            if c in LETTERS or c in DIGITS or c == '_':
                 # next is still letter or digit or underscore, keep reading
                 self.buffer += c
                 self.pos += 1
@@ -144,12 +254,7 @@ class Lexer:
         return c in ';()'
 
     def _create_punctuation_token(self, c: str):
-        if c == ';':
-            self.lexeme.append(Token(TokenType.SEQ, c))
-        elif c == '(':
-            self.lexeme.append(Token(TokenType.LPAREN, c))
-        elif c == ')':
-            self.lexeme.append(Token(TokenType.RPAREN, c))
+        self.lexeme.append(Token(PUNCTUATION[c], c, self.pos + 1))
 
     def _is_operator_char(self, op_char: str) -> bool:
         # check if char is one of the first char of an operator
@@ -157,64 +262,28 @@ class Lexer:
     
     def _is_operator(self, op_str: str) -> bool:
         # check if string is a valid operator
-        return op_str in ['+', '-', '*', ':=', '<=', '=']
+        return op_str in OPERATORS
     
     def _create_operator_token(self, op_str: str):
-        if op_str == '+':
-            self.lexeme.append(Token(TokenType.PLUS, op_str))
-        elif op_str == '-':
-            self.lexeme.append(Token(TokenType.MINUS, op_str))
-        elif op_str == '*':
-            self.lexeme.append(Token(TokenType.MUL, op_str))
-        elif op_str == ':=':
-            self.lexeme.append(Token(TokenType.ASSIGN, op_str))
-        elif op_str == '<=':
-            self.lexeme.append(Token(TokenType.LE, op_str))
-        elif op_str == '=':
-            self.lexeme.append(Token(TokenType.EQ, op_str))
+        # a lone ':' or '<' is not an operator and produces no token
+        token_type = OPERATORS.get(op_str)
+        if token_type is not None:
+            self.lexeme.append(Token(token_type, op_str, self.start))
 
     def _create_int_token(self, int_str: str):
-        self.lexeme.append(Token(TokenType.INT, int(int_str)))
+        self.lexeme.append(Token(TokenType.INT, int(int_str), self.start))
 
     def _is_keyword(self, letter_str: str) -> bool:
-        keywords = {
-            'true', 'false', 'not', 'and', 'or',
-            'skip', 'if', 'then', 'else', 'end',
-            'while', 'do'
-        }
-        return letter_str in keywords
+        return letter_str in KEYWORDS
 
     def _create_keyword_token(self, letter_str: str):
-        if letter_str == 'true':
-            self.lexeme.append(Token(TokenType.TRUE, letter_str))
-        elif letter_str == 'false':
-            self.lexeme.append(Token(TokenType.FALSE, letter_str))
-        elif letter_str == 'not':
-            self.lexeme.append(Token(TokenType.NOT, letter_str))
-        elif letter_str == 'and':
-            self.lexeme.append(Token(TokenType.AND, letter_str))
-        elif letter_str == 'or':
-            self.lexeme.append(Token(TokenType.OR, letter_str))
-        elif letter_str == 'skip':
-            self.lexeme.append(Token(TokenType.SKIP, letter_str))
-        elif letter_str == 'if':
-            self.lexeme.append(Token(TokenType.IF, letter_str))
-        elif letter_str == 'then':
-            self.lexeme.append(Token(TokenType.THEN, letter_str))
-        elif letter_str == 'else':
-            self.lexeme.append(Token(TokenType.ELSE, letter_str))
-        elif letter_str == 'end':
-            self.lexeme.append(Token(TokenType.END, letter_str))
-        elif letter_str == 'while':
-            self.lexeme.append(Token(TokenType.WHILE, letter_str))
-        elif letter_str == 'do':
-            self.lexeme.append(Token(TokenType.DO, letter_str))
-        else:
+        token_type = KEYWORDS.get(letter_str)
+        if token_type is None:
             raise Exception(f"Lexer error: unknown keyword '{letter_str}'")
-
+        self.lexeme.append(Token(token_type, letter_str, self.start))
 
     def _create_var_token(self, letter_str: str):
-        self.lexeme.append(Token(TokenType.VAR, letter_str))
+        self.lexeme.append(Token(TokenType.VAR, letter_str, self.start))
 
     def _set_state(self, new_state):
         self.state = new_state
@@ -229,6 +298,140 @@ class Lexer:
         return None
 
 
+# a single master regex, matched repeatedly; each match skips leading white space and the
+# group that matched picks the token kind. the groups mirror the states of Lexer: an identifier
+# starts with a letter and continues with letters, digits or '_', and a lone ':' or '<' is
+# consumed without producing a token. the empty match at the end covers trailing white space.
+TOKEN_PATTERN = re.compile(r'''\s*(?:
+      (?P<int>[0-9]+)
+    | (?P<word>[A-Za-z][A-Za-z0-9_]*)
+    | (?P<operator>:=|<=|[-+*=:<])
+    | (?P<punctuation>[;()])
+    | (?P<error>\S)
+    | \Z)
+''', re.VERBOSE)
+
+def scan_tokens(text: str, final: bool = True, offset: int = 0):
+    '''
+    Match the tokens of text with TOKEN_PATTERN. Returns the token list and the index where scanning stopped.
+    Unless final, scanning stops before a token that touches the end of text, since more input could
+    still extend it (an identifier, an integer, ':' becoming ':='). offset is the position of text in the
+    whole source, added to the token positions.
+    '''
+    tokens = []
+    append = tokens.append
+    keywords = KEYWORDS
+    operators = OPERATORS
+    punctuation = PUNCTUATION
+    limit = -1 if final else len(text)
+    for match in TOKEN_PATTERN.finditer(text):
+        if match.end() == limit:
+            return tokens, match.start()
+        kind = match.lastgroup
+        if kind is None:
+            continue # trailing white space
+        value = match.group(kind)
+        pos = offset + match.start(kind)
+        if kind == 'word':
+            append(Token(keywords.get(value, TokenType.VAR), value, pos))
+        elif kind == 'int':
+            append(Token(TokenType.INT, int(value), pos))
+        elif kind == 'punctuation':
+            append(Token(punctuation[value], value, pos))
+        elif kind == 'operator':
+            token_type = operators.get(value)
+            if token_type is not None:
+                append(Token(token_type, value, pos))
+        else:
+            raise Exception(f"Lexer error: unexpected character '{value}' at position {pos}")
+    return tokens, len(text)
+
+class FastLexer:
+    '''
+    Regex based lexer producing the same Token list as Lexer, without the per-character state machine.
+    '''
+    def __init__(self, input_text, trace=None):
+        self.text = input_text
+        self.trace = trace # hook called with every token, see tracing
+        self.lexeme = []
+
+    def get_lexeme(self):
+        return self.lexeme
+
+    def lex(self):
+        tokens, _ = scan_tokens(self.text)
+        self.lexeme.extend(tokens)
+        if self.trace is not None:
+            for token in tokens:
+                self.trace('lex.token', token.pos, token)
+        return self.lexeme
+
+class StreamLexer:
+    '''
+    Lexer yielding tokens lazily from a str, a file object (text or binary), a memory-mapped file
+    or an iterable of str/bytes chunks. Only the current chunk and the tokens found in it are held,
+    tokens split across chunk boundaries are carried over to the next chunk.
+    The line starts of the chunks read so far are recorded in self.lines.
+    '''
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, source, chunk_size: int = CHUNK_SIZE, encoding: str = 'utf-8', trace=None):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.trace = trace # hook called with every token, see tracing
+        self.lines = LineTable()
+
+    def __iter__(self):
+        return self.tokens()
+
+    def _chunks(self):
+        # yield the source as str chunks
+        source = self.source
+        if isinstance(source, str):
+            yield source
+            return
+        if hasattr(source, 'read'):
+            # file objects and mmap
+            read = source.read
+            source = iter(lambda: read(self.chunk_size), read(0))
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        for chunk in source:
+            if isinstance(chunk, (bytes, bytearray, memoryview)):
+                chunk = decoder.decode(bytes(chunk))
+            if chunk:
+                yield chunk
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+    def tokens(self):
+        '''
+        Generator yielding the tokens of the source.
+        '''
+        if self.trace is None:
+            return self._scan()
+        return self._traced(self._scan())
+
+    def _traced(self, tokens):
+        trace = self.trace
+        for token in tokens:
+            trace('lex.token', token.pos, token)
+            yield token
+
+    def _scan(self):
+        carry = ''
+        offset = 0 # position of carry in the whole input
+        for chunk in self._chunks():
+            self.lines.extend(chunk)
+            text = carry + chunk
+            tokens, stop = scan_tokens(text, final=False, offset=offset)
+            yield from tokens
+            carry = text[stop:]
+            offset += stop
+        tokens, _ = scan_tokens(carry, final=True, offset=offset)
+        yield from tokens
+
 if __name__ == "__main__":
     # simple test
     input_text = "x := 10; if (x <= 20) then skip else x := (x + 1) end; while (x <= 20) do x := (x+1) end"
@@ -0,0 +1,129 @@
+import time
+
+from nodes import *
+from closed_form import AffineLoop
+
+# execution budgets. a step is one loop iteration: the backends only count on loop
+# back-edges, with an inlined countdown, and the clock is only read every
+# check_interval steps, so an unlimited budget costs nothing and a limited one very little.
+
+class ExecutionLimitExceeded(Exception):
+    '''
+    Raised when a run goes over its step or time budget.
+    steps is the number of loop iterations completed, memory the memory dict at the
+    point of interruption (the run's memory, updated with the variables set so far).
+    '''
+    def __init__(self, reason: str, steps: int, memory: dict = None):
+        self.reason = reason # 'steps' or 'timeout'
+        self.steps = steps
+        self.memory = memory
+        super().__init__(reason, steps)
+
+    def __reduce__(self):
+        # keep the memory when the exception crosses a process boundary
+        return (type(self), (self.reason, self.steps, self.memory))
+
+    def __str__(self):
+        if self.reason == 'steps':
+            return f"Execution stopped after {self.steps} steps: step limit reached"
+        return f"Execution stopped after {self.steps} steps: time limit reached"
+
+
+class Budget:
+    '''
+    Step and wall-clock budget of one run. Backends call tick once per loop iteration,
+    usually inlined as: budget.remaining -= 1; if budget.remaining < 0: budget.check()
+    '''
+    __slots__ = ('max_steps', 'timeout', 'check_interval', 'steps', 'window', 'remaining', 'deadline')
+
+    def __init__(self, max_steps: int = None, timeout: float = None, check_interval: int = 1024):
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.start()
+
+    def start(self):
+        self.steps = 0 # steps taken before the current window
+        self.deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        self.window = self._next_window()
+        self.remaining = self.window
+
+    def _next_window(self) -> int:
+        # steps allowed before the next check
+        window = self.check_interval
+        if self.max_steps is not None:
+            window = min(window, self.max_steps - self.steps)
+        return window
+
+    def tick(self):
+        self.remaining -= 1
+        if self.remaining < 0:
+            self.check()
+
+    def check(self):
+        '''
+        Called by the step that overdraws the current window.
+        '''
+        self.steps += self.window
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            raise ExecutionLimitExceeded('steps', self.steps)
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise ExecutionLimitExceeded('timeout', self.steps)
+        self.window = self._next_window()
+        self.remaining = self.window - 1 # the current step is taken from the new window
+
+    def charge(self, steps: int) -> bool:
+        '''
+        Take several steps at once, for a loop computed without iterating it. Returns False,
+        taking nothing, when fewer steps are left or the time is up: the caller then runs
+        the steps one by one, so the run stops at the same step as it would otherwise.
+        '''
+        if steps <= self.remaining:
+            self.remaining -= steps
+            return True
+        taken = self.steps_taken() + steps
+        if self.max_steps is not None and taken > self.max_steps:
+            return False
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return False
+        self.steps = taken
+        self.window = self._next_window()
+        self.remaining = self.window
+        return True
+
+    def steps_taken(self) -> int:
+        return self.steps + self.window - self.remaining
+
+
+def run_tree(ast: Node, memory: dict, budget: Budget):
+    '''
+    Run the AST like Node.eval, charging every loop iteration to the budget.
+    Only commands are walked here, expressions have no loops and use their own eval.
+    '''
+    try:
+        _run_command(ast, memory, budget)
+    except ExecutionLimitExceeded as e:
+        e.memory = memory
+        raise
+
+def _run_command(node: Node, memory: dict, budget: Budget):
+    if isinstance(node, SEQUENCE_NODES):
+        for command in sequence_commands(node):
+            _run_command(command, memory, budget)
+    elif isinstance(node, NodeWhile):
+        if isinstance(node, AffineLoop) and node.run(memory, budget):
+            return
+        condition = node.condition
+        body = node.body
+        while condition.eval(memory):
+            budget.remaining -= 1
+            if budget.remaining < 0:
+                budget.check()
+            _run_command(body, memory, budget)
+    elif isinstance(node, NodeIf):
+        if node.condition.eval(memory):
+            _run_command(node.then_branch, memory, budget)
+        else:
+            _run_command(node.else_branch, memory, budget)
+    else:
+        node.eval(memory) # assignments and skip
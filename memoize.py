@@ -0,0 +1,170 @@
+from collections import OrderedDict
+
+from nodes import *
+from resolver import UNSET
+from analysis import Dataflow
+from closed_form import AffineLoop
+from limits import Budget, ExecutionLimitExceeded
+
+# memoization of program regions. a command only depends on the values of the variables it
+# may read, and of those it may assign without assigning them on every path (they keep their
+# value when it does not); it only changes the variables it may assign. so the effect of a
+# region, the values of its written variables and the number of steps it took, can be reused
+# whenever it starts again with the same values for its inputs, in the same run or a later one.
+# the regions are the loops and the conditionals containing loops: other commands are cheaper
+# to run than to look up. a run with a memo walks the AST.
+
+class RegionMemo:
+    '''
+    LRU cache of region effects, keyed by the region and the values (and types) of its inputs.
+    At most max_entries effects are kept, the least recently used one is evicted first.
+    The counters add up over every run using the memo, which can be shared by interpreters.
+    '''
+    def __init__(self, max_entries: int = 4096):
+        if max_entries < 1:
+            raise ValueError("RegionMemo needs room for at least one entry")
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> (values of the written variables, steps), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''
+        Return the effect stored under key, or None.
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        '''
+        Drop the entries; the counters are kept.
+        '''
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class Region:
+    __slots__ = ('inputs', 'outputs')
+
+    def __init__(self, inputs: tuple, outputs: tuple):
+        self.inputs = inputs   # names of the variables the effect depends on
+        self.outputs = outputs # names of the variables the region may assign
+
+
+def find_regions(ast: Node, dataflow: Dataflow) -> dict:
+    '''
+    Map the memoized regions of the AST to their Region, using the read/write sets of
+    dataflow (the analysis of the same AST).
+    '''
+    regions = {}
+    _find_regions(ast, dataflow, regions)
+    return regions
+
+def _find_regions(node: Node, dataflow: Dataflow, regions: dict) -> bool:
+    # returns whether node contains a loop
+    if isinstance(node, SEQUENCE_NODES):
+        found = False
+        for command in sequence_commands(node):
+            found = _find_regions(command, dataflow, regions) or found
+        return found
+    if isinstance(node, NodeIf):
+        found = _find_regions(node.then_branch, dataflow, regions)
+        found = _find_regions(node.else_branch, dataflow, regions) or found
+    elif isinstance(node, AffineLoop):
+        return True # computed in closed form, not worth a lookup
+    elif isinstance(node, NodeWhile):
+        _find_regions(node.body, dataflow, regions)
+        found = True
+    else:
+        return False
+    if found:
+        sets = dataflow.sets[node]
+        inputs = sets.reads | (sets.writes - sets.defines)
+        regions[node] = Region(tuple(sorted(inputs)), tuple(sorted(sets.writes)))
+    return found
+
+
+def run_memoized(ast: Node, memory: dict, memo: RegionMemo, regions: dict, budget: Budget = None):
+    '''
+    Run the AST like Node.eval, reusing the effect of the regions (see find_regions) found
+    in memo and storing those it computes. Loop iterations are charged to the budget as in
+    limits.run_tree, a reused effect being charged the steps it took when computed.
+    '''
+    if budget is None:
+        budget = Budget() # unlimited, counts the steps of the regions
+    try:
+        _run_command(ast, memory, memo, regions, budget)
+    except ExecutionLimitExceeded as e:
+        e.memory = memory
+        raise
+
+def _run_command(node: Node, memory: dict, memo: RegionMemo, regions: dict, budget: Budget):
+    region = regions.get(node)
+    if region is not None:
+        values = tuple([memory.get(name, UNSET) for name in region.inputs])
+        key = (node, values, tuple(map(type, values))) # 1, 1.0 and True are equal keys otherwise
+        try:
+            entry = memo.get(key)
+        except TypeError:
+            key = entry = None # an unhashable value
+        if entry is not None:
+            outputs, steps = entry
+            if budget.charge(steps):
+                for name, value in zip(region.outputs, outputs):
+                    if value is not UNSET:
+                        memory[name] = value
+                return
+        start = budget.steps_taken()
+        _execute(node, memory, memo, regions, budget)
+        if key is not None:
+            outputs = tuple([memory.get(name, UNSET) for name in region.outputs])
+            memo.put(key, (outputs, budget.steps_taken() - start))
+        return
+    _execute(node, memory, memo, regions, budget)
+
+def _execute(node: Node, memory: dict, memo: RegionMemo, regions: dict, budget: Budget):
+    if isinstance(node, SEQUENCE_NODES):
+        for command in sequence_commands(node):
+            _run_command(command, memory, memo, regions, budget)
+    elif isinstance(node, NodeWhile):
+        if isinstance(node, AffineLoop) and node.run(memory, budget):
+            return
+        condition = node.condition
+        body = node.body
+        while condition.eval(memory):
+            budget.remaining -= 1
+            if budget.remaining < 0:
+                budget.check()
+            _run_command(body, memory, memo, regions, budget)
+    elif isinstance(node, NodeIf):
+        if node.condition.eval(memory):
+            _run_command(node.then_branch, memory, memo, regions, budget)
+        else:
+            _run_command(node.else_branch, memory, memo, regions, budget)
+    else:
+        node.eval(memory) # assignments and skip
@@ -1,6 +1,9 @@
+# the node classes use __slots__: programs produce a lot of nodes, and without an
+# instance __dict__ each one is smaller and faster to create
 class Node:
-    def __init__(self):
-        pass
+    # pos is the source offset of the node's first token (see lexer.LineTable), set by the
+    # parser; nodes built elsewhere may not have it, read it with getattr(node, 'pos', -1)
+    __slots__ = ('pos',)
 
     def eval(self, memory: dict):
         pass
@@ -11,9 +14,14 @@ class Node:
     def __str__(self):
         return "Node"
 
+def undefined_variable(name: str) -> NameError:
+    # the error of reading a variable that was never set, raised the same way by every backend
+    return NameError(f"Variable '{name}' not found in memory")
+
 class NodeSequence(Node):
+    __slots__ = ('first', 'second')
+
     def __init__(self, first: Node, second: Node):
-        super().__init__()
         self.first = first
         self.second = second
 
@@ -24,21 +32,65 @@ class NodeSequence(Node):
     def __str__(self):
         return f"({self.first.__str__()}; {self.second.__str__()})"
 
+class NodeBlock(Node):
+    # a sequence of two or more commands, as built by the parser. unlike a chain of
+    # NodeSequence, running or printing a long block does not recurse once per command
+    __slots__ = ('commands',)
+
+    def __init__(self, commands):
+        self.commands = tuple(commands)
+
+    def eval(self, memory: dict):
+        for command in self.commands:
+            command.eval(memory)
+
+    def __str__(self):
+        # printed like the equivalent left-nested chain of sequences: ((a; b); c)
+        commands = self.commands
+        return "(" * (len(commands) - 1) + commands[0].__str__() + "".join(
+            f"; {command.__str__()})" for command in commands[1:]
+        )
+
+SEQUENCE_NODES = (NodeSequence, NodeBlock)
+
+def sequence_commands(node: Node) -> list:
+    '''
+    Return the commands of a sequence (NodeSequence or NodeBlock) in execution order,
+    nested sequences flattened, without recursing on them.
+    '''
+    commands = []
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        if isinstance(current, NodeBlock):
+            pending.extend(reversed(current.commands))
+        elif isinstance(current, NodeSequence):
+            pending.append(current.second)
+            pending.append(current.first)
+        else:
+            commands.append(current)
+    return commands
+
 class NodeIdentifier(Node):
+    __slots__ = ('name',)
+
     def __init__(self, var_name):
-        super().__init__()
         self.name = var_name
     
     def eval(self, memory: dict):
-        return memory.get(self.name, KeyError(f"Variable '{self.name}' not found in memory"))
+        try:
+            return memory[self.name]
+        except KeyError:
+            raise undefined_variable(self.name) from None
     
     def __str__(self):
         return f"({self.name})"
 
 
 class NodeInteger(Node):
+    __slots__ = ('value',)
+
     def __init__(self, value: int):
-        super().__init__()
         self.value = value
 
     def eval(self, memory: dict):
@@ -48,8 +100,9 @@ class NodeInteger(Node):
         return f"({self.value})"
     
 class NodePlus(Node):
+    __slots__ = ('left', 'right')
+
     def __init__(self, val1: Node, val2: Node):
-        super().__init__()
         self.left = val1
         self.right = val2
 
@@ -60,8 +113,9 @@ class NodePlus(Node):
         return f"({self.left.__str__()} + {self.right.__str__()})"
     
 class NodeMinus(Node):
+    __slots__ = ('left', 'right')
+
     def __init__(self, val1: Node, val2: Node):
-        super().__init__()
         self.left = val1
         self.right = val2
 
@@ -72,8 +126,9 @@ class NodeMinus(Node):
         return f"({self.left.__str__()} - {self.right.__str__()})"
     
 class NodeMultiply(Node):
+    __slots__ = ('left', 'right')
+
     def __init__(self, val1: Node, val2: Node):
-        super().__init__()
         self.left = val1
         self.right = val2
 
@@ -83,9 +138,41 @@ class NodeMultiply(Node):
     def __str__(self):
         return f"({self.left.__str__()} * {self.right.__str__()})"
     
+# bounds of the fixed-width integer modes (64-bit two's complement)
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+def wrap_int64(value: int) -> int:
+    return ((value - INT64_MIN) & 0xFFFFFFFFFFFFFFFF) + INT64_MIN
+
+def int64_overflow(value: int) -> OverflowError:
+    # the error of an arithmetic result outside 64 bits in the trapping mode, raised the same way by every backend
+    return OverflowError(f"Integer overflow: {value} does not fit in 64 bits")
+
+class NodeInt64(Node):
+    # the value of expr brought back to 64 bits, wrapped around or, with trap, raising if it
+    # does not fit. inserted around every arithmetic result by optimizer.to_int64, printed as expr
+    __slots__ = ('expr', 'trap')
+
+    def __init__(self, expr: Node, trap: bool):
+        self.expr = expr
+        self.trap = trap
+
+    def eval(self, memory: dict):
+        value = self.expr.eval(memory)
+        if INT64_MIN <= value <= INT64_MAX:
+            return value
+        if self.trap:
+            raise int64_overflow(value)
+        return wrap_int64(value)
+
+    def __str__(self):
+        return self.expr.__str__()
+
 class NodeNot(Node):
+    __slots__ = ('factor',)
+
     def __init__(self, factor: Node):
-        super().__init__()
         self.factor = factor
 
     def eval(self, memory: dict):
@@ -95,8 +182,9 @@ class NodeNot(Node):
         return f"(not {self.factor.__str__()})"
     
 class NodeBoolean(Node):
+    __slots__ = ('value',)
+
     def __init__(self, value: bool):
-        super().__init__()
         self.value = value
 
     def eval(self, memory: dict):
@@ -106,8 +194,9 @@ class NodeBoolean(Node):
         return "(true)" if self.value else "(false)"
     
 class NodeLessEqual(Node):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left: Node, right: Node):
-        super().__init__()
         self.left = left
         self.right = right
 
@@ -118,8 +207,9 @@ class NodeLessEqual(Node):
         return f"({self.left.__str__()} <= {self.right.__str__()})"
     
 class NodeEqual(Node):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left: Node, right: Node):
-        super().__init__()
         self.left = left
         self.right = right
 
@@ -130,8 +220,9 @@ class NodeEqual(Node):
         return f"({self.left.__str__()} = {self.right.__str__()})"
 
 class NodeAnd(Node):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left: Node, right: Node):
-        super().__init__()
         self.left = left
         self.right = right
 
@@ -142,8 +233,9 @@ class NodeAnd(Node):
         return f"({self.left.__str__()} and {self.right.__str__()})"
     
 class NodeOr(Node):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left: Node, right: Node):
-        super().__init__()
         self.left = left
         self.right = right
 
@@ -154,8 +246,7 @@ class NodeOr(Node):
         return f"({self.left.__str__()} or {self.right.__str__()})"
     
 class NodeSkip(Node):
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
 
     def eval(self, memory: dict):
         pass # skip does nothing
@@ -164,8 +255,9 @@ class NodeSkip(Node):
         return "(skip)"
     
 class NodeAssign(Node):
+    __slots__ = ('var_name', 'expr')
+
     def __init__(self, var_name: str, expr: Node):
-        super().__init__()
         self.var_name = var_name
         self.expr = expr
 
@@ -177,8 +269,9 @@ class NodeAssign(Node):
         return f"({self.var_name} := {self.expr.__str__()})"
     
 class NodeIf(Node):
+    __slots__ = ('condition', 'then_branch', 'else_branch')
+
     def __init__(self, condition: Node, then_branch: Node, else_branch: Node):
-        super().__init__()
         self.condition = condition
         self.then_branch = then_branch
         self.else_branch = else_branch
@@ -194,14 +287,24 @@ class NodeIf(Node):
         
 
 class NodeWhile(Node):
+    __slots__ = ('condition', 'body')
+
     def __init__(self, condition: Node, body: Node):
-        super().__init__()
         self.condition = condition
         self.body = body
 
     def eval(self, memory: dict):
-        # create if node that represents while loop
-        expand_ast_node = NodeIf(
+        # run the loop natively, so the stack depth does not grow with the iteration count
+        condition = self.condition
+        body = self.body
+        while condition.eval(memory):
+            body.eval(memory)
+
+    def unroll(self):
+        '''
+        Return the one-step unrolling of the loop: if b then (c; while b do c) else skip.
+        '''
+        return NodeIf(
             self.condition,
             NodeSequence(
                 self.body,
@@ -209,7 +312,16 @@ class NodeWhile(Node):
             ),
             NodeSkip()
         )
-        return expand_ast_node.eval(memory)
+
+    def eval_unrolled(self, memory: dict):
+        '''
+        Reference semantics of the loop, evaluated through its unrolling.
+        Recurses once per iteration, so it is only meant as an oracle for eval.
+        '''
+        expand_ast_node = self.unroll()
+        if expand_ast_node.condition.eval(memory):
+            expand_ast_node.then_branch.first.eval(memory) # loop body
+            self.eval_unrolled(memory) # the loop itself, unrolled again
 
     def __str__(self):
         return f"(while {self.condition.__str__()} do {self.body.__str__()})"
@@ -0,0 +1,563 @@
+from nodes import *
+from analysis import analyze
+from closed_form import AffineLoop, recognize
+
+# AST to AST optimization passes. passes never modify the tree they are given (it may be
+# shared, e.g. through the parse cache), unchanged subtrees are reused in the result.
+
+class ConstantFolder:
+    '''
+    Fold arithmetic and comparisons over integer constants, simplify boolean and
+    arithmetic identities, and prune if/while branches decided by a constant condition.
+    An operand that would be evaluated is only dropped if it cannot raise, so the folded tree
+    reads an unset variable wherever the original does, e.g. (x * 0) and (x <= 1) or true stay.
+    With int64, only constants within 64 bits are folded, so folding never hides an overflow.
+    With trap, overflows raise, so an operand that may overflow is never dropped either.
+    '''
+    def __init__(self, int64: bool = False, trap: bool = False):
+        self.int64 = int64 or trap
+        self.trap = trap
+
+    def _fits(self, *values) -> bool:
+        return not self.int64 or all(INT64_MIN <= value <= INT64_MAX for value in values)
+
+    def _may_raise(self, node: Node) -> bool:
+        # whether evaluating the expression may raise: it reads a variable, which may be unset,
+        # or, with trap, computes arithmetic or a constant outside 64 bits
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, NodeIdentifier):
+                return True
+            if isinstance(node, (NodePlus, NodeMinus, NodeMultiply)):
+                if self.trap:
+                    return True
+                pending.append(node.left)
+                pending.append(node.right)
+            elif isinstance(node, NodeInteger):
+                if self.trap and not INT64_MIN <= node.value <= INT64_MAX:
+                    return True
+            elif isinstance(node, NodeNot):
+                pending.append(node.factor)
+            elif isinstance(node, (NodeLessEqual, NodeEqual, NodeAnd, NodeOr)):
+                pending.append(node.left)
+                pending.append(node.right)
+        return False
+
+    def fold(self, node: Node) -> Node:
+        # the nodes built by the pass take the source position of the node they replace (see _at),
+        # the nodes of the given tree are returned as they are
+        return self._fold_node(node)
+
+    def _fold_node(self, node: Node) -> Node:
+        if isinstance(node, SEQUENCE_NODES):
+            return self._fold_sequence(node)
+        if isinstance(node, (NodePlus, NodeMinus, NodeMultiply)):
+            return self._fold_arithmetic(node)
+        if isinstance(node, (NodeLessEqual, NodeEqual)):
+            return self._fold_comparison(node)
+        if isinstance(node, (NodeAnd, NodeOr)):
+            return self._fold_logic(node)
+        if isinstance(node, NodeNot):
+            return self._fold_not(node)
+        if isinstance(node, NodeAssign):
+            expr = self.fold(node.expr)
+            return node if expr is node.expr else _at(NodeAssign(node.var_name, expr), node)
+        if isinstance(node, NodeIf):
+            return self._fold_if(node)
+        if isinstance(node, NodeWhile):
+            return self._fold_while(node)
+        return node # leaves and skip
+
+    def _fold_sequence(self, node: Node) -> Node:
+        commands = sequence_commands(node)
+        folded = [self.fold(command) for command in commands]
+        if all(new is old and not isinstance(new, NodeSkip) for new, old in zip(folded, commands)):
+            return node
+        # a folded command may itself have become a sequence, e.g. a decided if
+        kept = []
+        for command in folded:
+            if isinstance(command, SEQUENCE_NODES):
+                kept.extend(sequence_commands(command))
+            elif not isinstance(command, NodeSkip):
+                kept.append(command)
+        if not kept:
+            return _at(NodeSkip(), node)
+        if len(kept) == 1:
+            return kept[0]
+        result = NodeBlock(kept)
+        if hasattr(kept[0], 'pos'):
+            result.pos = kept[0].pos
+        return result
+
+    def _fold_arithmetic(self, node: Node) -> Node:
+        left = self.fold(node.left)
+        right = self.fold(node.right)
+        left_value = left.value if isinstance(left, NodeInteger) else None
+        right_value = right.value if isinstance(right, NodeInteger) else None
+
+        if left_value is not None and right_value is not None:
+            if isinstance(node, NodePlus):
+                value = left_value + right_value
+            elif isinstance(node, NodeMinus):
+                value = left_value - right_value
+            else:
+                value = left_value * right_value
+            if self._fits(left_value, right_value, value):
+                return _at(NodeInteger(value), node)
+
+        if isinstance(node, NodePlus):
+            if left_value == 0:
+                return right
+            if right_value == 0:
+                return left
+        elif isinstance(node, NodeMinus):
+            if right_value == 0:
+                return left
+        else:
+            if left_value == 1:
+                return right
+            if right_value == 1:
+                return left
+
+        if left is node.left and right is node.right:
+            return node
+        return _at(type(node)(left, right), node)
+
+    def _fold_comparison(self, node: Node) -> Node:
+        left = self.fold(node.left)
+        right = self.fold(node.right)
+        if isinstance(left, NodeInteger) and isinstance(right, NodeInteger) and self._fits(left.value, right.value):
+            if isinstance(node, NodeLessEqual):
+                return _at(NodeBoolean(left.value <= right.value), node)
+            return _at(NodeBoolean(left.value == right.value), node)
+        if left is node.left and right is node.right:
+            return node
+        return _at(type(node)(left, right), node)
+
+    def _fold_logic(self, node: Node) -> Node:
+        left = self.fold(node.left)
+        right = self.fold(node.right)
+        # (true and b) => b, (false and b) => false, (false or b) => b, (true or b) => true,
+        # the operands being evaluated left to right until the result is known. with the constant
+        # on the right, b is evaluated first: (b and true) => b, but (b and false) => false only
+        # if evaluating b cannot raise, by reading an unset variable or an overflow that traps
+        identity = isinstance(node, NodeAnd) # the constant that leaves the other operand unchanged
+        for constant, other in ((left, right), (right, left)):
+            if isinstance(constant, NodeBoolean):
+                if constant.value == identity:
+                    return other
+                if constant is left or not self._may_raise(other):
+                    return _at(NodeBoolean(not identity), node)
+        if left is node.left and right is node.right:
+            return node
+        return _at(type(node)(left, right), node)
+
+    def _fold_not(self, node: NodeNot) -> Node:
+        factor = self.fold(node.factor)
+        if isinstance(factor, NodeBoolean):
+            return _at(NodeBoolean(not factor.value), node)
+        if isinstance(factor, NodeNot):
+            return factor.factor # not (not (b)) => b
+        return node if factor is node.factor else _at(NodeNot(factor), node)
+
+    def _fold_if(self, node: NodeIf) -> Node:
+        condition = self.fold(node.condition)
+        if isinstance(condition, NodeBoolean):
+            return self.fold(node.then_branch if condition.value else node.else_branch)
+        then_branch = self.fold(node.then_branch)
+        else_branch = self.fold(node.else_branch)
+        if condition is node.condition and then_branch is node.then_branch and else_branch is node.else_branch:
+            return node
+        return _at(NodeIf(condition, then_branch, else_branch), node)
+
+    def _fold_while(self, node: NodeWhile) -> Node:
+        condition = self.fold(node.condition)
+        if isinstance(condition, NodeBoolean) and not condition.value:
+            return _at(NodeSkip(), node)
+        body = self.fold(node.body)
+        if condition is node.condition and body is node.body:
+            return node
+        return _at(NodeWhile(condition, body), node)
+
+
+def fold_constants(ast: Node, int64: bool = False, trap: bool = False) -> Node:
+    '''
+    Return the AST with constants folded and dead branches removed.
+    '''
+    return ConstantFolder(int64, trap).fold(ast)
+
+
+ARITHMETIC_NODES = (NodePlus, NodeMinus, NodeMultiply)
+BINARY_NODES = (NodePlus, NodeMinus, NodeMultiply, NodeLessEqual, NodeEqual, NodeAnd, NodeOr)
+
+class LoopOptimizer:
+    '''
+    Loop-invariant code motion and strength reduction on while loops.
+    An arithmetic subexpression whose variables are not assigned in the loop is computed once,
+    into a temporary, before the loop. A product (i * c) of a constant and an induction
+    variable, i.e. one assigned once per iteration by i := (i + d), is kept in a temporary
+    that is increased by c * d after every update of i.
+    Only expressions evaluated on every iteration are hoisted, and a transformed loop is
+    guarded by its condition, so the temporaries are only computed when the loop runs:
+        if b then t := e; while b' do c' end else skip end
+    The temporaries (__licmN, __srN) cannot clash with program variables, which start with a
+    letter; their names are listed in temporaries. A run that fails on an unset variable, or
+    on an overflow that traps, may fail on another expression than with the original loop, or
+    before running out of steps.
+    Without reduce, products are left alone: the update after the last iteration computes a
+    product the loop never does, which must not raise when overflows trap.
+    '''
+    def __init__(self, reduce: bool = True):
+        self.reduce = reduce
+        self.temporaries = []
+
+    def optimize(self, node: Node) -> Node:
+        if isinstance(node, SEQUENCE_NODES):
+            commands = sequence_commands(node)
+            optimized = [self.optimize(command) for command in commands]
+            if all(new is old for new, old in zip(optimized, commands)):
+                return node
+            return _sequence(optimized)
+        if isinstance(node, NodeIf):
+            then_branch = self.optimize(node.then_branch)
+            else_branch = self.optimize(node.else_branch)
+            if then_branch is node.then_branch and else_branch is node.else_branch:
+                return node
+            return _at(NodeIf(node.condition, then_branch, else_branch), node)
+        if isinstance(node, AffineLoop):
+            return node # runs without iterating
+        if isinstance(node, NodeWhile):
+            # inner loops first, their temporaries then count as assigned in this loop
+            return self._optimize_loop(node, self.optimize(node.body))
+        return node
+
+    def _temporary(self, prefix: str) -> str:
+        name = f"{prefix}{len(self.temporaries)}"
+        self.temporaries.append(name)
+        return name
+
+    def _optimize_loop(self, loop: NodeWhile, body: Node) -> Node:
+        commands = sequence_commands(body) if isinstance(body, SEQUENCE_NODES) else [body]
+        written = set(analyze(body).sets[body].writes)
+
+        # strength reduction: induction variables are assigned once in the body, at its top level
+        counts = _assignment_counts(body)
+        # only what runs before the first inner loop is sure to run when an iteration starts,
+        # a loop may never end and the expressions after it must not be computed early
+        reached = len(commands)
+        for index, command in enumerate(commands):
+            if _has_loop(command):
+                reached = index
+                break
+        steps = {}
+        for command in commands[:reached] if self.reduce else ():
+            if isinstance(command, NodeAssign) and counts[command.var_name] == 1:
+                step = _induction_step(command)
+                if step is not None:
+                    steps[command.var_name] = step
+        reduced = {} # (variable, factor) -> temporary
+
+        def reduce(node: Node) -> Node:
+            if isinstance(node, NodeMultiply):
+                product = _induction_product(node, steps)
+                if product is not None:
+                    if product not in reduced:
+                        reduced[product] = self._temporary('__sr')
+                    return _at(NodeIdentifier(reduced[product]), node)
+            return None
+
+        condition = _rewrite(loop.condition, reduce)
+        commands = [_rewrite_command(command, reduce) for command in commands]
+        written.update(reduced.values())
+
+        # code motion: the maximal invariant arithmetic subexpressions evaluated on every iteration
+        hoisted = {} # printed expression -> (temporary, expression)
+        evaluated = [condition]
+        for command in commands[:reached + 1]:
+            if isinstance(command, NodeAssign):
+                evaluated.append(command.expr)
+            elif isinstance(command, (NodeIf, NodeWhile)):
+                evaluated.append(command.condition)
+        for expression in evaluated:
+            for candidate in _invariant_subexpressions(expression, written):
+                key = candidate.__str__()
+                if key not in hoisted:
+                    hoisted[key] = (self._temporary('__licm'), candidate)
+
+        if not hoisted and not reduced:
+            return loop if body is loop.body else _at(NodeWhile(loop.condition, body), loop)
+
+        def hoist(node: Node) -> Node:
+            if isinstance(node, ARITHMETIC_NODES):
+                entry = hoisted.get(node.__str__())
+                if entry is not None:
+                    return _at(NodeIdentifier(entry[0]), node)
+            return None
+
+        if hoisted:
+            condition = _rewrite(condition, hoist)
+            commands = [_rewrite_command(command, hoist) for command in commands]
+
+        # update the reduced products right after their induction variable
+        updated = []
+        for command in commands:
+            updated.append(command)
+            if isinstance(command, NodeAssign) and command.var_name in steps:
+                for (name, factor), temporary in reduced.items():
+                    if name == command.var_name:
+                        updated.append(_increment(temporary, factor * steps[name], command))
+
+        prologue = [_at(NodeAssign(temporary, expression), loop) for temporary, expression in hoisted.values()]
+        for (name, factor), temporary in reduced.items():
+            product = NodeMultiply(NodeIdentifier(name), NodeInteger(factor))
+            prologue.append(_at(NodeAssign(temporary, product), loop))
+        optimized = _at(NodeWhile(condition, _sequence(updated)), loop)
+        return _at(NodeIf(loop.condition, _sequence(prologue + [optimized]), NodeSkip()), loop)
+
+
+def _at(node: Node, like: Node) -> Node:
+    # a node built by the pass takes the source position of the node it stands for
+    if hasattr(like, 'pos'):
+        node.pos = like.pos
+    return node
+
+def _sequence(commands: list) -> Node:
+    if len(commands) == 1:
+        return commands[0]
+    return _at(NodeBlock(commands), commands[0])
+
+def _variables(node: Node) -> set:
+    names = set()
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, NodeIdentifier):
+            names.add(node.name)
+        elif isinstance(node, NodeNot):
+            pending.append(node.factor)
+        elif isinstance(node, BINARY_NODES):
+            pending.append(node.right)
+            pending.append(node.left)
+    return names
+
+def _invariant_subexpressions(node: Node, written: set) -> list:
+    # the maximal arithmetic subexpressions reading variables, none of them in written, that
+    # are evaluated whenever node is: the right operand of and/or may be skipped
+    found = []
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, ARITHMETIC_NODES):
+            names = _variables(node)
+            if names and not names & written:
+                found.append(node)
+                continue
+            pending.append(node.right)
+            pending.append(node.left)
+        elif isinstance(node, (NodeAnd, NodeOr)):
+            pending.append(node.left)
+        elif isinstance(node, NodeNot):
+            pending.append(node.factor)
+        elif isinstance(node, (NodeLessEqual, NodeEqual)):
+            pending.append(node.right)
+            pending.append(node.left)
+    return found
+
+def _rewrite(node: Node, replace) -> Node:
+    # rebuild the expression top-down, replace(node) giving a replacement or None
+    replacement = replace(node)
+    if replacement is not None:
+        return replacement
+    if isinstance(node, NodeNot):
+        factor = _rewrite(node.factor, replace)
+        return node if factor is node.factor else _at(NodeNot(factor), node)
+    if isinstance(node, BINARY_NODES):
+        left = _rewrite(node.left, replace)
+        right = _rewrite(node.right, replace)
+        if left is node.left and right is node.right:
+            return node
+        return _at(type(node)(left, right), node)
+    return node
+
+def _rewrite_command(node: Node, replace) -> Node:
+    # _rewrite applied to every expression of the command
+    if isinstance(node, SEQUENCE_NODES):
+        commands = sequence_commands(node)
+        rewritten = [_rewrite_command(command, replace) for command in commands]
+        if all(new is old for new, old in zip(rewritten, commands)):
+            return node
+        return _sequence(rewritten)
+    if isinstance(node, NodeAssign):
+        expr = _rewrite(node.expr, replace)
+        return node if expr is node.expr else _at(NodeAssign(node.var_name, expr), node)
+    if isinstance(node, NodeIf):
+        condition = _rewrite(node.condition, replace)
+        then_branch = _rewrite_command(node.then_branch, replace)
+        else_branch = _rewrite_command(node.else_branch, replace)
+        if condition is node.condition and then_branch is node.then_branch and else_branch is node.else_branch:
+            return node
+        return _at(NodeIf(condition, then_branch, else_branch), node)
+    if isinstance(node, AffineLoop):
+        return node # its closed form reads the expressions as they are
+    if isinstance(node, NodeWhile):
+        condition = _rewrite(node.condition, replace)
+        body = _rewrite_command(node.body, replace)
+        if condition is node.condition and body is node.body:
+            return node
+        return _at(NodeWhile(condition, body), node)
+    return node
+
+def _assignment_counts(node: Node) -> dict:
+    counts = {}
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, SEQUENCE_NODES):
+            pending.extend(sequence_commands(node))
+        elif isinstance(node, NodeAssign):
+            counts[node.var_name] = counts.get(node.var_name, 0) + 1
+        elif isinstance(node, NodeIf):
+            pending.append(node.then_branch)
+            pending.append(node.else_branch)
+        elif isinstance(node, NodeWhile):
+            pending.append(node.body)
+    return counts
+
+def _has_loop(node: Node) -> bool:
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, NodeWhile):
+            return True
+        if isinstance(node, SEQUENCE_NODES):
+            pending.extend(sequence_commands(node))
+        elif isinstance(node, NodeIf):
+            pending.append(node.then_branch)
+            pending.append(node.else_branch)
+    return False
+
+def _induction_step(node: NodeAssign) -> int:
+    # d for i := (i + d), (d + i) or (i - d) with an integer constant d, None otherwise
+    expr = node.expr
+    name = node.var_name
+    if isinstance(expr, NodePlus):
+        for variable, constant in ((expr.left, expr.right), (expr.right, expr.left)):
+            if isinstance(variable, NodeIdentifier) and variable.name == name and isinstance(constant, NodeInteger):
+                return constant.value
+    elif isinstance(expr, NodeMinus):
+        if isinstance(expr.left, NodeIdentifier) and expr.left.name == name and isinstance(expr.right, NodeInteger):
+            return -expr.right.value
+    return None
+
+def _induction_product(node: NodeMultiply, steps: dict) -> tuple:
+    # (variable, factor) for (i * c) or (c * i) with an induction variable i, None otherwise
+    for variable, constant in ((node.left, node.right), (node.right, node.left)):
+        if isinstance(variable, NodeIdentifier) and variable.name in steps and isinstance(constant, NodeInteger):
+            return (variable.name, constant.value)
+    return None
+
+def _increment(name: str, step: int, like: Node) -> Node:
+    if step < 0:
+        expr = NodeMinus(NodeIdentifier(name), NodeInteger(-step))
+    else:
+        expr = NodePlus(NodeIdentifier(name), NodeInteger(step))
+    return _at(NodeAssign(name, expr), like)
+
+
+def optimize_loops(ast: Node) -> Node:
+    '''
+    Return the AST with loop invariants hoisted and induction products strength-reduced.
+    '''
+    return LoopOptimizer().optimize(ast)
+
+
+class LoopAccelerator:
+    '''
+    Replace the affine counting loops by AffineLoops (see closed_form), which compute the
+    memory they leave in closed form instead of iterating, whenever the values allow it.
+    '''
+    def accelerate(self, node: Node) -> Node:
+        if isinstance(node, SEQUENCE_NODES):
+            commands = sequence_commands(node)
+            accelerated = [self.accelerate(command) for command in commands]
+            if all(new is old for new, old in zip(accelerated, commands)):
+                return node
+            return _sequence(accelerated)
+        if isinstance(node, NodeIf):
+            then_branch = self.accelerate(node.then_branch)
+            else_branch = self.accelerate(node.else_branch)
+            if then_branch is node.then_branch and else_branch is node.else_branch:
+                return node
+            return _at(NodeIf(node.condition, then_branch, else_branch), node)
+        if isinstance(node, NodeWhile):
+            body = self.accelerate(node.body)
+            loop = node if body is node.body else _at(NodeWhile(node.condition, body), node)
+            return recognize(loop) or loop
+        return node
+
+
+def accelerate_loops(ast: Node) -> Node:
+    '''
+    Return the AST with its affine counting loops computed in closed form.
+    '''
+    return LoopAccelerator().accelerate(ast)
+
+
+class Int64Rewriter:
+    '''
+    Give the arithmetic of the AST 64-bit two's complement semantics: every +, - and * result
+    goes through a NodeInt64, which wraps it around or, with trap, raises OverflowError.
+    Integer constants outside 64 bits are wrapped, or raise when evaluated with trap. Closed
+    form loops keep wrapping results (see AffineLoop), with trap they are iterated.
+    '''
+    def __init__(self, trap: bool = False):
+        self.trap = trap
+
+    def rewrite(self, node: Node) -> Node:
+        if isinstance(node, SEQUENCE_NODES):
+            commands = sequence_commands(node)
+            rewritten = [self.rewrite(command) for command in commands]
+            if all(new is old for new, old in zip(rewritten, commands)):
+                return node
+            return _sequence(rewritten)
+        if isinstance(node, NodeAssign):
+            expr = self.rewrite(node.expr)
+            return node if expr is node.expr else _at(NodeAssign(node.var_name, expr), node)
+        if isinstance(node, NodeIf):
+            condition = self.rewrite(node.condition)
+            then_branch = self.rewrite(node.then_branch)
+            else_branch = self.rewrite(node.else_branch)
+            if condition is node.condition and then_branch is node.then_branch and else_branch is node.else_branch:
+                return node
+            return _at(NodeIf(condition, then_branch, else_branch), node)
+        if isinstance(node, NodeWhile):
+            loop = _at(NodeWhile(self.rewrite(node.condition), self.rewrite(node.body)), node)
+            if isinstance(node, AffineLoop) and not self.trap:
+                return AffineLoop(loop, node.induction, node.step, node.bound, node.exclusive, node.updates, wrap=True)
+            return loop
+        if isinstance(node, ARITHMETIC_NODES):
+            return _at(NodeInt64(_at(type(node)(self.rewrite(node.left), self.rewrite(node.right)), node), self.trap), node)
+        if isinstance(node, NodeInteger):
+            if INT64_MIN <= node.value <= INT64_MAX:
+                return node
+            if self.trap:
+                return _at(NodeInt64(node, True), node)
+            return _at(NodeInteger(wrap_int64(node.value)), node)
+        if isinstance(node, NodeNot):
+            factor = self.rewrite(node.factor)
+            return node if factor is node.factor else _at(NodeNot(factor), node)
+        if isinstance(node, BINARY_NODES):
+            left = self.rewrite(node.left)
+            right = self.rewrite(node.right)
+            if left is node.left and right is node.right:
+                return node
+            return _at(type(node)(left, right), node)
+        return node # identifiers, booleans and skip
+
+
+def to_int64(ast: Node, trap: bool = False) -> Node:
+    '''
+    Return the AST with 64-bit arithmetic, wrapping around or, with trap, raising on overflow.
+    '''
+    return Int64Rewriter(trap).rewrite(ast)
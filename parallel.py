@@ -0,0 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import time
+
+import imp_interpreter
+import limits
+import vm
+
+# the parallel runner spreads (program, memory) jobs over a pool of worker processes.
+# programs are parsed once in the parent and shipped to every worker as serialized
+# bytecode when the pool starts, so a job only carries a program id and its memory.
+# the temporaries of the loop optimizer go along and are removed from the results.
+# jobs are sent in chunks to amortize the inter-process round trips.
+
+_worker_programs = {} # program id -> (BytecodeProgram, its temporaries), in each worker process
+_worker_limits = (None, None) # (max_steps, timeout) of every job, in each worker process
+
+def _init_worker(serialized_programs: dict, job_limits: tuple):
+    global _worker_limits
+    _worker_programs.clear()
+    for program_id, (data, temporaries) in serialized_programs.items():
+        _worker_programs[program_id] = (vm.BytecodeProgram.from_bytes(data), temporaries)
+    _worker_limits = job_limits
+
+def _run_chunk(chunk: list) -> list:
+    # chunk is a list of (index, program id, memory); returns JobResults
+    results = []
+    max_steps, timeout = _worker_limits
+    budgeted = max_steps is not None or timeout is not None
+    for index, program_id, memory in chunk:
+        start = time.perf_counter()
+        program, temporaries = _worker_programs[program_id]
+        try:
+            budget = limits.Budget(max_steps, timeout) if budgeted else None
+            program.execute(memory, budget)
+            error = None
+        except Exception as e:
+            error = e
+        for name in temporaries:
+            memory.pop(name, None)
+        results.append(JobResult(index, program_id, memory, error, time.perf_counter() - start, os.getpid()))
+    return results
+
+
+class JobResult:
+    def __init__(self, index: int, program_id: int, memory: dict, error: Exception, wall_time: float, worker: int):
+        self.index = index           # position of the job in the submitted jobs
+        self.program_id = program_id
+        self.memory = memory         # final memory (a copy made by the worker), None if the job failed
+        self.error = error           # exception raised by the job, None on success
+        self.wall_time = wall_time   # seconds spent running the job in the worker
+        self.worker = worker         # pid of the worker process
+        if error is not None:
+            self.memory = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f"error={self.error!r}"
+        return f"JobResult(index={self.index}, program={self.program_id}, {status}, wall_time={self.wall_time:.6f})"
+
+
+class ParallelRunner:
+    '''
+    Run many (program, memory) jobs on a process pool.
+    Register programs with add_program, then call run with the jobs; results are
+    yielded in completion order. max_steps and timeout bound every job as in
+    IMPInterpreter.run, so a runaway job cannot hold a worker. undefined is the mode of
+    IMPInterpreter: with 'error', a job whose memory lacks variables its program may read
+    before assigning them fails in the parent, without being sent to a worker, and so does a
+    job whose memory the integers mode of its program rejects (see IMPInterpreter.check_integers).
+    '''
+    def __init__(self, max_workers: int = None, chunk_size: int = 64, max_steps: int = None,
+                 timeout: float = None, undefined: str = 'ignore'):
+        if undefined not in ('ignore', 'warn', 'error'):
+            raise ValueError(f"Unknown undefined mode '{undefined}', expected 'ignore', 'warn' or 'error'")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.undefined = undefined
+        self.programs = {} # program id -> (serialized bytecode, temporaries of the loop optimizer)
+        self.dataflows = {} # program id -> analysis.Dataflow, to check the memories of the jobs
+        self.lines = {} # program id -> LineTable of its source, to locate the reads in errors
+        self.integer_checks = {} # program id -> IMPInterpreter.check_integers, for the 64-bit modes
+
+    def add_program(self, program) -> int:
+        '''
+        Register a program, given as source text or as an IMPInterpreter, and return its id.
+        '''
+        if not isinstance(program, imp_interpreter.IMPInterpreter):
+            program = imp_interpreter.IMPInterpreter(program)
+        program_id = len(self.programs)
+        data = program.compile('vm').to_bytes()
+        program.program_ast() # the bytecode may come from the parse cache, this lists the temporaries
+        self.programs[program_id] = (data, list(program.temporaries))
+        self.dataflows[program_id] = program.dataflow()
+        self.lines[program_id] = program.lines
+        if program.integers != 'unbounded':
+            self.integer_checks[program_id] = program.check_integers
+        return program_id
+
+    def run(self, jobs):
+        '''
+        Run the jobs, an iterable of (program id, memory) pairs, and yield a JobResult for
+        each of them as soon as its chunk completes. JobResult.index gives the job's position.
+        Jobs rejected by the undefined or integers mode are yielded first.
+        '''
+        chunks = []
+        chunk = []
+        rejected = []
+        for index, (program_id, memory) in enumerate(jobs):
+            if program_id not in self.programs:
+                raise KeyError(f"Unknown program id {program_id}")
+            check_integers = self.integer_checks.get(program_id)
+            if self.undefined != 'ignore' or check_integers is not None:
+                try:
+                    if check_integers is not None:
+                        check_integers(memory)
+                    if self.undefined != 'ignore':
+                        self.dataflows[program_id].check(memory, self.lines[program_id], self.undefined)
+                except Exception as e:
+                    rejected.append(JobResult(index, program_id, memory, e, 0.0, os.getpid()))
+                    continue
+            chunk.append((index, program_id, memory))
+            if len(chunk) == self.chunk_size:
+                chunks.append(chunk)
+                chunk = []
+        if chunk:
+            chunks.append(chunk)
+        yield from rejected
+        if not chunks:
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=min(self.max_workers, len(chunks)),
+            initializer=_init_worker,
+            initargs=(self.programs, (self.max_steps, self.timeout)),
+        ) as pool:
+            futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                yield from future.result()
+
+    def run_all(self, jobs) -> list:
+        '''
+        Run the jobs and return their JobResults in job order.
+        '''
+        results = list(self.run(jobs))
+        results.sort(key=lambda result: result.index)
+        return results
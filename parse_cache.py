@@ -0,0 +1,132 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import tempfile
+
+from nodes import Node
+
+# bump when the node classes change in a way that makes old pickles unusable. a cache file holds
+# two pickles, the version and then the AST, so a stale AST is never unpickled
+FORMAT_VERSION = 5
+
+class CacheEntry:
+    def __init__(self, ast):
+        self.ast = ast
+        # (backend name, options) -> compiled program, filled in by IMPInterpreter.compile.
+        # compiled programs live in memory only, closures cannot be pickled.
+        self.compiled = {}
+
+
+class ParseCache:
+    '''
+    LRU cache of parsed programs keyed by the SHA-256 of their source.
+    At most max_entries ASTs are kept in memory, the least recently used one is evicted first.
+    If directory is given, ASTs are also pickled there so they survive process restarts.
+    '''
+    def __init__(self, max_entries: int = 256, directory: str = None):
+        if max_entries < 1:
+            raise ValueError("ParseCache needs room for at least one entry")
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict() # key -> CacheEntry, least recently used first
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(source: str) -> str:
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get(self, source: str):
+        '''
+        Return the CacheEntry of the source, or None if it was never parsed.
+        '''
+        key = self.key(source)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        ast = self._load(key)
+        if ast is not None:
+            self.disk_hits += 1
+            return self._insert(key, CacheEntry(ast))
+
+        self.misses += 1
+        return None
+
+    def put(self, source: str, ast):
+        '''
+        Cache the AST of the source and return its CacheEntry.
+        '''
+        key = self.key(source)
+        entry = self._insert(key, CacheEntry(ast))
+        self._save(key, ast)
+        return entry
+
+    def clear(self):
+        '''
+        Drop the in-memory entries; the on-disk cache is kept.
+        '''
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _insert(self, key: str, entry: CacheEntry) -> CacheEntry:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def _load(self, key: str):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                if pickle.load(f) != FORMAT_VERSION:
+                    return None # written by another version, parse the program again
+                ast = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # unreadable or truncated file, parse the program again
+            return None
+        return ast if isinstance(ast, Node) else None
+
+    def _save(self, key: str, ast):
+        if self.directory is None:
+            return
+        try:
+            data = pickle.dumps(FORMAT_VERSION) + pickle.dumps(ast, protocol=pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # pickle recurses along the AST, very deep trees are only cached in memory
+            return
+        # write to a temporary file first so concurrent readers never see a partial pickle
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
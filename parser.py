@@ -1,27 +1,132 @@
-from token import TokenType, Token
-import token
-from lexer import Lexer
+from collections import deque
+
+from imp_token import TokenType, Token
+from lexer import Lexer, LineTable
 from nodes import *
 
 
+class TokenStream:
+    '''
+    Indexable view over a token iterator. Tokens are pulled on demand and only the
+    last `window` of them are kept, which bounds the parser's lookahead and rollback.
+    '''
+    def __init__(self, tokens, window: int = 16):
+        self.iterator = iter(tokens)
+        self.window = window
+        self.buffer = deque() # holds tokens[self.start:]
+        self.start = 0
+        self.exhausted = False
+
+    def get(self, index: int):
+        '''
+        Return the token at index, or None past the end of the input.
+        '''
+        if index < self.start:
+            raise SyntaxError(f"Token {index} is no longer buffered (window of {self.window} tokens)")
+        buffer = self.buffer
+        while index >= self.start + len(buffer):
+            if self.exhausted:
+                return None
+            try:
+                buffer.append(next(self.iterator))
+            except StopIteration:
+                self.exhausted = True
+                return None
+            if len(buffer) > self.window:
+                buffer.popleft()
+                self.start += 1
+        return buffer[index - self.start]
+
+
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
+    def __init__(self, tokens, lines: LineTable = None, trace=None):
+        '''
+        tokens is either a list of tokens or any iterable of them (e.g. a StreamLexer),
+        which is then consumed lazily through a TokenStream.
+        With the LineTable of the source, syntax errors give the line and column of the
+        offending token instead of its offset.
+        trace is a hook called with the first token of every command parsed, see tracing.
+        '''
+        self.lines = lines
+        self.trace = trace
+        if trace is not None:
+            # installed once here, so parsing without a hook does no checks at all
+            parse_atomic_command = self.parse_Atomic_Command
+            def traced_parse_atomic_command():
+                token = self._get_next_token()
+                trace('parse.command', -1 if token is None else token.pos, token)
+                return parse_atomic_command()
+            self.parse_Atomic_Command = traced_parse_atomic_command
         self.pos = -1
-        self.length = len(tokens)
+        if isinstance(tokens, list):
+            self.tokens = tokens
+            self.length = len(tokens)
+            self.stream = None
+        else:
+            self.tokens = None
+            self.length = None
+            self.stream = TokenStream(tokens)
 
     def parse(self):
-        cst =  self.parse_Command()
-        # it should reach the end of Command parsing
-        if self._get_next_token() is not None:
-            raise SyntaxError("Unexpected token after parsing Command")
-        
+        try:
+            cst =  self.parse_Command()
+            # it should reach the end of Command parsing
+            if self._get_next_token() is not None:
+                raise SyntaxError("Unexpected token after parsing Command")
+        except SyntaxError as e:
+            # errors are raised with the offending token next in the input
+            raise SyntaxError(f"{e.msg} {self._location()}") from None
+
         return cst
 
+    def parse_commands(self):
+        '''
+        Parse the whole input as its list of top-level commands, i.e. the commands of the
+        outermost sequence. Also returns the source offsets of the ';' tokens between them,
+        which incremental re-parsing uses as boundaries.
+        '''
+        try:
+            commands = []
+            separators = []
+            while True:
+                command = self.parse_Atomic_Command()
+                if command is None:
+                    raise SyntaxError("Invalid Command")
+                commands.append(command)
+                token = self._get_next_token()
+                if token is None:
+                    break
+                if token.type != TokenType.SEQ:
+                    raise SyntaxError("Unexpected token after parsing Command")
+                separators.append(token.pos)
+                self._advance() # consume ';'
+        except SyntaxError as e:
+            raise SyntaxError(f"{e.msg} {self._location()}") from None
+        return commands, separators
+
+    def _location(self) -> str:
+        token = self._get_next_token()
+        if token is None:
+            return "at end of input"
+        if token.pos < 0:
+            return f"at token {self.pos + 1}"
+        if self.lines is None:
+            return f"at position {token.pos}"
+        return self.lines.describe(token.pos)
+
+    def _at(self, node: Node, token: Token) -> Node:
+        # record the source offset of the node's first token
+        node.pos = token.pos
+        return node
+
     def _has_next_token(self):
+        if self.stream is not None:
+            return self.stream.get(self.pos + 1) is not None
         return (self.pos + 1 < self.length)   
 
     def _get_next_token(self):
+        if self.stream is not None:
+            return self.stream.get(self.pos + 1)
         return self.tokens[self.pos + 1] if self._has_next_token() else None
     
     def _advance(self):
@@ -37,32 +142,17 @@ class Parser:
         
         if token.type == TokenType.INT:
             self._advance() # consume INT
-            return NodeInteger(token.value)
+            return self._at(NodeInteger(token.value), token)
         
         if token.type == TokenType.VAR:
             self._advance() # consume VAR
-            return NodeIdentifier(token.value)
+            return self._at(NodeIdentifier(token.value), token)
         
         if token.type == TokenType.LPAREN:
-            self._advance() # consume '('
-            left_node = self.parse_AExpression()
-            op_token = self._get_next_token()
-            if op_token is None or op_token.type not in {TokenType.PLUS, TokenType.MINUS, TokenType.MUL}:
-                raise SyntaxError(f"Invalid operator {op_token} in AExpression")
-            self._advance() # consume operator
-            right_node = self.parse_AExpression()
-            closing_token = self._get_next_token()
-            if closing_token is None or closing_token.type != TokenType.RPAREN:
-                raise SyntaxError("Expected ')' at the end of AExpression")
-            self._advance() # consume ')'
-
-            # valid expression, create corresponding node
-            if op_token.type == TokenType.PLUS:
-                return NodePlus(left_node, right_node)
-            elif op_token.type == TokenType.MINUS:
-                return NodeMinus(left_node, right_node)
-            elif op_token.type == TokenType.MUL:
-                return NodeMultiply(left_node, right_node)
+            node, is_boolean = self._parse_parenthesized()
+            if is_boolean:
+                raise SyntaxError(f"Expected AExpression but found BExpression {node}")
+            return node
             
         return None # we should not raise error here, since it may be part of BExpression
 
@@ -76,104 +166,138 @@ class Parser:
         
         if token.type == TokenType.TRUE:
             self._advance() # consume 'true'
-            return NodeBoolean(True)
+            return self._at(NodeBoolean(True), token)
         
         if token.type == TokenType.FALSE:
             self._advance() # consume 'false'
-            return NodeBoolean(False)
+            return self._at(NodeBoolean(False), token)
         
         if token.type == TokenType.NOT:
             self._advance() # consume 'not'
             if self._get_next_token() is None or self._get_next_token().type != TokenType.LPAREN:
                 raise SyntaxError("Expected '(' after 'not' in BExpression")
+            self._advance() # consume '('
             factor_node = self.parse_BExpression()
+            if factor_node is None:
+                raise SyntaxError("Invalid BExpression after 'not'")
             if self._get_next_token() is None or self._get_next_token().type != TokenType.RPAREN:
                 raise SyntaxError("Expected ')' after BExpression in 'not' operation")
             self._advance() # consume ')'
-            return NodeNot(factor_node)
+            return self._at(NodeNot(factor_node), token)
         
-
         if token.type == TokenType.LPAREN:
-            # hit '(' it could be '(' AExpression '<=/=' AExpression ')' or '(' BExpression 'and/or' BExpression ')'
-            # try one of them, if one fails, need to rollback and try other options
-            
-            current_pos = self.pos # save current position for rollback
-
-             # try '(' AExpression '<=/=' AExpression ')'
-            self._advance() # consume '('
-            left_aexpr = self.parse_AExpression()
-            if left_aexpr is None:
-                # rollback, try '(' BExpression 'and/or' BExpression ')'
-                self.pos = current_pos
-                self._advance() # consume '('
-                left_bexpr = self.parse_BExpression()
-                if left_bexpr is None:
-                    raise SyntaxError("Invalid BExpression after '('")
-                op_token = self._get_next_token()
-                if op_token is None or op_token.type not in {TokenType.AND, TokenType.OR}:
-                    raise SyntaxError(f"Invalid operator {op_token} in BExpression")
-                self._advance() # consume operator
-                right_bexpr = self.parse_BExpression()
-                closing_token = self._get_next_token()
-                if closing_token is None or closing_token.type != TokenType.RPAREN:
-                    raise SyntaxError("Expected ')' at the end of BExpression")
-                self._advance() # consume ')'
-
-                # valid expression, create corresponding node
-                if op_token.type == TokenType.AND:
-                    return NodeAnd(left_bexpr, right_bexpr)
-                elif op_token.type == TokenType.OR:
-                    return NodeOr(left_bexpr, right_bexpr)
-            else:
-                # success parsing left AExpression
-                op_token = self._get_next_token()
-                if op_token is None or op_token.type not in {TokenType.LE, TokenType.EQ}:
-                    raise SyntaxError(f"Invalid operator {op_token} in BExpression")
-                self._advance() # consume operator
-                right_aexpr = self.parse_AExpression()
-                closing_token = self._get_next_token()
-                if closing_token is None or closing_token.type != TokenType.RPAREN:
-                    raise SyntaxError("Expected ')' at the end of BExpression")
-                self._advance() # consume ')'
-
-                # valid expression, create corresponding node
-                if op_token.type == TokenType.LE:
-                    return NodeLessEqual(left_aexpr, right_aexpr)
-                elif op_token.type == TokenType.EQ:
-                    return NodeEqual(left_aexpr, right_aexpr)
+            node, is_boolean = self._parse_parenthesized()
+            if not is_boolean:
+                raise SyntaxError(f"Expected BExpression but found AExpression {node}")
+            return node
         
         return None
+
+    def _parse_parenthesized(self):
+        '''
+        '(' Operand op Operand ')', where the kind of the expression is only known once op is seen:
+        '+/-/*' gives an AExpression, '<=/=' and 'and/or' give a BExpression.
+        Parsing the left operand without committing to a kind avoids backtracking, so every token
+        is read once. Returns the node and whether it is a BExpression.
+        '''
+        open_token = self._get_next_token()
+        self._advance() # consume '('
+        left_node, left_is_boolean = self._parse_operand()
+        op_token = self._get_next_token()
+        if op_token is None:
+            raise SyntaxError("Unexpected end of input after '('")
+
+        if op_token.type in {TokenType.PLUS, TokenType.MINUS, TokenType.MUL, TokenType.LE, TokenType.EQ}:
+            if left_is_boolean:
+                raise SyntaxError(f"Invalid operator {op_token} after BExpression")
+            self._advance() # consume operator
+            right_node = self.parse_AExpression()
+            if right_node is None:
+                raise SyntaxError(f"Invalid AExpression after {op_token}")
+        elif op_token.type in {TokenType.AND, TokenType.OR}:
+            if not left_is_boolean:
+                raise SyntaxError(f"Invalid operator {op_token} after AExpression")
+            self._advance() # consume operator
+            right_node = self.parse_BExpression()
+            if right_node is None:
+                raise SyntaxError(f"Invalid BExpression after {op_token}")
+        else:
+            raise SyntaxError(f"Invalid operator {op_token} in expression")
+
+        closing_token = self._get_next_token()
+        if closing_token is None or closing_token.type != TokenType.RPAREN:
+            raise SyntaxError("Expected ')' at the end of expression")
+        self._advance() # consume ')'
+
+        # valid expression, create corresponding node
+        if op_token.type == TokenType.PLUS:
+            node, is_boolean = NodePlus(left_node, right_node), False
+        elif op_token.type == TokenType.MINUS:
+            node, is_boolean = NodeMinus(left_node, right_node), False
+        elif op_token.type == TokenType.MUL:
+            node, is_boolean = NodeMultiply(left_node, right_node), False
+        elif op_token.type == TokenType.LE:
+            node, is_boolean = NodeLessEqual(left_node, right_node), True
+        elif op_token.type == TokenType.EQ:
+            node, is_boolean = NodeEqual(left_node, right_node), True
+        elif op_token.type == TokenType.AND:
+            node, is_boolean = NodeAnd(left_node, right_node), True
+        else:
+            node, is_boolean = NodeOr(left_node, right_node), True
+        return self._at(node, open_token), is_boolean
+
+    def _parse_operand(self):
+        '''
+        Parse an AExpression or a BExpression, deciding on the next token only.
+        Returns the node and whether it is a BExpression.
+        '''
+        token = self._get_next_token()
+        if token is None:
+            raise SyntaxError("Unexpected end of input while parsing expression")
+        if token.type in {TokenType.INT, TokenType.VAR}:
+            return self.parse_AExpression(), False
+        if token.type in {TokenType.TRUE, TokenType.FALSE, TokenType.NOT}:
+            return self.parse_BExpression(), True
+        if token.type == TokenType.LPAREN:
+            return self._parse_parenthesized()
+        raise SyntaxError(f"Unexpected token {token} in expression")
     
 
     def parse_Command(self):
         '''
         Command ::=  Command ';' Command
         '''
-        left_node = self.parse_Atomic_Command()
+        first_node = self.parse_Atomic_Command()
+        commands = [first_node]
         token = self._get_next_token()
+        if first_node is None and token is not None and token.type == TokenType.SEQ:
+            raise SyntaxError("Invalid Command before ';' in sequence")
         while token is not None and token.type == TokenType.SEQ:
             self._advance() # consume ';'
             right_node = self.parse_Atomic_Command()
             if right_node is None:
-                raise SyntaxError(f"Invalid Command after ';' in sequence at position {self.pos}")
-            left_node = NodeSequence(left_node, right_node)
+                raise SyntaxError("Invalid Command after ';' in sequence")
+            commands.append(right_node)
             token = self._get_next_token()
 
-        return left_node
+        if len(commands) == 1:
+            return first_node
+        block = NodeBlock(commands)
+        block.pos = first_node.pos # a sequence starts where its first command does
+        return block
 
     def parse_Atomic_Command(self):
         '''
         'skip' | VAR ':=' AExpression | 'if' BExpression 'then' Command 'else' Command 'end' | 'while' BExpression 'do' Command 'end' 
         '''
         token = self._get_next_token()
-        print(token)
 
         if token is None:
             raise SyntaxError("Unexpected end of input while parsing Command")
         
         if token.type == TokenType.SKIP:
             self._advance() # consume 'skip'
-            return NodeSkip()
+            return self._at(NodeSkip(), token)
         
         if token.type == TokenType.VAR:
             var_name = token.value
@@ -185,7 +309,7 @@ class Parser:
             aexpr_node = self.parse_AExpression()
             if aexpr_node is None:
                 raise SyntaxError("Invalid AExpression in assignment")
-            return NodeAssign(var_name, aexpr_node)
+            return self._at(NodeAssign(var_name, aexpr_node), token)
         
         if token.type == TokenType.IF:
             self._advance() # consume 'if'
@@ -206,7 +330,7 @@ class Parser:
             if end_token is None or end_token.type != TokenType.END:
                 raise SyntaxError("Expected 'end' at the end of if statement")
             self._advance() # consume 'end'
-            return NodeIf(bexpr_node, then_command, else_command)
+            return self._at(NodeIf(bexpr_node, then_command, else_command), token)
         
         if token.type == TokenType.WHILE:
             self._advance() # consume 'while'
@@ -222,7 +346,7 @@ class Parser:
             if end_token is None or end_token.type != TokenType.END:
                 raise SyntaxError("Expected 'end' at the end of while statement")
             self._advance() # consume 'end'
-            return NodeWhile(bexpr_node, do_command)
+            return self._at(NodeWhile(bexpr_node, do_command), token)
             
         return None
     
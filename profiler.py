@@ -0,0 +1,223 @@
+import json
+import marshal
+import time
+
+from lexer import LineTable
+from nodes import *
+
+# the profiler runs an instrumented copy of the AST: every node except the sequences is
+# wrapped in a ProfiledNode that counts its evaluations and times them. the wrappers sit
+# between a node and its children, so the node classes and the normal eval path are left
+# untouched and cost nothing when profiling is off.
+
+class ProfiledNode(Node):
+    __slots__ = ('node', 'index', 'parent', 'children', 'count', 'total')
+
+    def __init__(self, node: Node, index: int, parent: int):
+        self.node = node        # the instrumented copy of the profiled node
+        self.index = index      # preorder number of the node in the program
+        self.parent = parent    # index of the closest profiled ancestor, None for the top level
+        self.children = []      # indices of the closest profiled descendants
+        self.count = 0          # number of evaluations
+        self.total = 0          # nanoseconds spent in the node, children included
+
+    def eval(self, memory: dict):
+        start = time.perf_counter_ns()
+        try:
+            return self.node.eval(memory)
+        finally:
+            self.total += time.perf_counter_ns() - start
+            self.count += 1
+
+    def __str__(self):
+        return self.node.__str__()
+
+
+class Profiler:
+    '''
+    Per-node execution counts and times of a program.
+    run can be called several times, the statistics add up.
+    With the LineTable of the source, nodes are reported with their line and column,
+    and annotate can list the source with the time spent on each line.
+    '''
+    def __init__(self, ast: Node, lines: LineTable = None, filename: str = '<imp>'):
+        self.ast = ast
+        self.lines = lines
+        self.filename = filename
+        self.entries = [] # ProfiledNode of every profiled node, by index
+        self.originals = [] # the original node of every entry
+        self.program = self._instrument(ast, None)
+        self.runs = 0
+        self.total = 0 # nanoseconds spent in run
+
+    def run(self, memory: dict) -> dict:
+        start = time.perf_counter_ns()
+        try:
+            self.program.eval(memory)
+        finally:
+            self.total += time.perf_counter_ns() - start
+            self.runs += 1
+        return memory
+
+    def _instrument(self, node: Node, parent: int) -> Node:
+        if isinstance(node, SEQUENCE_NODES):
+            # sequences are only structure: their commands are profiled
+            return NodeBlock([self._instrument(command, parent) for command in sequence_commands(node)])
+
+        entry = ProfiledNode(None, len(self.entries), parent)
+        self.entries.append(entry)
+        self.originals.append(node)
+        if parent is not None:
+            self.entries[parent].children.append(entry.index)
+
+        # copy the node, with its child nodes replaced by their instrumented versions
+        copy = object.__new__(type(node))
+        for cls in type(node).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if not hasattr(node, name):
+                    continue # e.g. no source position
+                value = getattr(node, name)
+                if isinstance(value, Node):
+                    value = self._instrument(value, entry.index)
+                setattr(copy, name, value)
+        entry.node = copy
+        return entry
+
+    # --- results ---
+
+    def self_time(self, entry: ProfiledNode) -> int:
+        '''
+        Nanoseconds spent in the node itself, its profiled children excluded.
+        '''
+        return entry.total - sum(self.entries[child].total for child in entry.children)
+
+    def kind(self, entry: ProfiledNode) -> str:
+        name = type(self.originals[entry.index]).__name__
+        return name[4:].lower() if name.startswith('Node') else name
+
+    def position(self, entry: ProfiledNode) -> tuple:
+        '''
+        (line, column) of the node in the source, or None if unknown.
+        '''
+        pos = getattr(self.originals[entry.index], 'pos', -1)
+        if self.lines is None or pos < 0:
+            return None
+        return self.lines.position(pos)
+
+    def location(self, entry: ProfiledNode) -> str:
+        position = self.position(entry)
+        return '?' if position is None else f"{position[0]}:{position[1]}"
+
+    def text(self, entry: ProfiledNode, width: int = 60) -> str:
+        text = self.originals[entry.index].__str__()
+        return text if len(text) <= width else text[:width - 3] + '...'
+
+    def hot_spots(self, limit: int = None) -> list:
+        '''
+        Entries of the evaluated nodes, by decreasing self time.
+        '''
+        entries = [entry for entry in self.entries if entry.count]
+        entries.sort(key=self.self_time, reverse=True)
+        return entries if limit is None else entries[:limit]
+
+    def report(self, limit: int = 20) -> str:
+        '''
+        Return a table of the nodes with the most self time.
+        '''
+        total = self.total or 1
+        lines = [
+            f"{self.runs} run(s), {self.total / 1e6:.3f} ms",
+            f"{'count':>10}  {'total ms':>10}  {'self ms':>10}  {'self %':>6}  {'line:col':>9}  {'kind':<10}  source",
+        ]
+        for entry in self.hot_spots(limit):
+            self_time = self.self_time(entry)
+            lines.append(
+                f"{entry.count:>10}  {entry.total / 1e6:>10.3f}  {self_time / 1e6:>10.3f}  "
+                f"{100 * self_time / total:>6.1f}  {self.location(entry):>9}  {self.kind(entry):<10}  {self.text(entry)}"
+            )
+        return "\n".join(lines)
+
+    def annotate(self) -> str:
+        '''
+        Return the source with, on each line, the self time of the nodes starting there and
+        the highest evaluation count among them. Needs a LineTable holding the source text.
+        '''
+        if self.lines is None or self.lines.text is None:
+            raise ValueError("Profiler error: annotate needs the LineTable of the source text")
+        per_line = {} # line -> [count, self time]
+        for entry in self.entries:
+            position = self.position(entry)
+            if position is None:
+                continue
+            stats = per_line.setdefault(position[0], [0, 0])
+            stats[0] = max(stats[0], entry.count)
+            stats[1] += self.self_time(entry)
+        total = self.total or 1
+        lines = [f"{'count':>10}  {'self ms':>10}  {'%':>5}  {'line':>5}  source"]
+        for number in range(1, self.lines.line_count() + 1):
+            count, self_time = per_line.get(number, (0, 0))
+            if count:
+                prefix = f"{count:>10}  {self_time / 1e6:>10.3f}  {100 * self_time / total:>5.1f}"
+            else:
+                prefix = f"{'':>10}  {'':>10}  {'':>5}"
+            lines.append(f"{prefix}  {number:>5}  {self.lines.source_line(number)}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        '''
+        The statistics as plain data, times in seconds.
+        '''
+        nodes = []
+        for entry in self.entries:
+            line, column = self.position(entry) or (None, None)
+            nodes.append({
+                'index': entry.index,
+                'parent': entry.parent,
+                'line': line,
+                'column': column,
+                'kind': self.kind(entry),
+                'source': self.text(entry),
+                'count': entry.count,
+                'total_time': entry.total / 1e9,
+                'self_time': self.self_time(entry) / 1e9,
+            })
+        return {'runs': self.runs, 'total_time': self.total / 1e9, 'nodes': nodes}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def stats(self) -> dict:
+        '''
+        The statistics in the format of the profile and cProfile modules,
+        every node being a function called by its parent node.
+        '''
+        # pstats identifies functions by (file name, line number, function name)
+        keys = []
+        seen = set()
+        for entry in self.entries:
+            position = self.position(entry)
+            if position is None:
+                key = (self.filename, 0, f"{self.kind(entry)} #{entry.index} {self.text(entry, 40)}")
+            else:
+                key = (self.filename, position[0], f"{self.kind(entry)}:{position[1]} {self.text(entry, 40)}")
+            if key in seen:
+                key = (key[0], key[1], f"{key[2]} #{entry.index}")
+            seen.add(key)
+            keys.append(key)
+
+        stats = {}
+        for entry in self.entries:
+            seconds = entry.total / 1e9
+            self_seconds = self.self_time(entry) / 1e9
+            callers = {}
+            if entry.parent is not None:
+                callers[keys[entry.parent]] = (entry.count, entry.count, self_seconds, seconds)
+            stats[keys[entry.index]] = (entry.count, entry.count, self_seconds, seconds, callers)
+        return stats
+
+    def dump_stats(self, path: str):
+        '''
+        Write the statistics to a file that pstats.Stats can load.
+        '''
+        with open(path, 'wb') as f:
+            marshal.dump(self.stats(), f)
@@ -0,0 +1,77 @@
+from nodes import *
+
+# the resolver gives every distinct variable name of a program an integer slot,
+# so compiled backends can keep variables in a preallocated list (a "frame")
+# instead of hashing names into the memory dict on every access.
+
+class Unset:
+    # the value of a frame slot whose variable is not set
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'UNSET'
+
+UNSET = Unset()
+
+class SlotTable:
+    def __init__(self, names: list):
+        self.names = names # variable name of each slot
+        self.slots = {name: slot for slot, name in enumerate(names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def slot(self, name: str) -> int:
+        return self.slots[name]
+
+    def load(self, memory: dict) -> list:
+        '''
+        Build a frame holding the values of the memory dict.
+        Variables absent from memory hold UNSET.
+        '''
+        return [memory.get(name, UNSET) for name in self.names]
+
+    def store(self, frame: list, memory: dict):
+        '''
+        Write the variables that were set in the frame back to the memory dict.
+        Only the first len(self) entries of the frame are variables.
+        '''
+        for slot, name in enumerate(self.names):
+            value = frame[slot]
+            if value is not UNSET:
+                memory[name] = value
+
+
+def resolve_slots(ast: Node) -> SlotTable:
+    '''
+    Assign a slot to every variable name used in the AST, in order of first appearance.
+    '''
+    names = {} # used as an ordered set
+    pending = [ast]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, NodeIdentifier):
+            names.setdefault(node.name)
+        elif isinstance(node, NodeAssign):
+            names.setdefault(node.var_name)
+            pending.append(node.expr)
+        elif isinstance(node, NodeBlock):
+            pending.extend(reversed(node.commands))
+        elif isinstance(node, NodeSequence):
+            pending.append(node.second)
+            pending.append(node.first)
+        elif isinstance(node, NodeIf):
+            pending.append(node.else_branch)
+            pending.append(node.then_branch)
+            pending.append(node.condition)
+        elif isinstance(node, NodeWhile):
+            pending.append(node.body)
+            pending.append(node.condition)
+        elif isinstance(node, NodeNot):
+            pending.append(node.factor)
+        elif isinstance(node, NodeInt64):
+            pending.append(node.expr)
+        elif isinstance(node, (NodePlus, NodeMinus, NodeMultiply, NodeLessEqual, NodeEqual, NodeAnd, NodeOr)):
+            pending.append(node.right)
+            pending.append(node.left)
+    return SlotTable(list(names))
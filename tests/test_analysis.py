@@ -0,0 +1,58 @@
+import warnings
+
+import pytest
+
+from analysis import UndefinedVariableWarning, analyze
+from imp_interpreter import IMPInterpreter
+
+SOURCE = """x := 1;
+if (x <= n) then
+  y := 2
+else
+  skip
+end;
+z := (x + y)"""
+
+
+def test_inputs_and_proven_reads():
+    interpreter = IMPInterpreter(SOURCE)
+    dataflow = interpreter.dataflow()
+    # y is only assigned on one branch, so its read may find it unset
+    assert dataflow.inputs == {'n', 'y'}
+    assert [read.name for read in dataflow.undefined_reads] == ['n', 'y']
+    assert dataflow.missing_inputs({'n': 0}) == {'y'}
+    assert not dataflow.proven(dataflow.undefined_reads[0].node)
+    assert interpreter.check({'n': 0, 'y': 0}) == []
+    assert analyze(IMPInterpreter("x := 1; while (x <= 2) do y := x; x := (x + 1) end; z := y").ast).inputs == {'y'}
+
+
+def test_warn(recwarn):
+    interpreter = IMPInterpreter(SOURCE, undefined='warn')
+    assert interpreter.run({'n': 3}) == {'n': 3, 'x': 1, 'y': 2, 'z': 3}
+    assert [str(w.message) for w in recwarn if w.category is UndefinedVariableWarning] == [
+        "variable 'y' may be read before it is assigned at line 7, column 11"
+    ]
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        interpreter.run({'n': 3, 'y': 0}) # nothing missing, nothing reported
+
+
+def test_error():
+    interpreter = IMPInterpreter(SOURCE, undefined='error')
+    with pytest.raises(Exception, match="Analysis error: variable 'n' may be read before it is assigned at line 2, column 10"):
+        interpreter.run({})
+    memory = {'n': 0}
+    with pytest.raises(Exception, match="variable 'y' .* at line 7, column 11"):
+        interpreter.run(memory)
+    assert memory == {'n': 0} # rejected before running
+    result = interpreter.run_batch([{'n': 3}, {'n': 3, 'y': 5}])
+    assert result[0] is None and result[1]['z'] == 3
+
+
+def test_ignore_raises_on_the_read():
+    interpreter = IMPInterpreter(SOURCE)
+    assert interpreter.run({'n': 3})['z'] == 3 # the path taken assigns y
+    with pytest.raises(NameError):
+        interpreter.run({'n': 0})
+    with pytest.raises(ValueError):
+        IMPInterpreter(SOURCE, undefined='loud')
@@ -0,0 +1,125 @@
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from limits import ExecutionLimitExceeded
+
+# every backend, optimized or not, must leave the same memory as the tree walker on the
+# unoptimized program
+
+PROGRAMS = [
+    ("x := 1; y := (x + 2)", {}),
+    ("if (x <= 3) then y := (x * 2) else y := (x - 1) end", {'x': 5}),
+    ("if ((x <= 3) and not ((x = 1))) then y := 1 else y := 0 end", {'x': 2}),
+    # fibonacci
+    ("a := 0; b := 1; i := 0; while (i <= n) do t := a; a := b; b := (t + b); i := (i + 1) end", {'n': 30}),
+    # factorial, counting down
+    ("f := 1; while (1 <= n) do f := (f * n); n := (n - 1) end", {'n': 20}),
+    # affine counting loops, computed in closed form when optimized
+    ("s := 0; i := 0; while (i <= n) do s := (s + ((2 * i) + k)); i := (i + 1) end", {'n': 1000, 'k': 3}),
+    ("s := 0; i := n; while not ((i <= 0)) do s := (s - i); i := (i - 2) end", {'n': 101}),
+    # invariants and induction products, for the loop optimizer
+    ("s := 0; i := 0; while (i <= n) do if (s <= 50) then t := (i * 3) else skip end; "
+     "s := ((s + (i * 4)) + (k * k)); i := (i + 1) end", {'n': 40, 'k': 2}),
+    # nested loops
+    ("c := 0; i := 0; while (i <= 5) do j := 0; while (j <= i) do c := (c + j); j := (j + 1) end; "
+     "i := (i + 1) end", {}),
+]
+
+BACKENDS = IMPInterpreter.BACKENDS
+
+
+def reference(source: str, memory: dict) -> dict:
+    return IMPInterpreter(source).run(dict(memory))
+
+
+@pytest.mark.parametrize("source, memory", PROGRAMS)
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("optimize", [False, True])
+def test_backends_agree(source, memory, backend, optimize):
+    interpreter = IMPInterpreter(source, backend=backend, optimize=optimize)
+    for _ in range(3): # the closure backend compiles straight-line code after a few runs
+        assert interpreter.run(dict(memory)) == reference(source, memory)
+
+
+@pytest.mark.parametrize("source, memory", PROGRAMS)
+@pytest.mark.parametrize("optimize", [False, True])
+def test_vectorized_batch_agrees(source, memory, optimize):
+    pytest.importorskip("numpy")
+    memories = [dict(memory) for _ in range(3)]
+    if 'n' in memory:
+        memories = [dict(memory, n=n) for n in (0, 1, memory['n'])]
+    expected = [reference(source, m) for m in memories]
+    result = IMPInterpreter(source, optimize=optimize).run_batch(memories, vectorize=True)
+    assert result.ok
+    assert list(result) == expected
+
+
+def test_vectorized_batch_falls_back():
+    pytest.importorskip("numpy")
+    import vectorized
+    source = PROGRAMS[4][0] # 25! does not fit in 64 bits
+    program = vectorized.VectorizedProgram(IMPInterpreter(source).ast)
+    for memories in ([{'n': 5}, {'n': 25}], [{'n': 5}, {}]):
+        with pytest.raises(vectorized.VectorFallback):
+            program.run_memories([dict(m) for m in memories])
+        result = IMPInterpreter(source).run_batch(memories, vectorize=True)
+        assert result[0] == {'n': 0, 'f': 120}
+    assert result[1] is None and isinstance(result.errors[1], NameError)
+    assert IMPInterpreter(source).run_batch([{'n': 25}], vectorize=True)[0]['f'] == 15511210043330985984000000
+
+
+def nested_loops(depth: int) -> str:
+    source = "c := (c + 1)"
+    for k in range(depth):
+        source = f"i{k} := 0; while (i{k} <= 1) do {source}; i{k} := (i{k} + 1) end"
+    return "c := 0; " + source
+
+
+def deep_expression(depth: int) -> str:
+    source = "x"
+    for k in range(depth):
+        source = f"({source} + y{k % 3})"
+    return source
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_deeply_nested_commands_and_expressions(backend):
+    # deeper than the python blocks and parentheses the closure compiler inlines
+    source = f"z := {deep_expression(300)}; {nested_loops(15)}"
+    memory = {'x': 1, 'y0': 1, 'y1': 2, 'y2': 3}
+    interpreter = IMPInterpreter(source, backend=backend)
+    for _ in range(3):
+        assert interpreter.run(dict(memory)) == reference(source, memory)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_nested_closures_keep_the_memory_on_a_limit(backend):
+    source = nested_loops(15)
+    with pytest.raises(ExecutionLimitExceeded) as expected:
+        IMPInterpreter(source).run({}, max_steps=40)
+    with pytest.raises(ExecutionLimitExceeded) as raised:
+        IMPInterpreter(source, backend=backend).run({}, max_steps=40)
+    assert raised.value.memory == expected.value.memory
+
+
+def test_bytecode_round_trip():
+    import vm
+    source, memory = PROGRAMS[3]
+    program = vm.BytecodeProgram.from_bytes(IMPInterpreter(source).compile('vm').to_bytes())
+    result = dict(memory)
+    program.execute(result)
+    assert result == reference(source, memory)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_unset_variable_raises(backend):
+    # slots of variables missing from the memory hold UNSET, and reading one raises
+    with pytest.raises(NameError, match="Variable 'x' not found in memory"):
+        IMPInterpreter("y := (x + 1)", backend=backend).run({})
+    with pytest.raises(NameError):
+        IMPInterpreter("i := 0; while (i <= 3) do i := (i + x) end", backend=backend).run({})
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_unused_memory_entries_are_kept(backend):
+    assert IMPInterpreter("y := 1", backend=backend).run({'other': 'kept'}) == {'other': 'kept', 'y': 1}
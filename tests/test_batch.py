@@ -0,0 +1,46 @@
+import pytest
+
+from batch import BatchError
+from imp_interpreter import IMPInterpreter
+from limits import ExecutionLimitExceeded
+
+FACTORIAL = "f := 1; while (1 <= n) do f := (f * n); n := (n - 1) end"
+
+
+@pytest.mark.parametrize("backend", IMPInterpreter.BACKENDS)
+def test_batch_matches_run(backend):
+    interpreter = IMPInterpreter(FACTORIAL)
+    memories = [{'n': n} for n in range(8)]
+    expected = [IMPInterpreter(FACTORIAL).run(dict(memory)) for memory in memories]
+    result = interpreter.run_batch(memories, backend=backend)
+    assert result.ok and len(result) == 8
+    assert list(result) == expected
+    assert result[5] is memories[5] # updated in place
+
+
+def test_errors_are_recorded_per_input():
+    memories = [{'n': 3}, {}, {'n': 4}, {'m': 1}]
+    result = IMPInterpreter(FACTORIAL).run_batch(memories)
+    assert not result.ok
+    assert [memory is None for memory in result] == [False, True, False, True]
+    assert sorted(result.errors) == [1, 3]
+    assert all(isinstance(e, NameError) for e in result.errors.values())
+    assert result.columns(['f', 'n']) == {'f': [6, None, 24, None], 'n': [0, None, 0, None]}
+    assert list(result.columns()) == ['n', 'f'] # in order of appearance
+    with pytest.raises(BatchError, match="2 input\\(s\\) of the batch failed, first at index 1: NameError"):
+        result.raise_errors()
+
+
+def test_stop_on_error():
+    memories = [{'n': 3}, {}, {'n': 4}]
+    with pytest.raises(NameError):
+        IMPInterpreter(FACTORIAL).run_batch(memories, stop_on_error=True)
+    assert memories[0]['f'] == 6 and 'f' not in memories[2]
+
+
+def test_limits_apply_to_each_input():
+    memories = [{'n': 3}, {'n': 1000}, {'n': 2}]
+    result = IMPInterpreter(FACTORIAL).run_batch(memories, max_steps=100)
+    assert sorted(result.errors) == [1]
+    assert isinstance(result.errors[1], ExecutionLimitExceeded)
+    assert result.columns(['f'])['f'] == [6, None, 2]
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import benchmark
+from imp_interpreter import IMPInterpreter
+
+
+def result(rates: dict, size: int = 10) -> dict:
+    metrics = {metric: benchmark.measurement(1.0, rate, 'steps/s') for metric, rate in rates.items()}
+    return {'format': benchmark.FORMAT_VERSION, 'benchmarks': {'loop': dict(metrics, size=size)}}
+
+
+def test_compare():
+    baseline = result({'lex': 1000, 'parse': 1000, 'eval_tree': 1000, 'eval_vm': 1000})
+    current = result({'lex': 850, 'parse': 1200, 'eval_tree': 950})
+    current['benchmarks']['loop']['eval_vm'] = {'error': "OverflowError: too big"}
+    assert benchmark.compare(baseline, current) == [
+        ('loop', 'lex', 1000, 850, 0.85, 'regression'),
+        ('loop', 'parse', 1000, 1200, 1.2, 'improvement'),
+        ('loop', 'eval_tree', 1000, 950, 0.95, 'ok'),
+        ('loop', 'eval_vm', 1000, None, None, 'missing'),
+    ]
+    assert benchmark.compare(baseline, current, threshold=0.2)[0][-1] == 'ok'
+    assert {row[-1] for row in benchmark.compare(baseline, result({'lex': 1000}, size=20))} == {'size differs', 'missing'}
+
+
+def test_compare_command(tmp_path, capsys):
+    baseline, current = tmp_path / "baseline.json", tmp_path / "current.json"
+    baseline.write_text(json.dumps(result({'eval_tree': 2000000})))
+    current.write_text(json.dumps(result({'eval_tree': 1000000})))
+    assert benchmark.main(['compare', str(baseline), str(current)]) == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ['benchmark', 'metric', 'baseline', 'current', 'ratio', 'status']
+    assert lines[1].split() == ['loop', 'eval_tree', '2,000,000', '1,000,000', '0.50', 'regression']
+    assert lines[2] == "1 regression(s) over 10%"
+    assert benchmark.main(['compare', str(baseline), str(baseline)]) == 0
+
+
+@pytest.mark.parametrize("name", list(benchmark.PROGRAMS))
+def test_generated_programs_run(name):
+    generator, _ = benchmark.PROGRAMS[name]
+    IMPInterpreter(generator(3)).run({})
+
+
+def test_run_suite():
+    results = benchmark.run_suite(repeat=1, scale=0.01, only=['tight_loop'])
+    metrics = results['benchmarks']['tight_loop']
+    assert results['format'] == benchmark.FORMAT_VERSION
+    assert {'lex', 'lex_fast', 'parse'} | {f"eval_{backend}" for backend in benchmark.BACKENDS} <= set(metrics)
+    assert metrics['eval_tree']['unit'] == 'steps/s' and metrics['eval_tree']['rate'] > 0
+    json.dumps(results)
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from closed_form import AffineLoop, recognize
+from imp_interpreter import IMPInterpreter
+from limits import ExecutionLimitExceeded
+from nodes import NodeWhile, sequence_commands
+
+
+def loop_of(source: str) -> NodeWhile:
+    return sequence_commands(IMPInterpreter(source).ast)[-1]
+
+
+@pytest.mark.parametrize("source", [
+    "while (i <= n) do s := (s + ((2 * i) + k)); i := (i + 1) end",
+    "while not ((i <= 0)) do s := (s - i); i := (i - 2) end",
+    "while not ((n <= i)) do t := (i * k); i := (i + 3); s := ((i - k) + s) end",
+    "while (n <= i) do i := (i - 1); s := ((i * 2) + s) end",
+])
+def test_recognized_loops_match_iteration(source):
+    loop = recognize(loop_of(source))
+    assert isinstance(loop, AffineLoop)
+    generator = random.Random(source)
+    for _ in range(50):
+        memory = {'i': generator.randint(-20, 20), 'n': generator.randint(-20, 20), 'k': generator.randint(-3, 3),
+                  's': 0, 't': 0}
+        expected = dict(memory)
+        NodeWhile.eval(loop, expected) # iterated
+        assert loop.run(memory)
+        assert memory == expected
+
+
+@pytest.mark.parametrize("source", [
+    "while (i <= n) do s := (s * i); i := (i + 1) end",          # not affine
+    "while (i <= n) do t := i; s := (s + t); i := (i + 1) end",  # reads a variable of the loop
+    "while (i <= n) do n := (n + 1); i := (i + 1) end",          # the bound moves
+    "while (i <= n) do i := (i - 1) end",                        # moving away from the bound
+    "while (i <= n) do i := (i + 1); i := (i + 1) end",          # assigned twice
+    "while (i <= n) do if (i <= 2) then s := 1 else skip end; i := (i + 1) end",
+])
+def test_other_loops_are_not_recognized(source):
+    assert recognize(loop_of(source)) is None
+
+
+def test_huge_counts_run_in_closed_form():
+    source = "s := 0; i := 0; while (i <= n) do s := (s + i); i := (i + 1) end"
+    n = 10 ** 30
+    for backend in IMPInterpreter.BACKENDS:
+        assert IMPInterpreter(source, optimize=True).run({'n': n}, backend=backend) == \
+            {'n': n, 's': n * (n + 1) // 2, 'i': n + 1}
+
+
+def test_fallback_to_iteration():
+    loop = recognize(loop_of("while (i <= n) do s := (s + k); i := (i + 1) end"))
+    memory = {'i': 0, 'n': 3, 's': 0} # k unset: iterating raises on the read
+    assert not loop.run(memory) and memory == {'i': 0, 'n': 3, 's': 0}
+    with pytest.raises(NameError):
+        loop.eval(memory)
+    memory = {'i': 0, 'n': 2, 's': 0, 'k': True} # not an int, iterated
+    loop.eval(memory)
+    assert memory == {'i': 3, 'n': 2, 's': 3, 'k': True}
+
+
+def test_budget_stops_at_the_same_step():
+    source = "s := 0; i := 0; while (i <= n) do s := (s + i); i := (i + 1) end"
+    assert IMPInterpreter(source, optimize=True).run({'n': 9}, max_steps=10) == {'n': 9, 's': 45, 'i': 10}
+    with pytest.raises(ExecutionLimitExceeded) as raised:
+        IMPInterpreter(source, optimize=True).run({'n': 10 ** 9}, max_steps=10)
+    assert raised.value.memory['i'] == 10 and raised.value.memory['s'] == 45
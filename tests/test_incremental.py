@@ -0,0 +1,118 @@
+import random
+
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from incremental import IncrementalDocument
+from lexer import FastLexer, LineTable
+from nodes import Node
+from parser import Parser
+
+
+def parse(text: str) -> Node:
+    return Parser(FastLexer(text).lex(), LineTable(text)).parse()
+
+
+def nodes(node: Node) -> list:
+    # (class, position, printed form) of every node, in a fixed order
+    found = []
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        found.append((type(node).__name__, getattr(node, 'pos', None), node.__str__()))
+        for cls in type(node).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                value = getattr(node, name, None)
+                if isinstance(value, Node):
+                    pending.append(value)
+                elif isinstance(value, tuple):
+                    pending.extend(child for child in value if isinstance(child, Node))
+    return found
+
+
+COMMANDS = [
+    "x := 1",
+    "y := (x + 2)",
+    "if (x <= 3) then z := 1 else skip end",
+    "while (x <= 2) do x := (x + 1) end",
+]
+
+
+def test_edit_matches_a_full_parse():
+    text = "; ".join(COMMANDS * 3)
+    document = IncrementalDocument(text)
+    assert document.edit(text.index("2)"), 1, "40")
+    assert nodes(document.ast) == nodes(parse(document.text))
+    assert document.incremental_parses == 1
+
+
+def test_positions_after_the_edit_are_moved():
+    text = "x := 1;\ny := 2;\nz := (y + 3)"
+    document = IncrementalDocument(text)
+    assert document.edit(5, 1, "1000")
+    expected = parse(document.text)
+    assert nodes(document.ast) == nodes(expected)
+    assert document.ast.commands[2].pos == document.text.index("z")
+
+
+def test_broken_edit_reports_the_error_and_recovers():
+    text = "; ".join(COMMANDS)
+    document = IncrementalDocument(text)
+    end = text.index("end")
+    assert not document.edit(end, 3, "")
+    assert document.ast is None and document.error is not None
+    assert document.edit(end, 0, "end")
+    assert nodes(document.ast) == nodes(parse(text))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_edits_match_a_full_parse(seed):
+    generator = random.Random(seed)
+    document = IncrementalDocument("; ".join(generator.choice(COMMANDS) for _ in range(8)))
+    for _ in range(40):
+        offset = generator.randint(0, len(document.text))
+        deleted = generator.randint(0, min(3, len(document.text) - offset))
+        inserted = generator.choice(["", " ", "1", "\n", ";", "end", "; x := 4", generator.choice(COMMANDS) + "; "])
+        parsed = document.edit(offset, deleted, inserted)
+        try:
+            expected = parse(document.text)
+        except Exception:
+            expected = None
+        assert parsed == (expected is not None)
+        if expected is not None and generator.random() < 0.5: # let the pending shifts build up
+            assert nodes(document.ast) == nodes(expected)
+
+
+def test_interpreter_edit():
+    interpreter = IMPInterpreter("x := 1; y := (x + 1)")
+    assert interpreter.run({}) == {'x': 1, 'y': 2}
+    interpreter.edit(5, 1, "10")
+    assert interpreter.run({}) == {'x': 10, 'y': 11}
+    with pytest.raises(Exception):
+        interpreter.edit(0, 1, "(")
+    assert interpreter.run({}) == {'x': 10, 'y': 11} # the last valid program stays in use
+
+
+def test_earlier_asts_keep_their_positions():
+    text = "x := 1;\ny := 2;\nz := (y + 3)"
+    document = IncrementalDocument(text)
+    before = document.ast
+    expected = nodes(parse(text))
+    assert document.edit(0, 0, "w := 0; ")
+    assert document.edit(document.text.index("2"), 0, "2") # within the moved commands, after the pending shift
+    after = document.ast
+    assert nodes(before) == expected
+    assert nodes(after) == nodes(parse(document.text))
+    assert before.commands[2] is not after.commands[3]
+
+
+def test_long_document_edits():
+    text = "; ".join(COMMANDS * 2000)
+    document = IncrementalDocument(text)
+    document.ast
+    parsed = document.reparsed_chars
+    for k in range(20):
+        assert document.edit(document.text.index(";", k * 40) + 1, 0, "\n") # between two commands
+    assert document.incremental_parses == 20 and document.full_parses == 1
+    assert document.reparsed_chars - parsed < 2000
+    assert nodes(document.ast) == nodes(parse(document.text))
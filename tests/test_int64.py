@@ -0,0 +1,128 @@
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from nodes import INT64_MAX, INT64_MIN, wrap_int64
+
+BACKENDS = IMPInterpreter.BACKENDS
+
+OVERFLOWING = [
+    # (source, memory, the exact result of the unbounded mode)
+    ("y := (x * 3)", {'x': 2 ** 62}, {'y': 3 * 2 ** 62}),
+    ("y := (x + 1)", {'x': INT64_MAX}, {'y': INT64_MAX + 1}),
+    ("y := (0 - (x + 1))", {'x': INT64_MAX}, {'y': -INT64_MAX - 1}),
+    ("y := (9223372036854775807 + 1)", {}, {'y': 2 ** 63}),
+    ("i := 0; s := 0; while (i <= n) do s := (s + (i * 4611686018427387904)); i := (i + 1) end",
+     {'n': 10}, {'i': 11, 's': 55 * 2 ** 62}),
+    ("f := 1; while (1 <= n) do f := (f * n); n := (n - 1) end", {'n': 25}, {'n': 0, 'f': 15511210043330985984000000}),
+]
+
+
+def wrapped(memory: dict) -> dict:
+    return {name: wrap_int64(value) for name, value in memory.items()}
+
+
+@pytest.mark.parametrize("source, memory, exact", OVERFLOWING)
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("optimize", [False, True])
+def test_unbounded_mode_is_exact(source, memory, exact, backend, optimize):
+    result = IMPInterpreter(source, backend=backend, optimize=optimize).run(dict(memory))
+    assert result == dict(memory, **exact)
+
+
+@pytest.mark.parametrize("source, memory, exact", OVERFLOWING)
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("optimize", [False, True])
+def test_wrap_mode_wraps_around(source, memory, exact, backend, optimize):
+    result = IMPInterpreter(source, backend=backend, optimize=optimize, integers='wrap').run(dict(memory))
+    assert result == wrapped(dict(memory, **exact))
+
+
+@pytest.mark.parametrize("source, memory, exact", OVERFLOWING)
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("optimize", [False, True])
+def test_trap_mode_raises(source, memory, exact, backend, optimize):
+    with pytest.raises(OverflowError):
+        IMPInterpreter(source, backend=backend, optimize=optimize, integers='trap').run(dict(memory))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("optimize", [False, True])
+def test_trap_is_not_folded_away(backend, optimize):
+    source = "if (((x * 9223372036854775807) <= 4) and false) then y := 1 else y := 2 end"
+    with pytest.raises(OverflowError):
+        IMPInterpreter(source, backend=backend, optimize=optimize, integers='trap').run({'x': 3})
+    result = IMPInterpreter(source, backend=backend, optimize=optimize, integers='wrap').run({'x': 3})
+    assert result == {'x': 3, 'y': 2}
+
+
+@pytest.mark.parametrize("integers", ['wrap', 'trap'])
+@pytest.mark.parametrize("optimize", [False, True])
+def test_in_range_results_match_the_unbounded_mode(integers, optimize):
+    source = "s := 0; i := 0; while (i <= n) do s := (s + ((2 * i) + k)); i := (i + 1) end"
+    memory = {'n': 1000, 'k': -3}
+    expected = IMPInterpreter(source).run(dict(memory))
+    for backend in BACKENDS:
+        interpreter = IMPInterpreter(source, backend=backend, optimize=optimize, integers=integers)
+        assert interpreter.run(dict(memory)) == expected
+
+
+def test_wrap_mode_vectorizes():
+    pytest.importorskip("numpy")
+    source, memory, exact = OVERFLOWING[0]
+    memories = [{'x': 2 ** 62}, {'x': 5}, {'x': INT64_MIN}]
+    interpreter = IMPInterpreter(source, integers='wrap')
+    expected = [interpreter.run(dict(m)) for m in memories]
+    result = interpreter.run_batch(memories, vectorize=True)
+    assert result.ok and list(result) == expected
+
+
+@pytest.mark.parametrize("integers", ['wrap', 'trap'])
+def test_inputs_are_checked(integers):
+    interpreter = IMPInterpreter("y := x", integers=integers)
+    with pytest.raises(OverflowError):
+        interpreter.run({'x': INT64_MAX + 1})
+    with pytest.raises(ValueError):
+        interpreter.run({'x': 1.5})
+    result = interpreter.run_batch([{'x': 1}, {'x': INT64_MIN - 1}])
+    assert result[0] == {'x': 1, 'y': 1}
+    assert isinstance(result.errors[1], OverflowError)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        IMPInterpreter("x := 1", integers='saturate')
+
+
+def test_vm_checks_before_writing_the_target():
+    program = IMPInterpreter("x := (x * 3)", integers='trap').compile('vm')
+    assert [line.split()[1:] for line in program.disassemble().splitlines()] == [
+        ['MUL', 't0,', 'x,', '3'], ['TRAP', 't0'], ['MOVE', 'x,', 't0'], ['HALT'],
+    ]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_trapped_assignment_leaves_the_variable(backend):
+    interpreter = IMPInterpreter("i := 0; while (i <= 3) do x := (x * 3); i := (i + 1) end", backend=backend, integers='trap')
+    memory = {'x': 2 ** 61}
+    with pytest.raises(OverflowError):
+        interpreter.run(memory, max_steps=100)
+    assert INT64_MIN <= memory['x'] <= INT64_MAX # the overflowing value is never stored
+
+
+def test_profile_checks_the_memory():
+    with pytest.raises(OverflowError):
+        IMPInterpreter("y := x", integers='trap').profile({'x': INT64_MAX + 1})
+    with pytest.raises(Exception, match="Analysis error: variable 'x'"):
+        IMPInterpreter("y := x", undefined='error').profile({})
+    with pytest.warns(UserWarning, match="variable 'x'"):
+        with pytest.raises(NameError):
+            IMPInterpreter("y := x", undefined='warn').profile({})
+
+
+def test_parallel_runner_checks_the_memory():
+    import parallel
+    runner = parallel.ParallelRunner(max_workers=1)
+    program = runner.add_program(IMPInterpreter("y := (x * 3)", integers='wrap'))
+    results = runner.run_all([(program, {'x': INT64_MAX + 1}), (program, {'x': 2 ** 62})])
+    assert isinstance(results[0].error, OverflowError)
+    assert results[1].memory == {'x': 2 ** 62, 'y': wrap_int64(3 * 2 ** 62)}
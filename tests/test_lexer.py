@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from lexer import FastLexer, Lexer
+
+SAMPLE = """
+n := 10; a := 0; b := 1; i := 0;
+while (i <= n) do
+    if ((i = 0) or not ((a <= b))) then a_1 := (a * 2) else t := a; a := b; b := (t + b) end;
+    i := (i - 1)
+end
+"""
+
+
+def lex(lexer_class, text: str):
+    # the tokens, or the error message
+    try:
+        return [(token.type, token.value, token.pos) for token in lexer_class(text).lex()]
+    except Exception as e:
+        return str(e)
+
+
+def test_lexers_agree_on_a_program():
+    tokens = lex(Lexer, SAMPLE)
+    assert isinstance(tokens, list) and len(tokens) > 50
+    assert lex(FastLexer, SAMPLE) == tokens
+
+
+def test_lexers_agree_on_every_character():
+    # in particular the non-ascii digits, letters and numerals that str predicates accept
+    for code in range(0x3000):
+        for text in (chr(code), f"x{chr(code)}", f"1{chr(code)} "):
+            assert lex(FastLexer, text) == lex(Lexer, text), repr(text)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_lexers_agree_on_random_text(seed):
+    generator = random.Random(seed)
+    alphabet = "ab_01 9\n\t;():=<+-*" + "ifwhileandornot" + "²ⅷ·é"
+    for _ in range(300):
+        text = "".join(generator.choice(alphabet) for _ in range(generator.randint(0, 30)))
+        assert lex(FastLexer, text) == lex(Lexer, text), repr(text)
+
+
+def test_non_ascii_is_rejected():
+    assert lex(Lexer, "x := ²") == "Lexer error: unexpected character '²' at position 5"
+    assert lex(FastLexer, "x := ²") == "Lexer error: unexpected character '²' at position 5"
@@ -0,0 +1,51 @@
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from limits import ExecutionLimitExceeded
+
+FOREVER = "x := 0; while (0 <= x) do x := (x + 1) end"
+COUNT = "i := 0; while (i <= 9) do i := (i + 1) end" # 10 iterations
+
+
+@pytest.mark.parametrize("backend", IMPInterpreter.BACKENDS)
+@pytest.mark.parametrize("optimize", [False, True])
+def test_step_limit_stops_a_runaway_loop(backend, optimize):
+    interpreter = IMPInterpreter(FOREVER, backend=backend, optimize=optimize)
+    with pytest.raises(ExecutionLimitExceeded) as raised:
+        interpreter.run({}, max_steps=100)
+    assert raised.value.reason == 'steps'
+    assert raised.value.steps == 100
+    assert raised.value.memory['x'] == 100
+
+
+@pytest.mark.parametrize("backend", IMPInterpreter.BACKENDS)
+@pytest.mark.parametrize("optimize", [False, True])
+def test_step_limit_is_exact(backend, optimize):
+    interpreter = IMPInterpreter(COUNT, backend=backend, optimize=optimize)
+    assert interpreter.run({}, max_steps=10) == {'i': 10}
+    with pytest.raises(ExecutionLimitExceeded) as raised:
+        interpreter.run({}, max_steps=9)
+    assert raised.value.steps == 9
+
+
+@pytest.mark.parametrize("backend", IMPInterpreter.BACKENDS)
+def test_timeout_stops_a_runaway_loop(backend):
+    interpreter = IMPInterpreter(FOREVER, backend=backend)
+    with pytest.raises(ExecutionLimitExceeded) as raised:
+        interpreter.run({}, timeout=0.05)
+    assert raised.value.reason == 'timeout'
+    assert raised.value.memory['x'] > 0
+
+
+def test_limit_on_a_memoized_run():
+    from memoize import RegionMemo
+    interpreter = IMPInterpreter(FOREVER, memo=RegionMemo(16))
+    with pytest.raises(ExecutionLimitExceeded) as raised:
+        interpreter.run({}, max_steps=50)
+    assert raised.value.steps == 50
+
+
+def test_exception_pickles():
+    import pickle
+    error = pickle.loads(pickle.dumps(ExecutionLimitExceeded('steps', 7, {'x': 7})))
+    assert (error.reason, error.steps, error.memory) == ('steps', 7, {'x': 7})
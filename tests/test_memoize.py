@@ -0,0 +1,64 @@
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from limits import ExecutionLimitExceeded
+from memoize import RegionMemo
+
+SUM = "s := 0; i := 0; while (i <= n) do s := (s + (i * i)); i := (i + 1) end; d := (s - n)"
+
+
+def test_hits_and_misses():
+    memo = RegionMemo()
+    interpreter = IMPInterpreter(SUM, memo=memo)
+    assert interpreter.run({'n': 10}) == {'n': 10, 's': 385, 'i': 11, 'd': 375}
+    assert memo.stats() == {'entries': 1, 'hits': 0, 'misses': 1, 'evictions': 0, 'hit_rate': 0.0}
+    assert interpreter.run({'n': 10}) == {'n': 10, 's': 385, 'i': 11, 'd': 375}
+    assert interpreter.run({'n': 3}) == {'n': 3, 's': 14, 'i': 4, 'd': 11}
+    assert memo.stats() == {'entries': 2, 'hits': 1, 'misses': 2, 'evictions': 0, 'hit_rate': 1 / 3}
+    # shared by another interpreter of the same program
+    IMPInterpreter(SUM, memo=memo).run({'n': 3})
+    assert memo.hits == 1 # another AST, other regions
+    memo.clear()
+    assert len(memo) == 0 and memo.misses == 3
+
+
+def test_lru_eviction():
+    memo = RegionMemo(2)
+    interpreter = IMPInterpreter(SUM, memo=memo)
+    for n in (1, 2, 1, 3): # 2 is the least recently used when 3 comes in
+        interpreter.run({'n': n})
+    assert (memo.hits, memo.misses, memo.evictions, len(memo)) == (1, 3, 1, 2)
+    interpreter.run({'n': 1})
+    interpreter.run({'n': 2})
+    assert (memo.hits, memo.misses, memo.evictions) == (2, 4, 2)
+    with pytest.raises(ValueError):
+        RegionMemo(0)
+
+
+def test_keys_separate_value_types():
+    # 1 == True == 1.0, but a region left untouched must give back the value it was given
+    memo = RegionMemo()
+    interpreter = IMPInterpreter("while (i <= 0) do i := (i + 1) end", memo=memo)
+    assert interpreter.run({'i': True})['i'] is True
+    assert type(interpreter.run({'i': 1})['i']) is int
+    assert memo.hits == 0 and len(memo) == 2
+
+
+def test_nested_regions_and_unset_inputs():
+    source = "c := 0; if (0 <= k) then while (c <= k) do c := (c + 1) end else skip end"
+    memo = RegionMemo()
+    interpreter = IMPInterpreter(source, memo=memo)
+    assert interpreter.run({'k': 4}) == {'k': 4, 'c': 5}
+    assert interpreter.run({'k': 4}) == {'k': 4, 'c': 5}
+    assert memo.hits == 1 # the conditional, its loop is not looked up
+    with pytest.raises(NameError):
+        interpreter.run({})
+
+
+def test_hits_are_charged_their_steps():
+    interpreter = IMPInterpreter(SUM, memo=RegionMemo())
+    interpreter.run({'n': 50})
+    with pytest.raises(ExecutionLimitExceeded) as raised:
+        interpreter.run({'n': 50}, max_steps=20)
+    assert raised.value.memory['i'] == 20 # the reused effect took 51 steps, so it runs again
+    assert interpreter.run({'n': 50}, max_steps=51)['s'] == 42925
@@ -0,0 +1,43 @@
+import sys
+
+from imp_interpreter import IMPInterpreter
+from nodes import NodeAssign, NodeBlock, NodeInteger, NodeSequence, sequence_commands
+
+
+def test_long_loop_does_not_recurse():
+    # the tree walker runs a while loop iteratively, the iterations do not grow the stack
+    iterations = sys.getrecursionlimit() * 10
+    interpreter = IMPInterpreter("i := 0; while (i <= n) do i := (i + 1) end")
+    assert interpreter.run({'n': iterations}) == {'n': iterations, 'i': iterations + 1}
+
+
+def test_nested_loops():
+    source = "c := 0; i := 0; while (i <= 9) do j := 0; while (j <= i) do c := (c + 1); j := (j + 1) end; i := (i + 1) end"
+    assert IMPInterpreter(source).run({})['c'] == 55
+
+
+def test_long_straight_line_program():
+    # parsed into one NodeBlock: no backend recurses once per statement
+    count = 20000
+    source = "x := 0; " + "; ".join("x := (x + 1)" for _ in range(count))
+    interpreter = IMPInterpreter(source)
+    assert isinstance(interpreter.ast, NodeBlock) and len(interpreter.ast.commands) == count + 1
+    for backend in IMPInterpreter.BACKENDS:
+        assert interpreter.run({}, backend=backend) == {'x': count}
+    assert IMPInterpreter(source, optimize=True).run({}) == {'x': count}
+    printed = interpreter.ast.__str__()
+    assert printed.startswith("(" * count + "(x := (0)); (x := ((x) + (1))))")
+
+
+def test_block_prints_like_nested_sequences():
+    commands = [NodeAssign(name, NodeInteger(k)) for k, name in enumerate("abcd")]
+    chain = commands[0]
+    for command in commands[1:]:
+        chain = NodeSequence(chain, command)
+    block = NodeBlock(commands)
+    assert block.__str__() == chain.__str__() == "((((a := (0)); (b := (1))); (c := (2))); (d := (3)))"
+    assert sequence_commands(block) == sequence_commands(chain) == commands
+    assert IMPInterpreter("a := 0; b := 1; c := 2; d := 3").ast.__str__() == block.__str__()
+    memory = {}
+    block.eval(memory)
+    assert memory == {'a': 0, 'b': 1, 'c': 2, 'd': 3}
@@ -0,0 +1,132 @@
+import random
+
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from limits import ExecutionLimitExceeded
+from nodes import *
+from optimizer import LoopOptimizer, fold_constants
+
+BACKENDS = IMPInterpreter.BACKENDS
+
+
+def outcome(interpreter: IMPInterpreter, memory: dict, backend: str):
+    memory = dict(memory)
+    try:
+        interpreter.run(memory, backend=backend, max_steps=2000)
+    except ExecutionLimitExceeded:
+        return 'limit'
+    except NameError:
+        return 'unset' # hoisting may fail on another unset variable first
+    return memory
+
+
+@pytest.mark.parametrize("source, folded", [
+    ("x := ((2 * 3) + y)", "(x := ((6) + (y)))"),
+    ("x := (y + 0)", "(x := (y))"),
+    ("x := (y * 0)", "(x := ((y) * (0)))"), # y is still read
+    ("if (1 <= 2) then x := 1 else x := 2 end", "(x := (1))"),
+    ("while ((1 = 2) and (y <= 3)) do x := 1 end", "(skip)"),
+    ("if (true or (y <= 1)) then x := 1 else skip end", "(x := (1))"),
+    ("if ((y <= 1) or true) then x := 1 else skip end", "(if (((y) <= (1)) or (true)) then (x := (1)) else (skip))"),
+    ("if ((1 <= 2) or true) then x := 1 else skip end", "(x := (1))"),
+    ("if ((y <= 1) and true) then x := 1 else skip end", "(if ((y) <= (1)) then (x := (1)) else (skip))"),
+])
+def test_folding(source, folded):
+    assert fold_constants(IMPInterpreter(source).ast).__str__() == folded
+
+
+@pytest.mark.parametrize("source", [
+    "a := 1; if ((k <= 1) or true) then a := 2 else skip end",
+    "a := 1; if ((k <= 1) and false) then a := 2 else skip end",
+    "a := 1; while (not ((k = 1)) and false) do a := 2 end",
+    "a := (k * 0)",
+])
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_unset_reads_are_kept(source, backend):
+    with pytest.raises(NameError, match="'k'"):
+        IMPInterpreter(source, optimize=True).run({}, backend=backend)
+
+
+def random_condition(generator: random.Random, depth: int) -> str:
+    choice = generator.random()
+    if choice < 0.25:
+        return generator.choice(["true", "false"])
+    if depth == 0 or choice < 0.6:
+        return f"({generator.choice('ijk12')} {generator.choice(['<=', '='])} {generator.choice('ijk03')})"
+    if choice < 0.85:
+        operator = generator.choice(["and", "or"])
+        return f"({random_condition(generator, depth - 1)} {operator} {random_condition(generator, depth - 1)})"
+    return f"not ({random_condition(generator, depth - 1)})"
+
+
+def random_program(generator: random.Random, depth: int) -> str:
+    commands = []
+    for _ in range(generator.randint(1, 3)):
+        choice = generator.random()
+        if depth == 0 or choice < 0.5:
+            variable = generator.choice("ijk")
+            commands.append(f"{variable} := ({generator.choice('ijk2')} {generator.choice('+-*')} {generator.randint(0, 2)})")
+        elif choice < 0.8:
+            commands.append(f"if {random_condition(generator, 2)} then {random_program(generator, depth - 1)} "
+                            f"else {random_program(generator, depth - 1)} end")
+        else:
+            commands.append(f"while {random_condition(generator, 2)} do {random_program(generator, depth - 1)} end")
+    return "; ".join(commands)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_optimized_runs_match_on_memories_with_unset_variables(seed):
+    generator = random.Random(seed)
+    for _ in range(40):
+        source = random_program(generator, 2)
+        memory = {name: generator.randint(-2, 2) for name in "ijk" if generator.random() < 0.5}
+        expected = outcome(IMPInterpreter(source), memory, 'tree')
+        optimized = IMPInterpreter(source, optimize=True)
+        for backend in BACKENDS:
+            assert outcome(optimized, memory, backend) == expected, (source, memory, backend)
+
+
+def test_folding_does_not_modify_the_tree():
+    shared = NodeIdentifier('y') # built without a position, like the nodes of other passes
+    ast = NodeAssign('x', NodePlus(shared, NodeInteger(0)))
+    ast.pos = 0
+    folded = fold_constants(ast)
+    assert folded.expr is shared
+    assert not hasattr(shared, 'pos')
+    assert ast.expr.left is shared and ast.expr.__str__() == "((y) + (0))"
+
+
+LOOP = "s := 0; i := 0; while (i <= n) do s := ((s + (i * 4)) + (k * k)); i := (i + 1) end"
+
+
+def test_loop_optimizer():
+    optimizer = LoopOptimizer()
+    optimized = optimizer.optimize(IMPInterpreter(LOOP).ast)
+    assert optimizer.temporaries == ['__sr0', '__licm1']
+    assert optimized.__str__() == (
+        "(((s := (0)); (i := (0))); (if ((i) <= (n)) then (((__licm1 := ((k) * (k))); (__sr0 := ((i) * (4)))); "
+        "(while ((i) <= (n)) do (((s := (((s) + (__sr0)) + (__licm1))); (i := ((i) + (1)))); "
+        "(__sr0 := ((__sr0) + (4)))))) else (skip)))"
+    )
+    for n in (-1, 0, 7):
+        memory = {'n': n, 'k': 3}
+        expected = IMPInterpreter(LOOP).run(dict(memory))
+        optimized.eval(memory)
+        assert {name: value for name, value in memory.items() if not name.startswith('__')} == expected
+
+
+def test_loop_optimizer_temporaries_are_dropped():
+    import parallel
+    interpreter = IMPInterpreter(LOOP, optimize=True)
+    expected = {'n': 5, 'k': 2, 's': 84, 'i': 6}
+    for backend in BACKENDS:
+        assert interpreter.run({'n': 5, 'k': 2}, backend=backend) == expected
+    assert interpreter.temporaries
+    assert list(interpreter.run_batch([{'n': 5, 'k': 2}] * 2)) == [expected] * 2
+    memory = {'n': 5, 'k': 2}
+    interpreter.profile(memory)
+    assert memory == expected
+    runner = parallel.ParallelRunner(max_workers=1)
+    program = runner.add_program(interpreter)
+    assert runner.run_all([(program, {'n': 5, 'k': 2})])[0].memory == expected
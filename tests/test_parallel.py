@@ -0,0 +1,44 @@
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from limits import ExecutionLimitExceeded
+from parallel import ParallelRunner
+
+FACTORIAL = "f := 1; while (1 <= n) do f := (f * n); n := (n - 1) end"
+SUM = "s := 0; i := 0; while (i <= n) do s := (s + (i * 4)); i := (i + 1) end"
+
+
+def test_results_match_run():
+    runner = ParallelRunner(max_workers=2, chunk_size=3)
+    factorial = runner.add_program(FACTORIAL)
+    total = runner.add_program(IMPInterpreter(SUM, optimize=True))
+    jobs = [(factorial if n % 2 else total, {'n': n}) for n in range(10)]
+    results = runner.run_all(jobs)
+    assert [result.index for result in results] == list(range(10))
+    for (program_id, memory), result in zip(jobs, results):
+        source = FACTORIAL if program_id == factorial else SUM
+        assert result.ok and result.program_id == program_id
+        assert result.memory == IMPInterpreter(source).run(dict(memory)) # no temporaries
+        assert result.wall_time >= 0.0
+    assert len(list(runner.run(jobs))) == 10
+
+
+def test_failed_jobs():
+    runner = ParallelRunner(max_workers=2, chunk_size=2, max_steps=1000)
+    program = runner.add_program(FACTORIAL)
+    results = runner.run_all([(program, {'n': 3}), (program, {}), (program, {'n': 10 ** 6})])
+    assert results[0].memory == {'n': 0, 'f': 6}
+    assert isinstance(results[1].error, NameError) and results[1].memory is None
+    assert isinstance(results[2].error, ExecutionLimitExceeded) and not results[2].ok
+    with pytest.raises(KeyError):
+        runner.run_all([(program + 1, {})])
+
+
+def test_rejected_jobs_are_not_sent():
+    runner = ParallelRunner(max_workers=1, undefined='error')
+    program = runner.add_program(FACTORIAL)
+    results = list(runner.run([(program, {'n': 2}), (program, {})]))
+    assert [result.index for result in results] == [1, 0] # rejected jobs come first
+    assert "may be read before it is assigned" in str(results[0].error)
+    assert results[0].wall_time == 0.0
+    assert results[1].memory == {'n': 0, 'f': 2}
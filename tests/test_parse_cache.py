@@ -0,0 +1,75 @@
+import os
+import pickle
+
+from imp_interpreter import IMPInterpreter
+from parse_cache import FORMAT_VERSION, ParseCache
+
+SOURCES = [f"x := {n}; y := (x + 1)" for n in range(4)]
+
+
+def test_lru_eviction():
+    cache = ParseCache(max_entries=2)
+    for source in SOURCES[:2]:
+        IMPInterpreter(source, cache=cache)
+    IMPInterpreter(SOURCES[0], cache=cache) # now the most recently used
+    IMPInterpreter(SOURCES[2], cache=cache) # evicts SOURCES[1]
+    assert cache.get(SOURCES[0]) is not None
+    assert cache.get(SOURCES[1]) is None
+    assert cache.stats() == {'entries': 2, 'hits': 2, 'disk_hits': 0, 'misses': 4, 'evictions': 1}
+
+
+def test_hit_shares_the_ast_and_compiled_programs():
+    cache = ParseCache()
+    first = IMPInterpreter(SOURCES[0], cache=cache, backend='closure')
+    first.run({})
+    second = IMPInterpreter(SOURCES[0], cache=cache, backend='closure')
+    assert second.ast is first.ast
+    assert second.compile() is first.compile()
+    assert second.run({}) == {'x': 0, 'y': 1}
+
+
+def test_disk_store_survives_a_new_cache(tmp_path):
+    IMPInterpreter(SOURCES[0], cache=ParseCache(directory=str(tmp_path)))
+    cache = ParseCache(directory=str(tmp_path))
+    interpreter = IMPInterpreter(SOURCES[0], cache=cache)
+    assert cache.disk_hits == 1
+    assert interpreter.tokens is None # not lexed again
+    assert interpreter.run({}) == {'x': 0, 'y': 1}
+
+
+def test_corrupt_pickle_is_parsed_again(tmp_path):
+    cache = ParseCache(directory=str(tmp_path))
+    IMPInterpreter(SOURCES[0], cache=cache)
+    path = os.path.join(str(tmp_path), f"{ParseCache.key(SOURCES[0])}.pickle")
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    cache = ParseCache(directory=str(tmp_path))
+    assert IMPInterpreter(SOURCES[0], cache=cache).run({}) == {'x': 0, 'y': 1}
+    assert cache.disk_hits == 0 and cache.misses == 1
+    assert ParseCache(directory=str(tmp_path)).get(SOURCES[0]) is not None # written again
+
+
+unpickled = []
+
+class Stale:
+    # records its unpickling
+    def __reduce__(self):
+        return (unpickled.append, ('stale',))
+
+
+def test_stale_pickle_is_not_unpickled(tmp_path):
+    cache = ParseCache(directory=str(tmp_path))
+    path = os.path.join(str(tmp_path), f"{ParseCache.key(SOURCES[0])}.pickle")
+    with open(path, 'wb') as f:
+        f.write(pickle.dumps(FORMAT_VERSION - 1) + pickle.dumps(Stale()))
+    assert cache.get(SOURCES[0]) is None
+    assert unpickled == []
+    assert IMPInterpreter(SOURCES[0], cache=cache).run({}) == {'x': 0, 'y': 1}
+
+
+def test_pickle_of_another_format_is_ignored(tmp_path):
+    cache = ParseCache(directory=str(tmp_path))
+    path = os.path.join(str(tmp_path), f"{ParseCache.key(SOURCES[0])}.pickle")
+    with open(path, 'wb') as f:
+        pickle.dump((FORMAT_VERSION, "not an AST"), f)
+    assert cache.get(SOURCES[0]) is None
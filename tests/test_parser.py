@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from lexer import FastLexer, LineTable
+from parser import Parser
+
+
+def parse(text: str):
+    return Parser(FastLexer(text).lex(), LineTable(text)).parse()
+
+
+def condition(source: str) -> str:
+    # the printed condition of if <source> then skip else skip end
+    printed = parse(f"if {source} then skip else skip end").__str__()
+    assert printed.startswith("(if ") and printed.endswith(" then (skip) else (skip))")
+    return printed[len("(if "):-len(" then (skip) else (skip))")]
+
+
+@pytest.mark.parametrize("source, printed", [
+    ("(a <= b)", "((a) <= (b))"),
+    ("((a <= b) and (c = d))", "(((a) <= (b)) and ((c) = (d)))"),
+    ("(((a <= b) and (c = d)) or not ((e <= 1)))", "((((a) <= (b)) and ((c) = (d))) or (not ((e) <= (1))))"),
+    ("((a <= b) and ((c = d) or (e = f)))", "(((a) <= (b)) and (((c) = (d)) or ((e) = (f))))"),
+    ("(true and (false or true))", "((true) and ((false) or (true)))"),
+    ("not (not ((a = b)))", "(not (not ((a) = (b))))"),
+    ("((a <= (b + 1)) or ((c * 2) = d))", "(((a) <= ((b) + (1))) or (((c) * (2)) = (d)))"),
+    ("(((1 + 2) * x) <= y)", "((((1) + (2)) * (x)) <= (y))"),
+])
+def test_boolean_expressions(source, printed):
+    assert condition(source) == printed
+
+
+def random_condition(generator: random.Random, depth: int):
+    # (source, printed form) of a random boolean expression
+    choice = generator.random()
+    if depth == 0 or choice < 0.3:
+        left, right = generator.choice("xy1"), generator.choice("xz2")
+        operator = generator.choice(["<=", "="])
+        return f"({left} {operator} {right})", f"(({left}) {operator} ({right}))"
+    if choice < 0.45:
+        value = generator.choice(["true", "false"])
+        return value, f"({value})"
+    if choice < 0.6:
+        source, printed = random_condition(generator, depth - 1)
+        return f"not ({source})", f"(not {printed})"
+    operator = generator.choice(["and", "or"])
+    left, left_printed = random_condition(generator, depth - 1)
+    right, right_printed = random_condition(generator, depth - 1)
+    return f"({left} {operator} {right})", f"({left_printed} {operator} {right_printed})"
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_nested_conditions_round_trip(seed):
+    generator = random.Random(seed)
+    for _ in range(50):
+        source, printed = random_condition(generator, 5)
+        assert condition(source) == printed, source
+
+
+@pytest.mark.parametrize("source, message", [
+    ("x := 1 + 2", "Unexpected token after parsing Command at line 1, column 8"),
+    ("x := ((1 + 2)", "Unexpected end of input"),
+    ("x := ", "Unexpected end of input while parsing AExpression"),
+    ("if a <= b then skip else skip end", "Invalid BExpression in if statement at line 1, column 4"),
+    ("if ((a <= b) and (c = d) or true) then skip else skip end", "Expected '\\)' at the end of expression"),
+    ("if (true) then skip else skip end", "Invalid operator"),
+    ("while (x <= 1) do skip", "Expected 'end' at the end of while statement"),
+    ("x := 1;", "Unexpected end of input"),
+])
+def test_parse_errors(source, message):
+    with pytest.raises(SyntaxError, match=message):
+        parse(source)
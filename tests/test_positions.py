@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from lexer import FastLexer, Lexer, LineTable, StreamLexer
+from nodes import sequence_commands
+
+SOURCE = "x := 1;\n  y := (x +\n z);\n\nwhile (y <= 3) do\n\ty := (y + 1)\nend"
+
+
+@pytest.mark.parametrize("lexer", [Lexer, FastLexer])
+def test_token_offsets(lexer):
+    tokens = lexer(SOURCE).lex()
+    assert [token.pos for token in tokens[:3]] == [0, 2, 5]
+    for token in tokens:
+        if token.value is not None:
+            assert SOURCE[token.pos:].startswith(str(token.value))
+
+
+def test_node_offsets():
+    interpreter = IMPInterpreter(SOURCE)
+    first, second, loop = sequence_commands(interpreter.ast)
+    assert [interpreter.lines.position(command.pos) for command in (first, second, loop)] == [(1, 1), (2, 3), (5, 1)]
+    assert interpreter.lines.position(second.expr.right.pos) == (3, 2)
+    assert interpreter.lines.position(loop.body.pos) == (6, 2)
+
+
+def test_line_table():
+    lines = LineTable(SOURCE)
+    assert lines.line_count() == 7
+    assert lines.position(0) == (1, 1)
+    assert lines.position(7) == (1, 8) # the newline ends its line
+    assert lines.position(8) == (2, 1)
+    assert lines.describe(SOURCE.index('while')) == "at line 5, column 1"
+    assert lines.describe(None) == "at unknown position"
+    assert lines.source_line(4) == "" and lines.source_line(7) == "end"
+    assert LineTable().source_line(1) is None
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_line_table_fed_by_chunks(seed):
+    # newlines at the start or end of a chunk, or chunks of newlines only
+    text = "a\n\nb\n" + SOURCE + "\n"
+    generator = random.Random(seed)
+    lines = LineTable()
+    start = 0
+    while start < len(text):
+        stop = start + generator.randint(1, 3)
+        lines.extend(text[start:stop])
+        start = stop
+    whole = LineTable(text)
+    assert lines.line_count() == whole.line_count() == text.count("\n") + 1
+    assert [lines.position(offset) for offset in range(len(text))] == [whole.position(offset) for offset in range(len(text))]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7])
+def test_stream_lexer_lines(chunk_size):
+    lexer = StreamLexer(iter([SOURCE[i:i + chunk_size] for i in range(0, len(SOURCE), chunk_size)]))
+    tokens = list(lexer)
+    whole = LineTable(SOURCE)
+    assert [lexer.lines.position(token.pos) for token in tokens] == [whole.position(token.pos) for token in tokens]
+
+
+def test_syntax_error_location():
+    with pytest.raises(Exception, match="at line 2, column 5"):
+        IMPInterpreter("x := 1;\ny : 2")
@@ -0,0 +1,63 @@
+import json
+import pstats
+
+from imp_interpreter import IMPInterpreter
+
+SOURCE = """s := 0;
+i := 0;
+while (i <= 4) do
+  s := (s + i);
+  i := (i + 1)
+end"""
+
+
+def profile():
+    return IMPInterpreter(SOURCE).profile({})
+
+
+def test_counts_and_positions():
+    program_profiler = profile()
+    nodes = {(node['line'], node['column'], node['kind']): node for node in program_profiler.to_dict()['nodes']}
+    assert nodes[(1, 1, 'assign')]['count'] == 1
+    assert nodes[(3, 1, 'while')]['count'] == 1
+    assert nodes[(3, 7, 'lessequal')]['count'] == 6
+    assert nodes[(4, 3, 'assign')]['count'] == 5
+    assert nodes[(5, 8, 'plus')]['count'] == 5
+    assert all(node['self_time'] <= node['total_time'] for node in nodes.values())
+
+
+def test_runs_add_up():
+    interpreter = IMPInterpreter(SOURCE)
+    program_profiler = interpreter.profile({})
+    assert program_profiler.run({}) == {'s': 10, 'i': 5}
+    data = json.loads(program_profiler.to_json())
+    assert data['runs'] == 2
+    assert max(node['count'] for node in data['nodes']) == 12 # the condition
+
+
+def test_report_and_annotate():
+    program_profiler = profile()
+    report = program_profiler.report(limit=3).splitlines()
+    assert report[0].startswith("1 run(s), ")
+    assert report[1].split() == ['count', 'total', 'ms', 'self', 'ms', 'self', '%', 'line:col', 'kind', 'source']
+    assert len(report) == 5
+    annotated = program_profiler.annotate().splitlines()
+    assert len(annotated) == 7
+    assert annotated[4].split()[0] == '5' and annotated[4].endswith("4    s := (s + i);")
+    assert annotated[6].split() == ['6', 'end']
+
+
+def test_dump_stats(tmp_path):
+    path = str(tmp_path / "imp.prof")
+    profile().dump_stats(path)
+    stats = pstats.Stats(path)
+    calls = {name: counts[0] for (filename, line, name), counts in stats.stats.items()}
+    assert calls["lessequal:7 ((i) <= (4))"] == 6
+    assert calls["assign:3 (s := ((s) + (i)))"] == 5
+
+
+def test_profiling_leaves_the_program_alone():
+    interpreter = IMPInterpreter(SOURCE)
+    ast = interpreter.ast
+    interpreter.profile({})
+    assert interpreter.ast is ast and interpreter.run({}) == {'s': 10, 'i': 5}
@@ -0,0 +1,55 @@
+import io
+import random
+
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from lexer import FastLexer, StreamLexer
+
+SOURCE = """n := 12345; total := 0; counter := 0;
+while (counter <= n) do
+    total := (total + counter); counter := (counter + 1)
+end; if not ((total <= 0)) then done := 1 else skip end"""
+
+
+def tokens(lexer) -> list:
+    return [(token.type, token.value, token.pos) for token in lexer]
+
+
+def random_chunks(text: str, generator: random.Random) -> list:
+    chunks = []
+    start = 0
+    while start < len(text):
+        stop = start + generator.randint(1, 7)
+        chunks.append(text[start:stop])
+        start = stop
+    return chunks
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_chunked_input_matches_fast_lexer(seed):
+    # tokens split across chunks (':' and '=', 'coun' and 'ter', '123' and '45') are carried over
+    chunks = random_chunks(SOURCE, random.Random(seed))
+    assert tokens(StreamLexer(iter(chunks))) == tokens(FastLexer(SOURCE).lex())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 64])
+def test_file_sources(chunk_size):
+    expected = tokens(FastLexer(SOURCE).lex())
+    assert tokens(StreamLexer(io.StringIO(SOURCE), chunk_size=chunk_size)) == expected
+    assert tokens(StreamLexer(io.BytesIO(SOURCE.encode()), chunk_size=chunk_size)) == expected
+
+
+def test_multibyte_characters_split_across_chunks():
+    text = "x := 1; y := 2"
+    data = text.encode()
+    with pytest.raises(Exception, match="unexpected character 'é'"):
+        tokens(StreamLexer(io.BytesIO(("x := 1; é").encode()), chunk_size=1))
+    assert tokens(StreamLexer(io.BytesIO(data), chunk_size=1)) == tokens(FastLexer(text).lex())
+
+
+def test_interpreter_runs_a_streamed_source():
+    chunks = random_chunks(SOURCE, random.Random(0))
+    streamed = IMPInterpreter(iter(chunks))
+    assert streamed.tokens is None
+    assert streamed.run({}) == IMPInterpreter(SOURCE).run({})
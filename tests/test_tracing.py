@@ -0,0 +1,73 @@
+import io
+import logging
+
+import pytest
+
+from imp_interpreter import IMPInterpreter
+from lexer import FastLexer, Lexer, StreamLexer
+from parser import Parser
+from tracing import TraceRecorder, logging_hook
+
+SOURCE = "i := 0;\nwhile (i <= 1) do i := (i + 1) end;\nif (i = 2) then skip else skip end"
+WHILE, BODY, IF = SOURCE.index('while'), SOURCE.index('i := (i'), SOURCE.index('if')
+THEN, ELSE = SOURCE.index('skip'), SOURCE.rindex('skip')
+
+
+def test_lexer_events():
+    expected = [('lex.token', token.pos, token) for token in FastLexer(SOURCE).lex()]
+    for lexer in (Lexer(SOURCE, TraceRecorder()), FastLexer(SOURCE, TraceRecorder())):
+        lexer.lex()
+        assert [(kind, pos, (token.type, token.value)) for kind, pos, token in lexer.trace.events] == \
+            [(kind, pos, (token.type, token.value)) for kind, pos, token in expected]
+    recorder = TraceRecorder()
+    list(StreamLexer(io.StringIO(SOURCE), chunk_size=4, trace=recorder))
+    assert [pos for _, pos, _ in recorder.events] == [pos for _, pos, _ in expected]
+
+
+def test_parser_events():
+    recorder = TraceRecorder()
+    Parser(FastLexer(SOURCE).lex(), trace=recorder).parse()
+    assert [(pos, token.value) for _, pos, token in recorder.of_kind('parse.command')] == \
+        [(0, 'i'), (WHILE, 'while'), (BODY, 'i'), (IF, 'if'), (THEN, 'skip'), (ELSE, 'skip')]
+
+
+@pytest.mark.parametrize("backend", IMPInterpreter.BACKENDS)
+def test_eval_events(backend):
+    recorder = TraceRecorder()
+    interpreter = IMPInterpreter(SOURCE, backend=backend, trace=recorder)
+    recorder.events.clear()
+    assert interpreter.run({}) == {'i': 2}
+    assert recorder.events == [
+        ('eval.assign', 0, ('i', 0)),
+        ('eval.while', WHILE, True), ('eval.assign', BODY, ('i', 1)),
+        ('eval.while', WHILE, True), ('eval.assign', BODY, ('i', 2)),
+        ('eval.while', WHILE, False),
+        ('eval.if', IF, True), ('eval.skip', THEN, None),
+    ]
+
+
+def test_batch_runs_traced():
+    recorder = TraceRecorder()
+    interpreter = IMPInterpreter(SOURCE, trace=recorder)
+    recorder.events.clear()
+    result = interpreter.run_batch([{}, {}], vectorize=True)
+    assert list(result) == [{'i': 2}, {'i': 2}]
+    assert len(recorder.of_kind('eval.assign')) == 6
+
+
+def test_nothing_is_printed(capsys):
+    interpreter = IMPInterpreter(SOURCE)
+    interpreter.run({})
+    IMPInterpreter(SOURCE, fast_lexer=False, trace=TraceRecorder()).run({})
+    assert capsys.readouterr().out == ""
+
+
+def test_logging_hook(caplog):
+    logger = logging.getLogger('imp.test')
+    logger.setLevel(logging.INFO)
+    assert logging_hook(logger) is None # debug is off, so is tracing
+    hook = logging_hook(logger, logging.INFO)
+    with caplog.at_level(logging.INFO, logger='imp.test'):
+        IMPInterpreter("x := 1", trace=hook)
+    assert caplog.messages[0] == "lex.token at 0: " + repr(FastLexer("x := 1").lex()[0])
+    assert "parse.command at 0: " in caplog.messages[-1]
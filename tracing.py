@@ -0,0 +1,94 @@
+import logging
+
+from nodes import *
+from limits import Budget, ExecutionLimitExceeded
+
+# trace hooks. a hook is any callable hook(kind, pos, detail), called for every event of a
+# traced lexer, parser or run; pos is the source offset of the event (-1 if unknown).
+# the components check for a hook once, when they are created or when a run starts, and
+# install a traced code path only then, so nothing is checked per token or per node
+# when tracing is off.
+#
+# events:
+#   'lex.token'     detail is the Token
+#   'parse.command' detail is the first Token of the command about to be parsed
+#   'eval.assign'   detail is (variable name, value)
+#   'eval.if'       detail is the value of the condition
+#   'eval.while'    detail is the value of the condition, at every test
+#   'eval.skip'     detail is None
+
+class TraceRecorder:
+    '''
+    Hook keeping the events in a list of (kind, pos, detail).
+    '''
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, kind: str, pos: int, detail):
+        self.events.append((kind, pos, detail))
+
+    def of_kind(self, prefix: str) -> list:
+        return [event for event in self.events if event[0].startswith(prefix)]
+
+
+class LoggingTracer:
+    '''
+    Hook writing every event to a logger, see logging_hook.
+    '''
+    def __init__(self, logger: logging.Logger, level: int = logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, kind: str, pos: int, detail):
+        self.logger.log(self.level, "%s at %d: %r", kind, pos, detail)
+
+
+def logging_hook(logger: logging.Logger = None, level: int = logging.DEBUG):
+    '''
+    Return a hook logging to logger (the 'imp' logger by default) at level, or None if the
+    logger does not handle that level, so that tracing stays off without further checks.
+    '''
+    logger = logger or logging.getLogger('imp')
+    if not logger.isEnabledFor(level):
+        return None
+    return LoggingTracer(logger, level)
+
+
+def run_traced(ast: Node, memory: dict, hook, budget: Budget = None):
+    '''
+    Run the AST like Node.eval, reporting every command to hook.
+    Expressions are evaluated with their own eval. With a budget, loop iterations are
+    charged to it as in limits.run_tree.
+    '''
+    try:
+        _run_command(ast, memory, hook, budget)
+    except ExecutionLimitExceeded as e:
+        e.memory = memory
+        raise
+
+def _run_command(node: Node, memory: dict, hook, budget: Budget):
+    if isinstance(node, SEQUENCE_NODES):
+        for command in sequence_commands(node):
+            _run_command(command, memory, hook, budget)
+    elif isinstance(node, NodeAssign):
+        value = node.expr.eval(memory)
+        memory[node.var_name] = value
+        hook('eval.assign', getattr(node, 'pos', -1), (node.var_name, value))
+    elif isinstance(node, NodeIf):
+        condition = node.condition.eval(memory)
+        hook('eval.if', getattr(node, 'pos', -1), condition)
+        _run_command(node.then_branch if condition else node.else_branch, memory, hook, budget)
+    elif isinstance(node, NodeWhile):
+        pos = getattr(node, 'pos', -1)
+        while True:
+            condition = node.condition.eval(memory)
+            hook('eval.while', pos, condition)
+            if not condition:
+                break
+            if budget is not None:
+                budget.tick()
+            _run_command(node.body, memory, hook, budget)
+    elif isinstance(node, NodeSkip):
+        hook('eval.skip', getattr(node, 'pos', -1), None)
+    else:
+        raise Exception(f"Trace error: unsupported node {type(node).__name__}")
@@ -0,0 +1,196 @@
+try:
+    import numpy as np
+except ImportError: # numpy is optional, only this engine needs it
+    np = None
+
+from nodes import *
+from limits import Budget, ExecutionLimitExceeded
+from analysis import analyze
+
+# the vectorized engine runs one program over many inputs at once ("lanes").
+# every variable is a numpy int64 array with one element per lane, and operators are
+# evaluated as vector operations. control flow is handled with masks of active lanes:
+# an if runs both branches on the lanes that take them, a while loops until its
+# condition is false on every lane. values are plain int64, so whenever a lane would
+# overflow (unless the arithmetic wraps, see NodeInt64), read an unset variable or start from a non-int value, the engine gives up
+# with VectorFallback and the caller runs the inputs one by one instead.
+
+class VectorFallback(Exception):
+    '''
+    The inputs cannot be run as int64 vectors; run them with a scalar backend instead.
+    '''
+
+
+class LaneState:
+    '''
+    Variables of one vectorized run: a value vector and a "set" mask per name.
+    '''
+    def __init__(self, values: dict, defined: dict):
+        self.values = values
+        self.defined = defined
+        # names set on every lane, reading them needs no check (a lane never loses a variable)
+        self.everywhere = {name for name, present in defined.items() if present.all()}
+        self.budget = None
+
+
+class VectorizedProgram:
+    def __init__(self, ast: Node):
+        if np is None:
+            raise ImportError("the vectorized engine requires numpy")
+        self.ast = ast
+        self.unproven = analyze(ast).unproven # reads that may find their variable unset on some lane
+
+    def run_memories(self, memories: list, budget: Budget = None):
+        '''
+        Run the program on every memory dict of the list, updating them in place.
+        Raises VectorFallback, leaving every memory untouched, if the inputs cannot be vectorized.
+        With a budget, every vector loop iteration is charged to it. A lane never takes more
+        steps than the vector run, so when the budget runs out the inputs are handed back with
+        VectorFallback to find out which of them actually exceed it.
+        '''
+        lanes = len(memories)
+        if lanes == 0:
+            return
+        state = self._load(memories)
+        state.budget = budget
+        try:
+            self._command(self.ast, state, np.ones(lanes, dtype=bool))
+        except ExecutionLimitExceeded as e:
+            raise VectorFallback(f"vector run went over its budget: {e}")
+        self._store(memories, state)
+
+    def _load(self, memories: list) -> LaneState:
+        names = {} # used as an ordered set
+        for memory in memories:
+            names.update(dict.fromkeys(memory))
+        values = {}
+        defined = {}
+        for name in names:
+            column = [memory.get(name, 0) for memory in memories]
+            if not all(type(value) is int for value in column):
+                raise VectorFallback(f"some value of '{name}' is not an int")
+            try:
+                values[name] = np.array(column, dtype=np.int64)
+            except OverflowError:
+                raise VectorFallback(f"some value of '{name}' does not fit in int64")
+            defined[name] = np.fromiter((name in memory for memory in memories), dtype=bool, count=len(memories))
+        return LaneState(values, defined)
+
+    def _store(self, memories: list, state: LaneState):
+        for name, column in state.values.items():
+            column = column.tolist() # python ints
+            for lane in np.flatnonzero(state.defined[name]).tolist():
+                memories[lane][name] = column[lane]
+
+    # --- commands: run on the lanes selected by mask ---
+
+    def _command(self, node: Node, state: LaneState, mask):
+        if isinstance(node, SEQUENCE_NODES):
+            for command in sequence_commands(node):
+                self._command(command, state, mask)
+            return
+
+        if isinstance(node, NodeSkip):
+            return
+
+        if isinstance(node, NodeAssign):
+            value = self._expression(node.expr, state, mask)
+            name = node.var_name
+            if name not in state.values:
+                lanes = len(mask)
+                state.values[name] = np.zeros(lanes, dtype=np.int64)
+                state.defined[name] = np.zeros(lanes, dtype=bool)
+            np.copyto(state.values[name], value, where=mask)
+            if name not in state.everywhere:
+                state.defined[name] |= mask
+                if state.defined[name].all():
+                    state.everywhere.add(name)
+            return
+
+        if isinstance(node, NodeIf):
+            condition = self._expression(node.condition, state, mask)
+            then_mask = mask & condition
+            else_mask = mask & ~condition
+            if then_mask.any():
+                self._command(node.then_branch, state, then_mask)
+            if else_mask.any():
+                self._command(node.else_branch, state, else_mask)
+            return
+
+        if isinstance(node, NodeWhile):
+            # lanes leave the loop as their condition turns false, and never re-enter
+            budget = state.budget
+            while True:
+                mask = mask & self._expression(node.condition, state, mask)
+                if not mask.any():
+                    return
+                if budget is not None:
+                    budget.tick()
+                self._command(node.body, state, mask)
+
+        raise Exception(f"Vectorized engine error: unsupported node {type(node).__name__}")
+
+    # --- expressions: return a vector, only the lanes in mask are meaningful ---
+
+    def _expression(self, node: Node, state: LaneState, mask):
+        if isinstance(node, NodeIdentifier):
+            name = node.name
+            if node in self.unproven and name not in state.everywhere and \
+                    (name not in state.values or np.any(mask & ~state.defined[name])):
+                raise VectorFallback(f"variable '{name}' is not set on every lane")
+            return state.values[name]
+
+        if isinstance(node, NodeInteger):
+            if not INT64_MIN <= node.value <= INT64_MAX:
+                raise VectorFallback(f"constant {node.value} does not fit in int64")
+            return np.int64(node.value)
+
+        if isinstance(node, NodeBoolean):
+            return np.bool_(node.value)
+
+        if isinstance(node, NodeNot):
+            return ~self._expression(node.factor, state, mask)
+
+        if isinstance(node, NodeInt64):
+            expr = node.expr
+            if node.trap or not isinstance(expr, (NodePlus, NodeMinus, NodeMultiply)):
+                # an overflow falls back to the scalar run, which raises it
+                return self._expression(expr, state, mask)
+            # int64 vectors wrap around like the wrapped arithmetic
+            left = self._expression(expr.left, state, mask)
+            right = self._expression(expr.right, state, mask)
+            with np.errstate(all='ignore'):
+                if isinstance(expr, NodePlus):
+                    return left + right
+                if isinstance(expr, NodeMinus):
+                    return left - right
+                return left * right
+
+        left = self._expression(node.left, state, mask)
+        right = self._expression(node.right, state, mask)
+        if isinstance(node, NodeAnd):
+            return left & right
+        if isinstance(node, NodeOr):
+            return left | right
+        if isinstance(node, NodeLessEqual):
+            return left <= right
+        if isinstance(node, NodeEqual):
+            return left == right
+
+        with np.errstate(all='ignore'):
+            if isinstance(node, NodePlus):
+                result = left + right
+                overflow = ((left ^ result) & (right ^ result)) < 0
+            elif isinstance(node, NodeMinus):
+                result = left - right
+                overflow = ((left ^ right) & (left ^ result)) < 0
+            elif isinstance(node, NodeMultiply):
+                result = left * right
+                # exact check: the product overflowed iff dividing it back does not give the operand
+                divisor = np.where(left == 0, 1, left)
+                overflow = ((left != 0) & (result // divisor != right)) | ((left == -1) & (right == INT64_MIN))
+            else:
+                raise Exception(f"Vectorized engine error: unsupported node {type(node).__name__}")
+        if np.any(overflow & mask):
+            raise VectorFallback(f"int64 overflow in {node}")
+        return result
@@ -0,0 +1,427 @@
+from array import array
+import json
+import struct
+import sys
+
+from nodes import *
+from resolver import UNSET, SlotTable, resolve_slots
+from analysis import analyze
+from closed_form import AffineLoop
+from limits import Budget, ExecutionLimitExceeded
+
+# the vm runs programs compiled to a flat, array-backed bytecode.
+# every instruction is 4 ints wide: opcode, a, b, c. operands index a register file
+# that holds the program variables first, then the constants, then expression temporaries,
+# so an assignment like s := (s + i) is a single ADD instruction.
+
+# opcodes
+HALT          = 0
+MOVE          = 1   # r[a] = r[b]
+ADD           = 2   # r[a] = r[b] + r[c]
+SUB           = 3   # r[a] = r[b] - r[c]
+MUL           = 4   # r[a] = r[b] * r[c]
+LE            = 5   # r[a] = r[b] <= r[c]
+EQ            = 6   # r[a] = r[b] == r[c]
+NOT           = 7   # r[a] = not r[b]
+JUMP          = 8   # pc = a
+JUMP_IF_FALSE = 9   # if not r[a]: pc = b
+JUMP_IF_TRUE  = 10  # if r[a]: pc = b
+CHECK         = 11  # raise if the variable r[a] is unset
+AFFINE        = 12  # if loops[a] runs in closed form: pc = b
+WRAP          = 13  # r[a] = r[b] wrapped around to 64 bits
+TRAP          = 14  # raise if r[a] does not fit in 64 bits
+
+OPCODE_NAMES = {
+    HALT: 'HALT', MOVE: 'MOVE', ADD: 'ADD', SUB: 'SUB', MUL: 'MUL', LE: 'LE', EQ: 'EQ',
+    NOT: 'NOT', JUMP: 'JUMP', JUMP_IF_FALSE: 'JUMP_IF_FALSE', JUMP_IF_TRUE: 'JUMP_IF_TRUE',
+    CHECK: 'CHECK', AFFINE: 'AFFINE', WRAP: 'WRAP', TRAP: 'TRAP',
+}
+
+INSTRUCTION_WIDTH = 4
+
+# serialized form: magic, header length, json header, code bytes, checked code bytes
+MAGIC = b'IMPVM\x02'
+
+
+class BytecodeProgram:
+    def __init__(self, code: array, slot_table: SlotTable, constants: list, num_temps: int,
+                 checked_code: array = None, input_slots: list = (), loops: list = ()):
+        self.code = code              # array('i') of instructions
+        self.slot_table = slot_table  # the variable registers are the slots of the table
+        self.names = slot_table.names
+        self.constants = constants    # values of the constant registers
+        self.num_temps = num_temps    # number of temporary registers
+        # the same program with a CHECK before every read that may find its variable unset,
+        # run instead of code when the memory does not set every input slot
+        self.checked_code = checked_code
+        self.input_slots = input_slots
+        # runners of the loops computed in closed form (see closed_form), called by AFFINE
+        self.loops = loops
+
+    def __call__(self, memory: dict):
+        self.execute(memory)
+
+    def execute(self, memory: dict, budget: Budget = None):
+        '''
+        Run the program on the memory dict, which is updated in place.
+        With a budget, every backward jump (one before each loop iteration) is charged to it.
+        '''
+        regs = self.slot_table.load(memory)
+        regs.extend(self.constants)
+        regs.extend([None] * self.num_temps)
+        code = self.code
+        for slot in self.input_slots:
+            if regs[slot] is UNSET:
+                code = self.checked_code
+                break
+        try:
+            self._dispatch(regs, budget, code)
+        except ExecutionLimitExceeded as e:
+            self.slot_table.store(regs, memory)
+            e.memory = memory
+            raise
+        self.slot_table.store(regs, memory)
+
+    def _dispatch(self, regs: list, budget: Budget = None, code: array = None):
+        code = (self.code if code is None else code).tolist() # list indexing is cheaper than array indexing
+        _MOVE, _ADD, _SUB, _MUL, _LE, _EQ, _NOT = MOVE, ADD, SUB, MUL, LE, EQ, NOT
+        _JUMP, _JUMP_IF_FALSE, _JUMP_IF_TRUE, _CHECK, _AFFINE, _HALT = JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE, CHECK, AFFINE, HALT
+        _WRAP, _TRAP, _MIN, _MAX = WRAP, TRAP, INT64_MIN, INT64_MAX
+        loops = self.loops
+        pc = 0
+        while True:
+            op = code[pc]
+            a = code[pc + 1]
+            b = code[pc + 2]
+            c = code[pc + 3]
+            pc += 4
+            # ordered by how often the opcodes run in typical loops
+            if op == _ADD:
+                regs[a] = regs[b] + regs[c]
+            elif op == _JUMP_IF_TRUE:
+                if regs[a]:
+                    if budget is not None and b < pc: # loop back-edge
+                        budget.remaining -= 1
+                        if budget.remaining < 0:
+                            budget.check()
+                    pc = b
+            elif op == _LE:
+                regs[a] = regs[b] <= regs[c]
+            elif op == _JUMP_IF_FALSE:
+                if not regs[a]:
+                    pc = b
+            elif op == _JUMP:
+                pc = a
+            elif op == _SUB:
+                regs[a] = regs[b] - regs[c]
+            elif op == _MUL:
+                regs[a] = regs[b] * regs[c]
+            elif op == _EQ:
+                regs[a] = regs[b] == regs[c]
+            elif op == _MOVE:
+                regs[a] = regs[b]
+            elif op == _NOT:
+                regs[a] = not regs[b]
+            elif op == _WRAP:
+                value = regs[b]
+                regs[a] = value if _MIN <= value <= _MAX else wrap_int64(value)
+            elif op == _TRAP:
+                if not _MIN <= regs[a] <= _MAX:
+                    raise int64_overflow(regs[a])
+            elif op == _CHECK:
+                if regs[a] is UNSET:
+                    raise undefined_variable(self.names[a])
+            elif op == _AFFINE:
+                if loops[a](regs, budget):
+                    pc = b
+            elif op == _HALT:
+                return
+            else:
+                raise Exception(f"VM error: unknown opcode {op} at {pc - 4}")
+
+    def disassemble(self, checked: bool = False) -> str:
+        '''
+        Return a human readable listing of the bytecode (of checked_code with checked).
+        '''
+        def register(r):
+            if r < len(self.names):
+                return self.names[r]
+            if r < len(self.names) + len(self.constants):
+                return repr(self.constants[r - len(self.names)])
+            return f"t{r - len(self.names) - len(self.constants)}"
+
+        lines = []
+        code = self.checked_code if checked else self.code
+        for pc in range(0, len(code), INSTRUCTION_WIDTH):
+            op, a, b, c = code[pc:pc + INSTRUCTION_WIDTH]
+            if op == HALT:
+                args = ''
+            elif op == JUMP:
+                args = f"{a}"
+            elif op in (CHECK, TRAP):
+                args = f"{register(a)}"
+            elif op in (JUMP_IF_FALSE, JUMP_IF_TRUE):
+                args = f"{register(a)}, {b}"
+            elif op == AFFINE:
+                args = f"{a}, {b}"
+            elif op in (MOVE, NOT, WRAP):
+                args = f"{register(a)}, {register(b)}"
+            else:
+                args = f"{register(a)}, {register(b)}, {register(c)}"
+            lines.append(f"{pc:6d}  {OPCODE_NAMES.get(op, op):<14}{args}")
+        return "\n".join(lines)
+
+    def to_bytes(self) -> bytes:
+        '''
+        Serialize the program. Integers are unbounded, so constants are stored as text.
+        The closed-form loops are not serialized: their AFFINE instructions become jumps to
+        the next instruction, so the loaded program iterates them.
+        '''
+        header = json.dumps({
+            'names': self.names,
+            'constants': [[type(value).__name__, str(value)] for value in self.constants],
+            'num_temps': self.num_temps,
+            'code_length': len(self.code),
+            'input_slots': list(self.input_slots),
+            'byteorder': sys.byteorder,
+        }).encode('utf-8')
+        checked_code = b'' if self.checked_code is None else _without_loops(self.checked_code).tobytes()
+        return MAGIC + struct.pack('<I', len(header)) + header + _without_loops(self.code).tobytes() + checked_code
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        '''
+        Load a program serialized with to_bytes.
+        '''
+        if not data.startswith(MAGIC):
+            raise ValueError("VM error: not a serialized IMP bytecode program")
+        offset = len(MAGIC)
+        (header_length,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        header = json.loads(data[offset:offset + header_length].decode('utf-8'))
+        offset += header_length
+
+        code = array('i')
+        code.frombytes(data[offset:])
+        if header['byteorder'] != sys.byteorder:
+            code.byteswap()
+        checked_code = code[header['code_length']:] or None
+        del code[header['code_length']:]
+        constants = [
+            (value == 'True') if kind == 'bool' else int(value)
+            for kind, value in header['constants']
+        ]
+        return cls(code, SlotTable(header['names']), constants, header['num_temps'], checked_code, header['input_slots'])
+
+
+def _without_loops(code: array) -> array:
+    # the code with every AFFINE instruction replaced by a jump to the next one
+    if AFFINE not in code[::INSTRUCTION_WIDTH]:
+        return code
+    code = array('i', code)
+    for pc in range(0, len(code), INSTRUCTION_WIDTH):
+        if code[pc] == AFFINE:
+            code[pc:pc + INSTRUCTION_WIDTH] = array('i', (JUMP, pc + INSTRUCTION_WIDTH, 0, 0))
+    return code
+
+
+class BytecodeCompiler:
+    def __init__(self, checked: set = None):
+        self.checked = checked or set() # identifier nodes whose read is preceded by a CHECK
+        self.code = array('i')
+        self.loops = []         # runners of the closed-form loops
+        self.slot_table = None  # variable registers, resolved before compiling
+        self.constants = []     # constant registers, deduplicated
+        self.constant_slots = {}
+        self.temps = 0          # temporaries currently in use
+        self.max_temps = 0
+        # temporaries and constants are numbered separately while compiling and
+        # relocated after the register file layout is known
+        self.temp_operands = [] # code indices that hold a temporary register
+        self.const_operands = [] # code indices that hold a constant register
+
+    def compile(self, ast: Node) -> BytecodeProgram:
+        self.slot_table = resolve_slots(ast)
+        self._command(ast)
+        self._emit(HALT)
+
+        num_vars = len(self.slot_table)
+        num_consts = len(self.constants)
+        for index in self.const_operands:
+            self.code[index] += num_vars
+        for index in self.temp_operands:
+            self.code[index] += num_vars + num_consts
+        return BytecodeProgram(self.code, self.slot_table, self.constants, self.max_temps, loops=self.loops)
+
+    # --- emitting ---
+
+    def _emit(self, op, a=0, b=0, c=0) -> int:
+        # operands are (kind, index) pairs for registers, plain ints otherwise
+        pc = len(self.code)
+        self.code.append(op)
+        for position, operand in enumerate((a, b, c), start=1):
+            if isinstance(operand, tuple):
+                kind, operand = operand
+                if kind == 'const':
+                    self.const_operands.append(pc + position)
+                elif kind == 'temp':
+                    self.temp_operands.append(pc + position)
+            self.code.append(operand)
+        return pc
+
+    def _patch(self, index: int, target: int):
+        self.code[index] = target
+
+    def _here(self) -> int:
+        return len(self.code)
+
+    # --- registers ---
+
+    def _variable(self, name: str):
+        return ('var', self.slot_table.slot(name))
+
+    def _constant(self, value):
+        key = (type(value), value) # keep True and 1 apart
+        if key not in self.constant_slots:
+            self.constant_slots[key] = len(self.constants)
+            self.constants.append(value)
+        return ('const', self.constant_slots[key])
+
+    def _new_temp(self):
+        temp = ('temp', self.temps)
+        self.temps += 1
+        self.max_temps = max(self.max_temps, self.temps)
+        return temp
+
+    # --- expressions ---
+
+    BINARY_OPCODES = {
+        NodePlus: ADD, NodeMinus: SUB, NodeMultiply: MUL,
+        NodeLessEqual: LE, NodeEqual: EQ,
+    }
+
+    def _expression(self, node: Node, target=None):
+        '''
+        Compile an expression and return the register holding its value.
+        If target is given, operators write their result there directly.
+        '''
+        if isinstance(node, NodeIdentifier):
+            register = self._variable(node.name)
+            if node in self.checked:
+                self._emit(CHECK, register)
+            return register
+        if isinstance(node, (NodeInteger, NodeBoolean)):
+            return self._constant(node.value)
+
+        opcode = self.BINARY_OPCODES.get(type(node))
+        if opcode is not None:
+            saved = self.temps
+            left = self._expression(node.left)
+            right = self._expression(node.right)
+            self.temps = saved # operands are read before the result is written
+            dst = target if target is not None else self._new_temp()
+            self._emit(opcode, dst, left, right)
+            return dst
+
+        if isinstance(node, NodeNot):
+            saved = self.temps
+            factor = self._expression(node.factor)
+            self.temps = saved
+            dst = target if target is not None else self._new_temp()
+            self._emit(NOT, dst, factor)
+            return dst
+
+        if isinstance(node, NodeInt64):
+            if node.trap:
+                # checked in a temp, the target never holds a value out of range
+                result = self._expression(node.expr)
+                self._emit(TRAP, result)
+                return result
+            result = self._expression(node.expr, target)
+            # a result computed for this expression is wrapped in place
+            if result == target or result[0] == 'temp':
+                dst = result
+            else:
+                dst = target if target is not None else self._new_temp()
+            self._emit(WRAP, dst, result)
+            return dst
+
+        if isinstance(node, (NodeAnd, NodeOr)):
+            # short circuit like python: the result is the left value if it decides the outcome
+            saved = self.temps
+            dst = target if target is not None else self._new_temp()
+            self._expression_into(node.left, dst)
+            jump = self._emit(JUMP_IF_FALSE if isinstance(node, NodeAnd) else JUMP_IF_TRUE, dst, 0)
+            self._expression_into(node.right, dst)
+            self._patch(jump + 2, self._here())
+            self.temps = saved + (1 if target is None else 0)
+            return dst
+
+        raise Exception(f"VM compiler error: unsupported node {type(node).__name__}")
+
+    def _expression_into(self, node: Node, dst):
+        result = self._expression(node, dst)
+        if result != dst:
+            self._emit(MOVE, dst, result)
+
+    # --- commands ---
+
+    def _command(self, node: Node):
+        if isinstance(node, SEQUENCE_NODES):
+            for command in sequence_commands(node):
+                self._command(command)
+            return
+
+        if isinstance(node, NodeSkip):
+            return
+
+        if isinstance(node, NodeAssign):
+            target = self._variable(node.var_name)
+            self._expression_into(node.expr, target)
+            return
+
+        if isinstance(node, NodeIf):
+            condition = self._expression(node.condition)
+            self.temps = 0
+            jump_else = self._emit(JUMP_IF_FALSE, condition, 0)
+            self._command(node.then_branch)
+            jump_end = self._emit(JUMP, 0)
+            self._patch(jump_else + 2, self._here())
+            self._command(node.else_branch)
+            self._patch(jump_end + 1, self._here())
+            return
+
+        if isinstance(node, AffineLoop):
+            # AFFINE skips the loop when it runs in closed form
+            jump_end = self._emit(AFFINE, len(self.loops), 0)
+            self.loops.append(node.frame_runner(self.slot_table))
+            self._command(NodeWhile(node.condition, node.body))
+            self._patch(jump_end + 2, self._here())
+            return
+
+        if isinstance(node, NodeWhile):
+            # the condition is placed after the body, so an iteration takes a single jump:
+            # JUMP cond; body: ...; cond: ...; JUMP_IF_TRUE body
+            jump_condition = self._emit(JUMP, 0)
+            body = self._here()
+            self._command(node.body)
+            self._patch(jump_condition + 1, self._here())
+            condition = self._expression(node.condition)
+            self.temps = 0
+            self._emit(JUMP_IF_TRUE, condition, body)
+            return
+
+        raise Exception(f"VM compiler error: unsupported node {type(node).__name__}")
+
+
+def compile_ast(ast: Node) -> BytecodeProgram:
+    '''
+    Compile an AST produced by Parser.parse into a bytecode program.
+    If the program may read an unset variable, it also gets the checked version of its code.
+    '''
+    dataflow = analyze(ast)
+    program = BytecodeCompiler().compile(ast)
+    if dataflow.inputs:
+        program.checked_code = BytecodeCompiler(dataflow.unproven).compile(ast).code
+        program.input_slots = [program.slot_table.slot(name) for name in sorted(dataflow.inputs)]
+    return program